@@ -0,0 +1,195 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+
+import metocean.queries as moq
+import termindex
+
+
+# format: [(Value form field, the vocabulary graph of its choices), ...]
+VOCABULARIES = {
+    'um': [('name', 'http://um/umdpF3.ttl'),
+           ('stash_code', 'http://um/stashconcepts.ttl'),
+           ('field_code', 'http://um/fieldcode.ttl')],
+    'cf': [('name', 'http://CF/cfmodel.ttl'),
+           ('standard_name', 'http://CF/cf-standard-name-table.ttl'),
+           ('cf model', 'http://CF/cfmodel.ttl')],
+    'grib': [('name', 'http://grib/apikeys.ttl')],
+    }
+
+# vocabularies of more terms than this are offered by a search as the
+# editor types, rather than as a list of choices
+TYPEAHEAD_SIZE = 200
+
+
+class ChoiceProvider(object):
+    """
+    The choices for a form field, read from the triple store when they
+    are first asked for rather than when the form is defined, and then
+    reused by every form in the process for ttl seconds.
+
+    Args:
+
+    * query:
+        a function of a fuseki_process, and of any arguments given to
+        choices, returning the list of (value, label) choices
+    * ttl:
+        the number of seconds for which the choices are reused before
+        they are read again
+
+    """
+    def __init__(self, query, ttl=300):
+        self.query = query
+        self.ttl = ttl
+        # args: (time read, choices)
+        self._choices = {}
+        self._lock = threading.Lock()
+
+    def choices(self, fuseki_process, *args):
+        """
+        returns a new list of the choices for the args, read from the
+        fuseki_process if they are not held or have expired
+
+        """
+        with self._lock:
+            read, choices = self._choices.get(args, (None, None))
+        if read is None or time.time() - read > self.ttl:
+            read = time.time()
+            choices = list(self.query(fuseki_process, *args))
+            with self._lock:
+                self._choices[args] = (read, choices)
+        return list(choices)
+
+    def clear(self):
+        """discard the choices held, so they are read when next used"""
+        with self._lock:
+            self._choices.clear()
+
+
+class VocabularyProvider(object):
+    """
+    The subjects of vocabulary graphs, each with its notation, read from
+    the triple store the first time a graph is asked for and then shared
+    by every form in the process until the data is next loaded, as
+    vocabularies only change on load.
+
+    A TermIndex of a graph is built the first time it is searched.
+
+    """
+    def __init__(self):
+        self._generation = None
+        # graph: (the list of (subject, notation, prefLabel),
+        #         the set of subjects)
+        self._vocabularies = {}
+        # graph: TermIndex
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _vocabulary(self, fuseki_process, graph):
+        """
+        helper method
+        returns the list of (subject, notation, prefLabel) and the set of
+        subjects of the graph, reading them if they are not held for the
+        current generation of the fuseki_process
+
+        """
+        generation = fuseki_process.generation()
+        with self._lock:
+            if generation != self._generation:
+                self._vocabularies = {}
+                self._indexes = {}
+                self._generation = generation
+            vocabulary = self._vocabularies.get(graph)
+        if vocabulary is None:
+            terms = [(res['subject'], res['notation'],
+                      res.get('prefLabel', '')) for res in
+                     moq.subject_and_plabel(fuseki_process, graph,
+                                            stream=True)]
+            vocabulary = (terms, frozenset([term[0] for term in terms]))
+            with self._lock:
+                if generation == self._generation:
+                    self._vocabularies[graph] = vocabulary
+        return vocabulary
+
+    def choices(self, fuseki_process, graph):
+        """
+        returns a new list of the (subject, notation) choices for the
+        subjects of a graph, after a blank choice
+
+        """
+        terms, subjects = self._vocabulary(fuseki_process, graph)
+        return [('', '')] + [(subj, nota) for subj, nota, label in terms]
+
+    def size(self, fuseki_process, graph):
+        """returns the number of subjects of a graph"""
+        terms, subjects = self._vocabulary(fuseki_process, graph)
+        return len(terms)
+
+    def searched(self, fuseki_process, field, graph):
+        """
+        returns whether a Value form field is offered by a search as
+        the editor types, rather than as a list of choices: the name is
+        always a list, other fields are searched once their vocabulary
+        graph has more than TYPEAHEAD_SIZE subjects
+
+        """
+        return (field != 'name' and
+                self.size(fuseki_process, graph) > TYPEAHEAD_SIZE)
+
+    def declares(self, fuseki_process, graph, subject):
+        """returns whether the subject, '<http://...>', is in a graph"""
+        terms, subjects = self._vocabulary(fuseki_process, graph)
+        return subject in subjects
+
+    def search(self, fuseki_process, graph, text, limit=20):
+        """
+        returns the list of up to limit (subject, notation, prefLabel)
+        terms of a graph whose notation or prefLabel starts with, or
+        else contains, the text, ignoring case (see TermIndex.search)
+
+        """
+        generation = fuseki_process.generation()
+        terms, subjects = self._vocabulary(fuseki_process, graph)
+        with self._lock:
+            index = self._indexes.get(graph)
+        if index is None:
+            index = termindex.TermIndex(terms)
+            with self._lock:
+                if generation == self._generation:
+                    self._indexes[graph] = index
+        return index.search(text, limit)
+
+def _contacts(fuseki_process, register):
+    """returns the choices of the contacts in a register"""
+    return [(r['s'], r['prefLabel'].split('/')[-1]) for r in
+            moq.get_contacts(fuseki_process, register)]
+
+def _mediators(fuseki_process, fformat):
+    """returns the choices of the mediators for a format"""
+    meds = moq.get_mediators(fuseki_process, fformat)
+    if isinstance(meds, list):
+        meds = [(med['mediator'], med['label']) for med in meds]
+    else:
+        meds = [(meds['mediator'], meds['label'])]
+    return meds
+
+
+contacts = ChoiceProvider(_contacts)
+mediators = ChoiceProvider(_mediators)
+vocabularies = VocabularyProvider()
@@ -0,0 +1,224 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+# the number of hexadecimal characters of the state hash used as a draft id
+ID_LENGTH = 16
+
+# the operations an edit may apply to a draft
+_EDITS = ('append', 'remove', 'set')
+
+# the least number of seconds between removals of expired draft files
+SWEEP_INTERVAL = 3600
+
+
+class DraftStore(object):
+    """
+    A store of the in-progress states of mappings being edited, so that
+    the editor views pass a short draft id between them rather than the
+    whole json state.
+
+    Drafts are named from the hash of their json content, as records
+    are, so storing the same state twice gives the same id, and a draft
+    is never changed once stored: editing a draft stores a new one, so
+    the browser's back button returns to the earlier state.
+
+    Drafts are held in memory, at most size of them, the least recently
+    used being discarded first. If a path is given each draft is also
+    written to a json file in that directory, so drafts outlive the
+    process and may be shared by several editor processes; a draft file
+    not used for age seconds is removed.
+
+    Args:
+
+    * path:
+        a directory in which to keep the drafts, or None to keep them
+        in memory only
+    * size:
+        the maximum number of drafts held in memory
+    * age:
+        the number of seconds for which an unused draft file is kept
+
+    """
+    def __init__(self, path=None, size=10000, age=7 * 24 * 3600):
+        self.path = path
+        self.size = size
+        self.age = age
+        self._drafts = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._swept = 0
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+
+    def __contains__(self, draft_id):
+        return self._read(draft_id) is not None
+
+    def create(self, state):
+        """store the state of a mapping, returning its draft id"""
+        content = json.dumps(state, sort_keys=True, separators=(',', ':'))
+        draft_id = hashlib.sha1(content).hexdigest()[:ID_LENGTH]
+        self._remember(draft_id, content)
+        if self.path is not None:
+            draft_file = self._file(draft_id)
+            if not self._touch(draft_id):
+                partial = '{}.{}'.format(draft_file, os.getpid())
+                with open(partial, 'w') as out:
+                    out.write(content)
+                os.rename(partial, draft_file)
+            self._sweep()
+        return draft_id
+
+    def get(self, draft_id):
+        """
+        returns a new copy of the state stored as draft_id, which may be
+        changed without changing the draft;
+        raises a KeyError if there is no such draft
+
+        """
+        content = self._read(draft_id)
+        if content is None:
+            raise KeyError('no draft {}'.format(draft_id))
+        return json.loads(content)
+
+    def _read(self, draft_id):
+        """
+        helper method
+        returns the json content of a draft, or None
+
+        """
+        if not re.match('^[0-9a-f]{%i}$' % ID_LENGTH, draft_id):
+            return None
+        with self._lock:
+            content = self._drafts.pop(draft_id, None)
+            if content is not None:
+                self._drafts[draft_id] = content
+        if self.path is not None and self._touch(draft_id) and \
+           content is None:
+            with open(self._file(draft_id)) as draft_file:
+                content = draft_file.read()
+            self._remember(draft_id, content)
+        return content
+
+    def _touch(self, draft_id):
+        """
+        helper method
+        mark the file of a draft as used now, returning False if there
+        is no such file
+
+        """
+        try:
+            os.utime(self._file(draft_id), None)
+        except OSError:
+            return False
+        return True
+
+    def _sweep(self):
+        """
+        helper method
+        remove the draft files which have not been used for age seconds,
+        at most once every SWEEP_INTERVAL seconds
+
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._swept < SWEEP_INTERVAL:
+                return
+            self._swept = now
+        for name in os.listdir(self.path):
+            draft_file = os.path.join(self.path, name)
+            try:
+                if now - os.path.getmtime(draft_file) > self.age:
+                    os.remove(draft_file)
+            except OSError:
+                # removed by another process
+                pass
+
+    def _remember(self, draft_id, content):
+        """
+        helper method
+        hold the json content of a draft in memory
+
+        """
+        with self._lock:
+            self._drafts.pop(draft_id, None)
+            self._drafts[draft_id] = content
+            while len(self._drafts) > self.size:
+                self._drafts.popitem(last=False)
+
+    def _file(self, draft_id):
+        """helper method returns the path of the file for a draft"""
+        return os.path.join(self.path, '{}.json'.format(draft_id))
+
+
+def edit_string(operation, path, value=None):
+    """
+    returns the compact json string of an edit to a mapping state,
+    for use in a url, to be applied by apply_edit
+
+    Args:
+
+    * operation:
+        'append' the value to the list at the path, creating the list
+        if there is none; 'remove' the element at the path; or 'set'
+        the element at the path to the value
+    * path:
+        the list of the keys and indices from the top of the mapping
+        state to the element, e.g. ['mr:source', 'mr:hasProperty', 2]
+
+    """
+    if operation not in _EDITS:
+        raise ValueError('{} is not an edit operation'.format(operation))
+    edit = [operation, path]
+    if value is not None:
+        edit.append(value)
+    return json.dumps(edit, separators=(',', ':'))
+
+def apply_edit(state, edit):
+    """
+    apply the edit, a string from edit_string, to the mapping state,
+    in place, returning the state
+
+    """
+    try:
+        edit = json.loads(edit)
+        operation, path = edit[:2]
+        value = edit[2] if len(edit) > 2 else None
+        parent = state
+        for step in path[:-1]:
+            parent = parent[step]
+        last = path[-1]
+        if operation == 'append':
+            if not parent.get(last):
+                parent[last] = []
+            parent[last].append(value)
+        elif operation == 'remove':
+            del parent[last]
+        elif operation == 'set':
+            parent[last] = value
+        else:
+            raise ValueError('{} is not an edit operation'.format(operation))
+    except (KeyError, IndexError, TypeError, AttributeError):
+        raise ValueError('the edit {} does not fit this mapping'.format(edit))
+    return state
@@ -18,6 +18,7 @@
 
 import datetime
 import json
+import re
 from string import Template
 import sys
 import time
@@ -29,11 +30,15 @@ from django.utils import formats
 from django.utils.safestring import mark_safe
 
 
+import choices
 import metocean.prefixes as prefixes
 import metocean.queries as moq
 from settings import READ_ONLY
 from settings import fuseki_process
 
+# a vocabulary term: its URI, in angle brackets
+_TERM = re.compile(r'^<https?://[^<>"\s]+>$')
+
 def get_states():
     """
     Helper method to return valid states.
@@ -80,6 +85,47 @@ def formats():
                ('<http://www.metarelate.net/metOcean/format/cf>', 'CF')]
     return choices
 
+class VocabularyInput(forms.TextInput):
+    """
+    a text input which suggests the terms of a vocabulary starting with
+    the text typed, from the vocabulary search at url
+    
+    """
+    def __init__(self, url, attrs=None):
+        super(VocabularyInput, self).__init__(attrs)
+        self.url = url
+
+    def render(self, name, value, attrs=None):
+        list_id = 'vocabulary_{}'.format(name.replace(' ', '_'))
+        attrs = dict(attrs or {})
+        attrs.update({'list':list_id, 'data-vocabulary':self.url,
+                      'autocomplete':'off'})
+        text = super(VocabularyInput, self).render(name, value, attrs)
+        return mark_safe(u'{}<datalist id="{}"></datalist>'.format(text,
+                                                                 list_id))
+
+
+class VocabularyField(forms.CharField):
+    """
+    a free text field for a term of a vocabulary too large to list,
+    suggested from the vocabulary search at url as the editor types;
+    the value is the URI of the term, <http://...>
+    
+    """
+    def __init__(self, url, *args, **kwargs):
+        kwargs.setdefault('widget', VocabularyInput(url))
+        super(VocabularyField, self).__init__(*args, **kwargs)
+
+    def clean(self, value):
+        value = super(VocabularyField, self).clean(value).strip()
+        if value.startswith('http'):
+            value = '<{}>'.format(value)
+        if value and not _TERM.match(value):
+            raise forms.ValidationError('{} is not the URI of a vocabulary '
+                                        'term, <http://...>'.format(value))
+        return value
+
+
 class MappingFormats(forms.Form):
     """
     form to define the file format of the source and target
@@ -106,11 +152,7 @@ class Mediator(forms.Form):
     def __init__(self, *args, **kwargs):
         fformat = kwargs.pop('fformat')
         super(Mediator, self).__init__(*args, **kwargs)
-        meds = moq.get_mediators(fuseki_process, fformat)
-        if isinstance(meds, list):
-            meds = [(med['mediator'], med['label']) for med in meds]
-        else:
-            meds = [(meds['mediator'], meds['label'])]
+        meds = choices.mediators.choices(fuseki_process, fformat)
         #meds = [('<http://www.metarelate.net/metocean/mediates/cf/calendar>',
         #         'calendar')]
         self.fields['mediator'].choices = meds
@@ -145,60 +187,32 @@ class Value(forms.Form):
     name = forms.ChoiceField(required=False)
     _name = forms.CharField(required=False)
     value = forms.CharField(required=False)
-    operator = forms.CharField(required=False)
-    ops = moq.subject_and_plabel(fuseki_process, 'http://openmath/tests.ttl')
-    ops = [(op['subject'], op['notation']) for op in ops]
-    ops = [('','')] + ops
-    operator = forms.ChoiceField(required=False, choices=ops)
+    operator = forms.ChoiceField(required=False)
     
     def __init__(self, *args, **kwargs):
         self.fformat = kwargs.pop('fformat')
         super(Value, self).__init__(*args, **kwargs)
-        if self.fformat == 'um':
-            umRes = moq.subject_and_plabel(fuseki_process,
-                                         'http://um/umdpF3.ttl')
-            choices = [(um['subject'], um['notation']) for um in umRes]
-            choices = [('','')] + choices
-            self.fields['name'].choices = choices
-            sns = moq.subject_and_plabel(fuseki_process,
-                                         'http://um/stashconcepts.ttl')
-            sn_choices = [('','')]
-            sn_choices += [(um['subject'], um['notation']) for um in sns]
-            self.fields['stash_code'] = forms.ChoiceField(required=False,
-                                                          choices=sn_choices)
-            fcs = moq.subject_and_plabel(fuseki_process,
-                                         'http://um/fieldcode.ttl')
-            fc_choices = [('','')]
-            fc_choices += [(um['subject'], um['notation']) for um in fcs]
-            self.fields['field_code'] = forms.ChoiceField(required=False,
-                                                          choices=fc_choices)
-        elif self.fformat == 'cf':
-            cfRes = moq.subject_and_plabel(fuseki_process,
-                                         'http://CF/cfmodel.ttl')
-            choices = [(cf['subject'], cf['notation']) for cf in cfRes]
-            choices = [('','')] + choices
-            self.fields['name'].choices = choices
-            sns = moq.subject_and_plabel(fuseki_process,
-                                         'http://CF/cf-standard-name-table.ttl')
-            sn_choices = [('','')]
-            sn_choices += [(sn['subject'], sn['notation']) for sn in sns]
-            self.fields['standard_name'] = forms.ChoiceField(required=False,
-                                                             choices=sn_choices)
-            mod = moq.subject_and_plabel(fuseki_process,
-                                         'http://CF/cfmodel.ttl')
-            md_choices = [('','')]
-            md_choices += [(mo['subject'], mo['notation']) for mo in mod]
-            print md_choices
-            self.fields['cf model'] = forms.ChoiceField(required=False,
-                                                        choices=md_choices)
-        elif self.fformat == 'grib':
-            grRes = moq.subject_and_plabel(fuseki_process,
-                                           'http://grib/apikeys.ttl')
-            choices = [(grib['subject'], grib['notation']) for grib in grRes]
-            choices = [('','')] + choices
-            self.fields['name'].choices = choices
-        else:
+        ops = choices.vocabularies.choices(fuseki_process,
+                                           'http://openmath/tests.ttl')
+        self.fields['operator'].choices = ops
+        if not choices.VOCABULARIES.has_key(self.fformat):
             raise ValueError('invalid format supplied: {}'.format(self.fformat))
+        # the typeahead fields, and their vocabulary graphs
+        self.typeahead = {}
+        for field, graph in choices.VOCABULARIES[self.fformat]:
+            if choices.vocabularies.searched(fuseki_process, field, graph):
+                url = reverse('vocabulary_search',
+                              kwargs={'fformat':self.fformat})
+                url += '?' + urllib.urlencode({'field':field})
+                self.fields[field] = VocabularyField(url, required=False)
+                self.typeahead[field] = graph
+                continue
+            vocab = choices.vocabularies.choices(fuseki_process, graph)
+            if field == 'name':
+                self.fields['name'].choices = vocab
+            else:
+                self.fields[field] = forms.ChoiceField(required=False,
+                                                       choices=vocab)
     def clean(self):
         name = self.cleaned_data.get('name')
         _name = self.cleaned_data.get('_name')
@@ -208,6 +222,12 @@ class Value(forms.Form):
         st_name = self.cleaned_data.get('standard_name')
         cfmodel = self.cleaned_data.get('cf model')
         op = self.cleaned_data.get('operator')
+        for field, graph in self.typeahead.iteritems():
+            term = self.cleaned_data.get(field)
+            if term and not choices.vocabularies.declares(fuseki_process,
+                                                          graph, term):
+                raise forms.ValidationError('{} is not a known '
+                                            '{}'.format(term, field))
         if name and _name:
             # only one of name and _name may be used in a valid form entry
             raise forms.ValidationError('Name, name are mutually exclusive')
@@ -318,10 +338,7 @@ class DerivedValue(forms.Form):
     using the available values
     
     """        
-    ops = moq.subject_and_plabel(fuseki_process, 'http://openmath/ops.ttl')
-    #print ops
-    ops = [('','')] + [(op['subject'], op['notation']) for op in ops]
-    _operator = forms.ChoiceField(choices=ops)
+    _operator = forms.ChoiceField()
     _subject = forms.ChoiceField()
     _object = forms.ChoiceField(required=False)
     _object_literal = forms.CharField(required=False)
@@ -329,6 +346,9 @@ class DerivedValue(forms.Form):
         comp_vals = kwargs.pop('components')
         components = _unpack_values(comp_vals)
         super(DerivedValue, self).__init__(*args, **kwargs)
+        ops = choices.vocabularies.choices(fuseki_process,
+                                           'http://openmath/ops.ttl')
+        self.fields['_operator'].choices = ops
         # components = [json.loads(component) for component in components]
         # components = [(json.dumps(component),component['mr:subject']['mr:hasProperty']['mr:name']) for
         #        component in components]
@@ -370,9 +390,7 @@ class MappingMeta(forms.Form):
     last_editor = forms.CharField(max_length=50, required=False,
                                   widget=forms.TextInput(
                                       attrs={'readonly':True}))
-    editor = forms.ChoiceField([(r['s'],r['prefLabel'].split('/')[-1]) for
-                                r in moq.get_contacts(fuseki_process, 'people')]
-                                , required=False)
+    editor = forms.ChoiceField(required=False)
 #    editor = forms.ChoiceField([(r['s'],r['s'].split('/')[-1]) for
                                 # r in moq.get_contacts('people')],
                                 # widget=SelectWithPopUp)
@@ -404,6 +422,11 @@ class MappingMeta(forms.Form):
                               widget=forms.TextInput(attrs={'hidden':True}))
     valueMaps = forms.CharField(max_length=1000, required=False, widget=forms.TextInput(attrs={'hidden':True}))
 
+    def __init__(self, *args, **kwargs):
+        super(MappingMeta, self).__init__(*args, **kwargs)
+        self.fields['editor'].choices = choices.contacts.choices(
+            fuseki_process, 'people')
+
     def clean(self):
         """process the form"""
         source = self.data.get('source')
@@ -469,20 +492,25 @@ class HomeForm(forms.Form):
                                                                'rows': 50,
                                                                'readonly':True
                                                                }))
+    validation_status = forms.CharField(required=False,
+                                        widget=forms.TextInput(
+                                            attrs={'size': '100',
+                                                   'readonly':True}))
 
     def clean(self):
         if self.data.has_key('load'):
             print 'data loaded'
-            fuseki_process.load()
+            fuseki_process.load(incremental=True)
         elif self.data.has_key('revert'):
             print 'save cache reverted'
             fuseki_process.revert()
         elif self.data.has_key('save'):
             print  'cached changes saved'
             fuseki_process.save()
+            fuseki_process.start_validation(incremental=True)
         elif self.data.has_key('validate'):
             print 'validate triplestore'
-            self.cleaned_data['validation'] = fuseki_process.validate()
+            fuseki_process.start_validation()
         return self.cleaned_data
 
 
@@ -0,0 +1,60 @@
+// (C) British Crown Copyright 2011 - 2012, Met Office
+//
+// This file is part of metOcean-mapping.
+//
+// metOcean-mapping is free software: you can redistribute it and/or
+// modify it under the terms of the GNU Lesser General Public License
+// as published by the Free Software Foundation, either version 3 of
+// the License, or (at your option) any later version.
+//
+// metOcean-mapping is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+// GNU Lesser General Public License for more details.
+//
+// You should have received a copy of the GNU Lesser General Public License
+// along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+// fill the datalist of each vocabulary input with the terms matching
+// the text typed, from the vocabulary search url in its data-vocabulary,
+// each labelled by its notation and its preferred label
+
+(function () {
+    function suggest(input) {
+        var request = new XMLHttpRequest();
+        var url = input.getAttribute('data-vocabulary') + '&q=' +
+            encodeURIComponent(input.value);
+        request.onreadystatechange = function () {
+            if (request.readyState !== 4 || request.status !== 200) {
+                return;
+            }
+            var list = document.getElementById(input.getAttribute('list'));
+            var terms = JSON.parse(request.responseText);
+            while (list.firstChild) {
+                list.removeChild(list.firstChild);
+            }
+            for (var i = 0; i < terms.length; i++) {
+                var option = document.createElement('option');
+                var label = terms[i].label;
+                if (terms[i].title && terms[i].title !== label) {
+                    label += ': ' + terms[i].title;
+                }
+                option.value = terms[i].value;
+                option.label = label;
+                option.textContent = label;
+                list.appendChild(option);
+            }
+        };
+        request.open('GET', url, true);
+        request.send();
+    }
+
+    window.addEventListener('load', function () {
+        var inputs = document.querySelectorAll('input[data-vocabulary]');
+        for (var i = 0; i < inputs.length; i++) {
+            inputs[i].addEventListener('input', function (event) {
+                suggest(event.target);
+            });
+        }
+    });
+})();
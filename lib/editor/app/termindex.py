@@ -0,0 +1,124 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+
+
+class TermIndex(object):
+    """
+    An index of the terms of a vocabulary by their notation and their
+    preferred label, so that the terms matching the text an editor has
+    typed are found without scanning the vocabulary.
+
+    Terms whose notation or label starts with the text are found in a
+    sorted list of the lower case keys; terms whose notation or label
+    contains the text elsewhere are found from the intersection of the
+    terms containing each of the text's trigrams.
+
+    Args:
+
+    * terms:
+        the list of (subject, notation, prefLabel) of the vocabulary,
+        in the order in which matches are to be listed; the prefLabel
+        may be empty
+
+    """
+    def __init__(self, terms):
+        self.terms = list(terms)
+        # the keys of each term
+        self._term_keys = [_keys(term) for term in self.terms]
+        # (key, term number), sorted
+        self._keys = []
+        # trigram: frozenset of term numbers
+        self._trigrams = {}
+        trigrams = {}
+        for number, keys in enumerate(self._term_keys):
+            for key in keys:
+                self._keys.append((key, number))
+                for i in range(len(key) - 2):
+                    trigrams.setdefault(key[i:i + 3], set()).add(number)
+        self._keys.sort()
+        for trigram, numbers in trigrams.iteritems():
+            self._trigrams[trigram] = frozenset(numbers)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def search(self, text, limit=20):
+        """
+        returns the list of up to limit (subject, notation, prefLabel)
+        terms matching the text, ignoring case: those whose notation or
+        label starts with the text, in key order, then those in which
+        the text appears elsewhere, in vocabulary order
+
+        """
+        text = text.strip().lower()
+        found = set()
+        numbers = []
+        start = bisect.bisect_left(self._keys, (text, -1))
+        for key, number in self._keys[start:]:
+            if len(numbers) == limit or not key.startswith(text):
+                break
+            if number not in found:
+                found.add(number)
+                numbers.append(number)
+        if len(numbers) < limit and len(text) >= 3:
+            numbers.extend(self._containing(text, found,
+                                            limit - len(numbers)))
+        return [self.terms[number] for number in numbers]
+
+    def _containing(self, text, exclude, limit):
+        """
+        helper method
+        returns the list of the numbers of up to limit terms, other than
+        those excluded, with a key containing the text, in order
+
+        """
+        postings = []
+        for i in range(len(text) - 2):
+            numbers = self._trigrams.get(text[i:i + 3])
+            if numbers is None:
+                return []
+            postings.append(numbers)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for numbers in postings[1:]:
+            candidates.intersection_update(numbers)
+        candidates.difference_update(exclude)
+        found = []
+        for number in sorted(candidates):
+            # a term holding all of the trigrams need not hold the text
+            if any([text in key for key in self._term_keys[number]]):
+                found.append(number)
+                if len(found) == limit:
+                    break
+        return found
+
+
+def _keys(term):
+    """
+    helper function
+    returns the lower case keys, notation and label, of a term
+
+    """
+    subject, notation, label = term
+    keys = ['%s' % notation]
+    keys[0] = keys[0].strip('"').lower()
+    label = ('%s' % (label or '')).strip('"').lower()
+    if label and label != keys[0]:
+        keys.append(label)
+    return keys
@@ -0,0 +1,257 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import choices
+import drafts
+import termindex
+
+
+class TestDraftStore(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_same_state_same_id(self):
+        store = drafts.DraftStore()
+        state = {'mr:source': {'mr:hasProperty': [1, 2]}}
+        draft_id = store.create(state)
+        self.assertEqual(store.create(dict(state)), draft_id)
+        self.assertEqual(store.get(draft_id), state)
+        self.assertIsNot(store.get(draft_id), store.get(draft_id))
+
+    def test_unknown_draft(self):
+        store = drafts.DraftStore()
+        self.assertRaises(KeyError, store.get, '0' * drafts.ID_LENGTH)
+        self.assertRaises(KeyError, store.get, '../settings')
+
+    def test_shared_by_path(self):
+        draft_id = drafts.DraftStore(self.path).create({'a': 1})
+        self.assertEqual(drafts.DraftStore(self.path).get(draft_id),
+                         {'a': 1})
+
+    def test_unused_files_expire(self):
+        store = drafts.DraftStore(self.path, age=60)
+        old_id = store.create({'a': 1})
+        old = time.time() - 120
+        os.utime(os.path.join(self.path, '{}.json'.format(old_id)),
+                 (old, old))
+        store._swept = 0
+        new_id = store.create({'a': 2})
+        self.assertNotIn(old_id, drafts.DraftStore(self.path))
+        self.assertIn(new_id, drafts.DraftStore(self.path))
+
+
+class TestApplyEdit(unittest.TestCase):
+    def setUp(self):
+        self.state = {'mr:source': {'mr:hasProperty': [{'mr:name': 'a'}]}}
+
+    def _apply(self, operation, path, value=None):
+        edit = drafts.edit_string(operation, path, value)
+        return drafts.apply_edit(self.state, edit)
+
+    def test_append(self):
+        self._apply('append', ['mr:source', 'mr:hasProperty'], 'b')
+        self._apply('append', ['mr:target'], 'c')
+        self.assertEqual(self.state['mr:source']['mr:hasProperty'][1], 'b')
+        self.assertEqual(self.state['mr:target'], ['c'])
+
+    def test_remove(self):
+        self._apply('remove', ['mr:source', 'mr:hasProperty', 0])
+        self.assertEqual(self.state['mr:source']['mr:hasProperty'], [])
+
+    def test_set(self):
+        self._apply('set', ['mr:source', 'mr:hasProperty', 0, 'mr:name'],
+                    'b')
+        self.assertEqual(self.state['mr:source']['mr:hasProperty'][0],
+                         {'mr:name': 'b'})
+
+    def test_bad_operation(self):
+        self.assertRaises(ValueError, drafts.edit_string, 'move', ['a'])
+        self.assertRaises(ValueError, drafts.apply_edit, self.state,
+                          '["move", ["mr:source"]]')
+
+    def test_path_does_not_fit(self):
+        self.assertRaises(ValueError, self._apply, 'remove',
+                          ['mr:source', 'mr:hasProperty', 3])
+        self.assertRaises(ValueError, self._apply, 'set',
+                          ['mr:target', 'mr:name'], 'a')
+        self.assertRaises(ValueError, self._apply, 'append',
+                          ['mr:source', 'mr:hasProperty', 0, 'mr:name',
+                           'x'], 'a')
+
+    def test_not_an_edit(self):
+        self.assertRaises(ValueError, drafts.apply_edit, self.state, '{')
+        self.assertRaises(ValueError, drafts.apply_edit, self.state, '[]')
+        self.assertRaises(ValueError, drafts.apply_edit, self.state,
+                          '["set", []]')
+
+
+class TestTermIndex(unittest.TestCase):
+    def setUp(self):
+        self.terms = [('<http://x/1>', '"air_temperature"', ''),
+                      ('<http://x/2>', '"air_pressure"', '"Air Pressure"'),
+                      ('<http://x/3>', '"m01s00i024"', '"Surface temperature"'),
+                      ('<http://x/4>', '"sea_water_temperature"', ''),
+                      ('<http://x/5>', '"temp"', '')]
+        self.index = termindex.TermIndex(self.terms)
+
+    def _subjects(self, text, limit=20):
+        return [term[0] for term in self.index.search(text, limit)]
+
+    def test_prefix(self):
+        self.assertEqual(self._subjects('air_'), ['<http://x/2>',
+                                                  '<http://x/1>'])
+        self.assertEqual(self._subjects('M01S'), ['<http://x/3>'])
+
+    def test_label_prefix(self):
+        self.assertEqual(self._subjects('surface'), ['<http://x/3>'])
+        self.assertEqual(self._subjects('air pr'), ['<http://x/2>'])
+
+    def test_prefix_before_containing(self):
+        self.assertEqual(self._subjects('temp'), ['<http://x/5>',
+                                                  '<http://x/1>',
+                                                  '<http://x/3>',
+                                                  '<http://x/4>'])
+
+    def test_containing_needs_all_trigrams(self):
+        self.assertEqual(self._subjects('water_t'), ['<http://x/4>'])
+        self.assertEqual(self._subjects('ter_tem'), ['<http://x/4>'])
+        self.assertEqual(self._subjects('zzz'), [])
+
+    def test_limit(self):
+        self.assertEqual(len(self._subjects('temp', 2)), 2)
+        self.assertEqual(len(self._subjects('', 3)), 3)
+
+    def test_brute_force(self):
+        # text of fewer than three characters only matches at the start
+        for text in ['a', 'te', 'pre', 'ure', 'i02', 'r_t', 'sea_w']:
+            expected = set()
+            for term in self.terms:
+                for key in termindex._keys(term):
+                    if key.startswith(text) or \
+                       (len(text) >= 3 and text in key):
+                        expected.add(term[0])
+            self.assertEqual(set(self._subjects(text)), expected)
+
+
+class TestChoiceProvider(unittest.TestCase):
+    def setUp(self):
+        self.reads = []
+        self.provider = choices.ChoiceProvider(self.query, ttl=60)
+
+    def query(self, fuseki_process, fformat):
+        self.reads.append(fformat)
+        return [('<http://x/{}>'.format(fformat), fformat)]
+
+    def test_reused(self):
+        first = self.provider.choices(None, 'um')
+        first.append(('<http://x/extra>', 'extra'))
+        self.assertEqual(self.provider.choices(None, 'um'),
+                         [('<http://x/um>', 'um')])
+        self.provider.choices(None, 'cf')
+        self.assertEqual(self.reads, ['um', 'cf'])
+
+    def test_expired(self):
+        self.provider.choices(None, 'um')
+        read, held = self.provider._choices[('um',)]
+        self.provider._choices[('um',)] = (read - 61, held)
+        self.provider.choices(None, 'um')
+        self.assertEqual(self.reads, ['um', 'um'])
+        self.provider.choices(None, 'um')
+        self.assertEqual(len(self.reads), 2)
+
+    def test_clear(self):
+        self.provider.choices(None, 'um')
+        self.provider.clear()
+        self.provider.choices(None, 'um')
+        self.assertEqual(self.reads, ['um', 'um'])
+
+
+class _VocabularyStore(object):
+    """stands in for a FusekiServer, answering vocabulary queries"""
+    def __init__(self, size):
+        self.size = size
+        self.reads = 0
+        self._generation = 1
+
+    def generation(self):
+        return self._generation
+
+    def run_query(self, query_string, debug=False, stream=False):
+        self.reads += 1
+        return iter([{'subject': '<http://x/{}>'.format(i),
+                      'notation': '"n{}"'.format(i),
+                      'prefLabel': '"label {}"'.format(i)}
+                     for i in range(self.size)])
+
+
+class TestVocabularyProvider(unittest.TestCase):
+    def setUp(self):
+        self.store = _VocabularyStore(3)
+        self.provider = choices.VocabularyProvider()
+
+    def test_read_once_per_generation(self):
+        graph = 'http://um/stashconcepts.ttl'
+        self.assertEqual(self.provider.choices(self.store, graph)[:2],
+                         [('', ''), ('<http://x/0>', '"n0"')])
+        self.assertEqual(self.provider.size(self.store, graph), 3)
+        self.assertTrue(self.provider.declares(self.store, graph,
+                                               '<http://x/2>'))
+        self.assertFalse(self.provider.declares(self.store, graph,
+                                                '<http://x/3>'))
+        self.assertEqual(self.store.reads, 1)
+        # the data is loaded afresh, with another term
+        self.store.size = 4
+        self.store._generation += 1
+        self.assertTrue(self.provider.declares(self.store, graph,
+                                               '<http://x/3>'))
+        self.assertEqual(self.store.reads, 2)
+
+    def test_search_index_refreshed(self):
+        graph = 'http://um/stashconcepts.ttl'
+        self.assertEqual(self.provider.search(self.store, graph, 'n2'),
+                         [('<http://x/2>', '"n2"', '"label 2"')])
+        self.store.size = 4
+        self.assertEqual(self.provider.search(self.store, graph, 'n3'), [])
+        self.store._generation += 1
+        self.assertEqual(self.provider.search(self.store, graph, 'n3'),
+                         [('<http://x/3>', '"n3"', '"label 3"')])
+
+    def test_searched(self):
+        graph = 'http://um/stashconcepts.ttl'
+        self.store.size = choices.TYPEAHEAD_SIZE
+        self.assertFalse(self.provider.searched(self.store, 'stash_code',
+                                                graph))
+        self.store.size = choices.TYPEAHEAD_SIZE + 1
+        self.store._generation += 1
+        self.assertTrue(self.provider.searched(self.store, 'stash_code',
+                                               graph))
+        self.assertFalse(self.provider.searched(self.store, 'name', graph))
+        self.assertEqual(len(self.provider.search(self.store, graph, 'n',
+                                                  limit=20)), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
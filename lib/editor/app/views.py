@@ -35,13 +35,20 @@ from django.forms.formsets import formset_factory
 from django.forms.models import inlineformset_factory
 
 
+import choices
+import drafts
 import forms
 import metocean.prefixes as prefixes
 import metocean.queries as moq
+from settings import DRAFT_AGE
+from settings import DRAFT_PATH
 from settings import READ_ONLY
 from settings import fuseki_process
 
 
+draft_store = drafts.DraftStore(DRAFT_PATH, age=DRAFT_AGE)
+
+
 def home(request):
     """
     returns a view for the editor homepage
@@ -54,21 +61,21 @@ def home(request):
                    ' flagged as not existing in the persistent ' \
                    'StaticData store'.format(len(persist))
     cache_state = moq.print_records(persist)
+    validation = fuseki_process.validation_status()
     if request.method == 'POST':
         form = forms.HomeForm(request.POST)
         if form.is_valid():
-            invalids = form.cleaned_data.get('validation')
-            if invalids:
-                url = url_qstr(reverse('invalid_mappings'),
-                                           ref=json.dumps(invalids))
-                response = HttpResponseRedirect(url)
-            else:
-                url = url_qstr(reverse('home'))
-                response = HttpResponseRedirect(url)
+            url = url_qstr(reverse('home'))
+            response = HttpResponseRedirect(url)
     else:
+        validation_status = _validation_label(validation)
         form = forms.HomeForm(initial={'cache_status':cache_status,
-                                       'cache_state':cache_state})
+                                       'cache_state':cache_state,
+                                       'validation_status':validation_status})
         con_dict = {}
+        if validation['results']:
+            con_dict['validation'] = {'url':reverse('invalid_mappings'),
+                                      'label':'view the validation results'}
         searchurl = url_qstr(reverse('fsearch'),ref='')
         con_dict['search'] = {'url':searchurl, 'label':'search for mappings'}
         createurl = reverse('mapping_formats')
@@ -87,8 +94,7 @@ def mapping_formats(request):
             data = form.cleaned_data
             referrer = {'mr:source': {'mr:hasFormat': data['source_format']},
                         'mr:target': {'mr:hasFormat': data['target_format']}}
-            url = url_qstr(reverse('mapping_concepts'),
-                                       ref=json.dumps(referrer))
+            url = _draft_url(reverse('mapping_concepts'), referrer)
             response = HttpResponseRedirect(url)
     else:
         form = forms.MappingFormats()
@@ -136,6 +142,34 @@ def _prop_id(members):
     return prop_ids, new_map
 
 
+def _validation_label(validation):
+    """
+    helper function
+    returns a description of the background validation status
+
+    """
+    isoformat = '%Y-%m-%d %H:%M:%S'
+    if validation['running']:
+        started = datetime.datetime.fromtimestamp(validation['started'])
+        label = 'validating, started {}: {} of {} checks complete'
+        label = label.format(started.strftime(isoformat),
+                             validation['completed'], validation['checks'])
+    elif validation['error']:
+        label = 'the last validation failed: {}'.format(validation['error'])
+    elif validation['results'] is None:
+        label = 'not validated'
+    else:
+        label = '{} validation failures'
+        label = label.format(sum([len(failures) for failures in
+                                  validation['results'].values()]))
+    if validation['results'] is not None and not validation['running']:
+        finished = datetime.datetime.fromtimestamp(validation['finished'])
+        label += ', last validated {}'.format(finished.strftime(isoformat))
+        if not validation['current']:
+            label += ', the triple store has changed since'
+    return label
+
+
 def url_qstr(path, **kwargs):
     """
     helper function
@@ -145,6 +179,57 @@ def url_qstr(path, **kwargs):
     return path + '?' + urllib.urlencode(kwargs)
 
 
+def _draft_url(path, state):
+    """
+    helper function
+    returns url for path, referring to the draft of the mapping state
+    
+    """
+    return url_qstr(path, draft=draft_store.create(state))
+
+
+def _edit_url(path, draft_id, operation, keys, value=None):
+    """
+    helper function
+    returns url for path, referring to a draft and an edit to make to it:
+    the operation on the element of the draft at keys (see
+    drafts.edit_string)
+    
+    """
+    edit = drafts.edit_string(operation, keys, value)
+    return url_qstr(path, draft=draft_id, edit=edit)
+
+
+def _requestor(request, default=None):
+    """
+    helper function
+    returns the state of the mapping referred to by a request, from the
+    draft it names, with any edit the request makes to it applied, or
+    from the json of its 'ref', or the default
+    
+    """
+    draft_id = request.GET.get('draft', '')
+    if draft_id:
+        try:
+            requestor = draft_store.get(draft_id)
+        except KeyError:
+            raise Http404('this mapping draft is no longer available')
+        edit = request.GET.get('edit', '')
+        if edit:
+            try:
+                requestor = drafts.apply_edit(requestor, edit)
+            except ValueError:
+                raise Http404('this edit does not apply to the mapping draft')
+    else:
+        requestor_path = request.GET.get('ref', '')
+        requestor_path = urllib.unquote(requestor_path).decode('utf8')
+        if requestor_path == '':
+            requestor = default
+        else:
+            requestor = json.loads(requestor_path)
+    return requestor
+
+
 def _create_components(key, requestor, new_map, components):
     """
     return the mapping json structure and components list having created
@@ -195,159 +280,123 @@ def _create_properties(key, requestor, new_map, components):
         raise ValueError(ec)
     return new_map, components
 
-def _component_links(key, request, amended):
+def _component_links(key, request, amended, draft_id):
     """
     helper method
     provides urls in amended (the dictionary used for rendering the view,
-    for adding and removing concepts
+    for adding and removing concepts; each url refers to the draft of
+    request and the edit to make to it, so no copy of request is made
     
     """
     fformurl = '%s' % request[key]['mr:hasFormat']
     fformat = request[key]['mr:hasFormat'].split('/')[-1]
     fformat = fformat.rstrip('>')
+    concepts = reverse('mapping_concepts')
+    define_property = reverse('define_property', kwargs={'fformat':fformat})
     ## 'add a new component' link
-    fterm = copy.deepcopy(request)
-    if not fterm[key].get('mr:hasProperty'):
-        if not fterm[key].get('mr:hasComponent'):
-            fterm[key]['mr:hasComponent'] = []
+    if not request[key].get('mr:hasProperty'):
+        if not request[key].get('mr:hasComponent'):
             amended[key]['mr:hasComponent'] = []
-        fterm[key]['mr:hasComponent'].append({"mr:hasComponent":[]})
-        refer = {'url': url_qstr(reverse('mapping_concepts'),
-                                             ref=json.dumps(fterm)),
+        refer = {'url': _edit_url(concepts, draft_id, 'append',
+                                  [key, 'mr:hasComponent'],
+                                  {"mr:hasComponent":[]}),
                 'label': 'add a component'}
         amended[key]['mr:hasComponent'].append(refer)
     ## 'add a new property' link if no sub-component exist
     if not request[key].get('mr:hasComponent'):
-        new_term = copy.deepcopy(request)
-        if not new_term[key].get('mr:hasProperty'):
-            new_term[key]['mr:hasProperty'] = []
+        if not request[key].get('mr:hasProperty'):
             amended[key]['mr:hasProperty'] = []
-        new_term[key]['mr:hasProperty'].append('&&&&')
-        refer = {'url':url_qstr(reverse('define_property',
-                      kwargs={'fformat':fformat}),
-                      ref=json.dumps(new_term)),
+        refer = {'url':_edit_url(define_property, draft_id, 'append',
+                                 [key, 'mr:hasProperty'], '&&&&'),
                 'label':'add a property definition'}
         amended[key]['mr:hasProperty'].append(refer)
     ## removers
     rem_keys = ['mr:hasProperty', 'mr:hasComponent']
     for rem_key in rem_keys:
         for i, rs in enumerate(request[key].get(rem_key, [])):
-            remover = copy.deepcopy(request)
-            del remover[key][rem_key][i]
-            url = url_qstr(reverse('mapping_concepts'),
-                                               ref=json.dumps(remover))
+            url = _edit_url(concepts, draft_id, 'remove', [key, rem_key, i])
             ad = amended[key].get(rem_key, [])[i]
             ad['remove'] = {'url':url, 'label':'remove this item'}
     for i, rq in enumerate(request[key].get('mr:hasProperty', [])):
         ad = amended[key].get('mr:hasProperty', [])[i]
+        path = [key, 'mr:hasProperty', i, 'mr:hasComponent']
         ## link to add a new component to a 'name only' property
         if rq.get('mr:name') and not rq.get('mr:operator') and not \
             rq.get('rdf:value') and not rq.get('mr:hasComponent'):
-            refr = copy.deepcopy(request)
             new_comp = {'mr:hasFormat':fformurl}
-            refr[key]['mr:hasProperty'][i]['mr:hasComponent'] = new_comp
-            compurl = url_qstr(reverse('mapping_concepts'),
-                                     ref=json.dumps(refr))
+            compurl = _edit_url(concepts, draft_id, 'set', path, new_comp)
             ref = {'url':compurl, 'label':'add a component'}
             ad['define_component'] = ref
         #adder for a new sub-conponent property to a name and concept property
         elif rq.get('mr:name') and not rq.get('mr:operator') and not \
             rq.get('rdf:value') and rq.get('mr:hasComponent'):
-            refr = copy.deepcopy(request)
-            rf = refr[key]['mr:hasProperty'][i]
             if not rq['mr:hasComponent'].get('mr:hasProperty'):
-                rf['mr:hasComponent']['mr:hasProperty'] = []
                 ad['mr:hasComponent']['mr:hasProperty'] = []
-            rf['mr:hasComponent']['mr:hasProperty'].append('&&&&')
-            prop = {'url':url_qstr(reverse('define_property',
-                                           kwargs={'fformat':fformat}),
-                                   ref=json.dumps(refr)),
+            prop = {'url':_edit_url(define_property, draft_id, 'append',
+                                    path + ['mr:hasProperty'], '&&&&'),
                     'label':'add a property definition'}
             ad['mr:hasComponent']['mr:hasProperty'].append(prop)
             #remover for each sub-component property
             for j, prq in enumerate(rq['mr:hasComponent'].get('mr:hasProperty',
                                                               [])):
-                remover = copy.deepcopy(request)
-                rm = remover[key]['mr:hasProperty'][i]
-                del rm['mr:hasComponent']['mr:hasProperty'][j]
-                url = url_qstr(reverse('mapping_concepts'),
-                               ref=json.dumps(remover))
+                url = _edit_url(concepts, draft_id, 'remove',
+                                path + ['mr:hasProperty', j])
                 rmer = {'url':url, 'label':'remove this item'}
                 ad['mr:hasComponent']['mr:hasProperty'][j]['remove'] = rmer
     ## iterate through sub-components
     for k, scomp in enumerate(request[key].get('mr:hasComponent', [])):
         amd = amended[key].get('mr:hasComponent', [])[k]
+        spath = [key, 'mr:hasComponent', k, 'mr:hasProperty']
         ## add property
-        new_term = copy.deepcopy(request)
         if not scomp.get('mr:hasProperty'):
-            new_term[key]['mr:hasComponent'][k]['mr:hasProperty'] = []
             amd['mr:hasProperty'] = []
-        new_term[key]['mr:hasComponent'][k]['mr:hasProperty'].append('&&&&')
-        refer = {'url':url_qstr(reverse('define_property',
-                                        kwargs={'fformat':fformat}),
-                                ref=json.dumps(new_term)),
+        refer = {'url':_edit_url(define_property, draft_id, 'append', spath,
+                                 '&&&&'),
                 'label':'add a property definition'}
         amd['mr:hasProperty'].append(refer)
         
         for i, elem in enumerate(scomp.get('mr:hasProperty', [])):
             ad = amd.get('mr:hasProperty', [])[i]
+            path = spath + [i, 'mr:hasComponent']
         ## remove property
-            remover = copy.deepcopy(request)
-            del remover[key]['mr:hasComponent'][k]['mr:hasProperty'][i]
-            url = url_qstr(reverse('mapping_concepts'), ref=json.dumps(remover))
+            url = _edit_url(concepts, draft_id, 'remove', spath + [i])
             ad['remove'] = {'url':url, 'label':'remove this item'}
             ## enable component as property
             if elem.get('mr:name') and not elem.get('mr:operator') and not \
                 elem.get('rdf:value') and not elem.get('mr:hasComponent'):
-                refr = copy.deepcopy(request)
-                refR = refr[key]['mr:hasComponent'][k]['mr:hasProperty'][i]
-                refR['mr:hasComponent'] = {'mr:hasFormat':fformurl}
-                compurl = url_qstr(reverse('mapping_concepts'),
-                                         ref=json.dumps(refr))
+                compurl = _edit_url(concepts, draft_id, 'set', path,
+                                    {'mr:hasFormat':fformurl})
                 ref = {'url':compurl, 'label':'add a component'}
                 ad['define_component'] = ref
             elif elem.get('mr:name') and not elem.get('mr:operator') and not \
                 elem.get('rdf:value') and elem.get('mr:hasComponent'):
                 #adder for a new property
-                refr = copy.deepcopy(request)
-                refR = refr[key]['mr:hasComponent'][k]['mr:hasProperty'][i]
                 if not elem['mr:hasComponent'].get('mr:hasProperty'):
-                    refR['mr:hasComponent']['mr:hasProperty'] = []
                     ad['mr:hasComponent']['mr:hasProperty'] = []
-                refR['mr:hasComponent']['mr:hasProperty'].append('&&&&')
-                prop = {'url':url_qstr(reverse('define_property',
-                                                kwargs={'fformat':fformat}),
-                                       ref=json.dumps(refr)),
+                prop = {'url':_edit_url(define_property, draft_id, 'append',
+                                        path + ['mr:hasProperty'], '&&&&'),
                         'label':'add a property definition'}
                 ad['mr:hasComponent']['mr:hasProperty'].append(prop)
                 #remover for each property
                 pelems = elem['mr:hasComponent'].get('mr:hasProperty', [])
                 pads = ad['mr:hasComponent'].get('mr:hasProperty', [])
-                for j, pelem, pad in enumerate(pelems):
+                for j, pelem in enumerate(pelems):
                     pad = pads[j]
-                    rer = copy.deepcopy(request)
-                    rmR = rer[key]['mr:hasComponent'][k]['mr:hasProperty'][i]
-                    del rmR['mr:hasComponent']['mr:hasProperty'][j]
-                    url = url_qstr(reverse('mapping_concepts'),
-                                   ref=json.dumps(remover))
+                    url = _edit_url(concepts, draft_id, 'remove',
+                                    path + ['mr:hasProperty', j])
                     pad['remove'] = {'url':url, 'label':'remove this item'}
     ## mediators
     for fckey in ['dc:requires', 'dc:mediator']:
         url = None
         # if True:
         # if fformat == 'cf':
-        adder = copy.deepcopy(request)
+        rev = reverse('define_mediator', kwargs={'mediator':fckey,
+                                                 'fformat':fformat})
         if request[key].get(fckey):
             if fckey == 'dc:requires':
-                adder[key][fckey].append('&&&&')
-                rev = reverse('define_mediator', kwargs={'mediator':fckey,
-                                                         'fformat':fformat})
-                url = url_qstr(rev, ref=json.dumps(adder))
+                url = _edit_url(rev, draft_id, 'append', [key, fckey], '&&&&')
         else:
-            adder[key][fckey] = ['&&&&']
-            rev = reverse('define_mediator', kwargs={'mediator':fckey,
-                                                     'fformat':fformat})
-            url = url_qstr(rev, ref=json.dumps(adder))
+            url = _edit_url(rev, draft_id, 'set', [key, fckey], ['&&&&'])
             amended[key][fckey] = []
         if url:
             amended[key][fckey].append({'url': url,
@@ -510,11 +559,7 @@ def mapping_concepts(request):
     source and target, and the valuemaps
     
     """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
-    if requestor_path == '':
-        requestor_path = '{}'
-    requestor = json.loads(requestor_path)
+    requestor = _requestor(request, {})
     print requestor
     amended_dict = copy.deepcopy(requestor)
     if request.method == 'POST':
@@ -535,13 +580,17 @@ def mapping_concepts(request):
                 new_map[key]['component'] = '%s' % components[key]
             else:
                 raise ValueError('The source and target are not both defined')
-        ref = json.dumps(new_map)
-        url = url_qstr(reverse('value_maps'),ref=ref)
+        url = _draft_url(reverse('value_maps'), new_map)
         response = HttpResponseRedirect(url)
     else:
         form = forms.MappingConcept()
+        # an unedited draft is already stored
+        draft_id = request.GET.get('draft', '')
+        if not draft_id or request.GET.get('edit'):
+            draft_id = draft_store.create(requestor)
         for key in ['mr:source','mr:target']:
-            amended_dict = _component_links(key, requestor, amended_dict)
+            amended_dict = _component_links(key, requestor, amended_dict,
+                                            draft_id)
         con_dict = {}
         con_dict['mapping'] = amended_dict
         con_dict['form'] = form
@@ -555,27 +604,24 @@ def define_mediator(request, mediator, fformat):
     formatConcept
     
     """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
-    requestor = json.loads(requestor_path)
+    requestor = _requestor(request)
     if request.method == 'POST':
         form = forms.Mediator(request.POST, fformat=fformat)
     else:
         form = forms.Mediator(fformat=fformat)
     if request.method == 'POST' and form.is_valid():
         mediator = form.cleaned_data['mediator']
-        requestor_path = requestor_path.replace('&&&&',
-                                                          mediator)
-        url = url_qstr(reverse('mapping_concepts'),
-                                   ref=requestor_path)
+        requestor_path = json.dumps(requestor).replace('&&&&', mediator)
+        url = _draft_url(reverse('mapping_concepts'),
+                         json.loads(requestor_path))
         response = HttpResponseRedirect(url)
     else:
         con_dict = {'form':form}
         if mediator == 'dc:mediator':
             links = []
-            link_url = url_qstr(reverse('create_mediator',
-                                        kwargs={'fformat':fformat}),
-                                ref=requestor_path)
+            link_url = _draft_url(reverse('create_mediator',
+                                          kwargs={'fformat':fformat}),
+                                  requestor)
             links.append({'url':link_url, 'label':'create a new mediator'})
             con_dict['links'] = links
         context = RequestContext(request, con_dict)
@@ -589,9 +635,7 @@ def create_mediator(request, fformat):
     formatConcept
     
     """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
-    requestor = json.loads(requestor_path)
+    requestor = _requestor(request)
     if request.method == 'POST':
         form = forms.NewMediator(request.POST)
     else:
@@ -599,9 +643,9 @@ def create_mediator(request, fformat):
     if request.method == 'POST' and form.is_valid():
         mediator = form.cleaned_data['mediator']
         moq.create_mediator(fuseki_process, mediator, fformat)
+        choices.mediators.clear()
         kw = {'mediator':'dc:mediator','fformat':fformat}
-        url = url_qstr(reverse('define_mediator', kwargs=kw),
-                                   ref=requestor_path)
+        url = _draft_url(reverse('define_mediator', kwargs=kw), requestor)
         response = HttpResponseRedirect(url)
     else:
         con_dict = {'form':form}
@@ -654,11 +698,7 @@ def value_maps(request):
     source and target pair
     
     """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
-    if requestor_path == '':
-        requestor_path = '{}'
-    requestor = json.loads(requestor_path)
+    requestor = _requestor(request, {})
     print requestor
     amended_dict = copy.deepcopy(requestor)
     if request.method == 'POST':
@@ -676,8 +716,7 @@ def value_maps(request):
             vmap = moq.get_value_map(fuseki_process, vmap_dict)
             valuemap['valueMap'] = vmap['valueMap']
             #value['value'] = val_id
-        url = url_qstr(reverse('mapping_edit'),
-                                   ref = json.dumps(requestor))
+        url = _draft_url(reverse('mapping_edit'), requestor)
         response = HttpResponseRedirect(url)
             
     else:
@@ -685,13 +724,11 @@ def value_maps(request):
         if not amended_dict.has_key('mr:hasValueMap'):
             addition = copy.deepcopy(requestor)
             addition['mr:hasValueMap'] = []
-            url = url_qstr(reverse('define_valuemaps'),
-                                       ref=json.dumps(addition))
+            url = _draft_url(reverse('define_valuemaps'), addition)
             amended_dict['addValueMap'] = {'url':url,
                                            'label':'add a value mapping'}
         else:
-            url = url_qstr(reverse('define_valuemaps'),
-                           ref=json.dumps(requestor))
+            url = _draft_url(reverse('define_valuemaps'), requestor)
             amended_dict['addValueMap'] = {'url':url,
                                            'label':'add a value mapping'}
         con_dict = {}
@@ -722,9 +759,7 @@ def _define_valuemap_choice(comp, aproperty, choice):
 
 def define_valuemap(request):
     """ returns a view to input choices for an individual value_map """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
-    requestor = json.loads(requestor_path)
+    requestor = _requestor(request)
     # print requestor
     source_list = []
     target_list = []
@@ -758,19 +793,17 @@ def define_valuemap(request):
             requestor['mr:hasValueMap'].append(new_vmap)
             if requestor.get('derived_values'):
                 del requestor['derived_values']
-            requestor_path = json.dumps(requestor)
-            url = url_qstr(reverse('value_maps'),
-                                       ref=requestor_path)
+            url = _draft_url(reverse('value_maps'), requestor)
             return HttpResponseRedirect(url)
     else:
         form = forms.ValueMap(sc=source_list, tc=target_list)
     con_dict = {'form':form}
     links = []
-    link_url = url_qstr(reverse('derived_value', kwargs={'role':'source'}),
-                                        ref=requestor_path)
+    link_url = _draft_url(reverse('derived_value', kwargs={'role':'source'}),
+                          requestor)
     links.append({'url':link_url, 'label':'create a derived source value'})
-    link_url = url_qstr(reverse('derived_value', kwargs={'role':'target'}),
-                                        ref=requestor_path)
+    link_url = _draft_url(reverse('derived_value', kwargs={'role':'target'}),
+                          requestor)
     links.append({'url':link_url, 'label':'create a derived target value'})
     con_dict['links'] = links
     context = RequestContext(request, con_dict)
@@ -783,9 +816,7 @@ def derived_value(request, role):
     given the potnetial inputs from the component request
     
     """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
-    requestor = json.loads(requestor_path)
+    requestor = _requestor(request)
     if not requestor.get('derived_values'):
         requestor['derived_values'] = {'mr:source':[], 'mr:target':[]}
     source_list = []
@@ -823,9 +854,7 @@ def derived_value(request, role):
                 derived['mr:object'] = form.cleaned_data['_object_literal']
             derived['mr:operator'] = form.cleaned_data['_operator']
             requestor['derived_values']['mr:{}'.format(role)].append(derived)
-            requestor_path = json.dumps(requestor)
-            url = url_qstr(reverse('define_valuemaps'),
-                                       ref=requestor_path)
+            url = _draft_url(reverse('define_valuemaps'), requestor)
             response = HttpResponseRedirect(url)
         else:
             con_dict = {'form':form}
@@ -841,8 +870,7 @@ def derived_value(request, role):
 
 def define_property(request, fformat):
     """ returns a view to define an individual property  """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
+    requestor_path = json.dumps(_requestor(request))
     if request.method == 'POST':
         form = forms.Value(request.POST, fformat=fformat)
         if form.is_valid():
@@ -855,8 +883,8 @@ def define_property(request, fformat):
                 new_value['mr:operator'] = form.cleaned_data['operator']
             newv = json.dumps(new_value)
             requestor_path = requestor_path.replace('"&&&&"', newv)
-            url = url_qstr(reverse('mapping_concepts'),
-                                       ref=requestor_path)
+            url = _draft_url(reverse('mapping_concepts'),
+                             json.loads(requestor_path))
             response = HttpResponseRedirect(url)
         else:
             con_dict = {'form':form}
@@ -877,19 +905,14 @@ def mapping_edit(request):
     source target and any valuemaps from the referrer
     
     """
-    requestor_path = request.GET.get('ref', '')
-    requestor_path = urllib.unquote(requestor_path).decode('utf8')
-    if requestor_path == '':
-        requestor_path = '{}'
-    requestor = json.loads(requestor_path)
+    requestor = _requestor(request, {})
     print requestor
     if request.method == 'POST':
         form = forms.MappingMeta(request.POST)
         if form.is_valid():
-            map_id = process_form(form, requestor_path)
+            map_id = process_form(form, json.dumps(requestor))
             requestor['mapping'] = map_id
-            url = url_qstr(reverse('mapping_edit'),
-                                       ref=json.dumps(requestor))
+            url = _draft_url(reverse('mapping_edit'), requestor)
             return HttpResponseRedirect(url)
     else:
         ## look for mapping, if it exists, show it, with a warning
@@ -930,8 +953,8 @@ def mapping_edit(request):
     con_dict = {}
     con_dict['mapping'] = requestor
     con_dict['form'] = form
-    con_dict['amend'] = {'url': url_qstr(reverse(mapping_concepts),
-                                                    ref=requestor_path),
+    con_dict['amend'] = {'url': _draft_url(reverse(mapping_concepts),
+                                           requestor),
                         'label': 'Re-define this Mapping'}
     context = RequestContext(request, con_dict)
     return render_to_response('mapping_concept.html', context)
@@ -990,16 +1013,16 @@ def invalid_mappings(request):
     requestor_path = request.GET.get('ref', '')
     requestor_path = urllib.unquote(requestor_path).decode('utf8')
     if requestor_path == '':
-        requestor_path = '{}'
-    requestor = json.loads(requestor_path)
+        requestor = fuseki_process.validation_status()['results'] or {}
+    else:
+        requestor = json.loads(requestor_path)
     invalids = []
     for key, inv_mappings in requestor.iteritems():
         invalid = {'label':key, 'mappings':[]}
         for inv_map in inv_mappings:
             mapping = moq.get_mapping_by_id(fuseki_process, inv_map['amap'])
             referrer = fuseki_process.structured_mapping(mapping)
-            map_json = json.dumps(referrer)
-            url = url_qstr(reverse('mapping_edit'), ref=map_json)
+            url = _draft_url(reverse('mapping_edit'), referrer)
             sig = inv_map.get('signature', [])
             label = []
             if isinstance(sig, list):
@@ -1018,6 +1041,30 @@ def invalid_mappings(request):
     return render_to_response('select_list.html', context)
 
 
+def vocabulary_search(request, fformat):
+    """
+    returns a json list of the terms, as {'value':, 'label':, 'title':},
+    of the vocabulary of a property definition 'field' for a format,
+    whose notation or preferred label starts with, or else contains, 'q';
+    at most 'limit' terms are returned
+    
+    """
+    graph = dict(choices.VOCABULARIES.get(fformat, [])).get(
+        request.GET.get('field'))
+    if graph is None:
+        raise Http404('no vocabulary for this field')
+    try:
+        limit = min(int(request.GET.get('limit', 20)), 100)
+    except ValueError:
+        limit = 20
+    terms = choices.vocabularies.search(fuseki_process, graph,
+                                        request.GET.get('q', ''), limit)
+    terms = [{'value':subject, 'label':notation.strip('"'),
+              'title':label.strip('"')} for
+             subject, notation, label in terms]
+    return HttpResponse(json.dumps(terms), content_type='application/json')
+
+
 ### searching    
 
 def fsearch(request):
@@ -1110,8 +1157,7 @@ def search_maps(request):
     for amap in mappings:
         mapping = moq.get_mapping_by_id(fuseki_process, amap)
         referrer = fuseki_process.structured_mapping(mapping)
-        map_json = json.dumps(referrer)
-        url = url_qstr(reverse('mapping_edit'), ref=map_json)
+        url = _draft_url(reverse('mapping_edit'), referrer)
         label = 'mapping'
         mapurls['mappings'].append({'url':url, 'label':label})
     context_dict = {'invalid': [mapurls]}  
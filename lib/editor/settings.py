@@ -145,6 +145,12 @@ LOGGING = {
     }
 }
 
+# A directory in which to keep the drafts of the mappings being edited,
+# so they outlive the editor process, or None to keep them in memory only.
+DRAFT_PATH = None
+# The number of seconds for which a draft file is kept after it is last used.
+DRAFT_AGE = 7 * 24 * 3600
+
 try:
     from settings_local import *
 except ImportError:
@@ -25,6 +25,8 @@ urlpatterns = patterns('',
         name='mapping_concepts'),
     url(r'^defineproperty/(?P<fformat>[^/]+)/$',
         'editor.app.views.define_property', name='define_property'),
+    url(r'^vocabulary/(?P<fformat>[^/]+)/$',
+        'editor.app.views.vocabulary_search', name='vocabulary_search'),
     url(r'^valuemap/$', 'editor.app.views.value_maps', name='value_maps'),
     url(r'^definevaluemap', 'editor.app.views.define_valuemap',
         name='define_valuemaps'),
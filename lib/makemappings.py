@@ -16,15 +16,15 @@
 # along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
 
 
-import copy
 import datetime
 import glob
+import os
+import sys
 import time
 
 import iris.fileformats.um_cf_map as umcf
 
-import metocean.fuseki as fu
-import metocean.queries as moq
+import metocean.bulk as bulk
 import metocean.prefixes as prefixes
 
 import moreumcf
@@ -163,7 +163,17 @@ ttl_str = '''#(C) British Crown Copyright 2011 - 2012, Met Office This file is p
 '''
 pre = prefixes.Prefixes()
 
-for st_file in glob.glob('../staticData/metarelate.net/*.ttl'):
+if '--offline' in sys.argv:
+    # without a triple store, nor its configuration, the records are
+    # written to the repository's static data
+    staticdata = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'staticData')
+else:
+    import metocean.fuseki as fu
+    staticdata = fu.STATICDATA
+metarelate = os.path.join(staticdata, 'metarelate.net')
+
+for st_file in glob.glob(os.path.join(metarelate, '*.ttl')):
     if st_file.split('/')[-1] != 'contacts.ttl':
         with open(st_file, 'w') as st:
             st.write(ttl_str)
@@ -180,34 +190,22 @@ mapping_p_o['mr:reason'] = ['"new mapping"']
 
 
 
-with fu.FusekiServer(3131) as fu_p:
-    fu_p.load()
-    print 'load complete'
-    for newlink in linkages:
-        map_dict = copy.deepcopy(mapping_p_o)
-        map_dict['mr:invertible'] = newlink['mr:invertible']
-        st = ['mr:source', 'mr:target']
-        for pref in st:
-            members = newlink[pref]['mr:hasProperty']
-            memberids = []
-            for v_dict in members:
-                prop_res = moq.get_property(fu_p, v_dict)
-                if prop_res:
-                    prop_id = '%s' % prop_res['property']
-                else:
-                    raise ValueError('%i results returned from get_value %s' %
-                                     (len(val_res), str(val_res)))
-                memberids.append(prop_id)
-            fc_dict = {'mr:hasFormat' : newlink[pref]['mr:hasFormat'],
-                       'mr:hasProperty' : memberids}
-            fc_res = moq.get_component(fu_p, fc_dict)
-            if fc_res:
-                fcID = '%s' % fc_res['component']
-            else:
-                raise ValueError('%i results returned from get_component %s' %
-                                 (len(fc_res), str(fc_res)))
-            map_dict[pref] = fcID
-        map_res = moq.create_mapping(fu_p, map_dict)
-    print 'saving cached changes'
-    fu_p.save()
-
+records = bulk.RecordSet()
+for newlink in linkages:
+    records.add_linkage(newlink, mapping_p_o)
+print '%i records to import' % len(records)
+
+if '--offline' in sys.argv:
+    # write the records straight to the ttl files, without a triple store
+    written = records.save_ttl(metarelate)
+    for graph, count in written.iteritems():
+        print '%i records written to %s' % (count, graph)
+else:
+    with fu.FusekiServer(3131) as fu_p:
+        fu_p.load()
+        print 'load complete'
+        written = records.insert(fu_p)
+        for graph, count in written.iteritems():
+            print '%i records written to %s' % (count, graph)
+        print 'saving cached changes'
+        fu_p.save()
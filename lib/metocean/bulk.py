@@ -0,0 +1,331 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import copy
+import os
+
+import metocean.prefixes as prefixes
+import metocean.queries as queries
+
+
+CONCEPTS = 'http://metarelate.net/concepts.ttl'
+MAPPINGS = 'http://metarelate.net/mappings.ttl'
+
+# the maximum number of records written in a single INSERT DATA update
+INSERT_SIZE = 500
+
+# record type: (graph, subject namespace, rdf type, predicates omitted
+# from the hash)
+_RECORD_TYPES = {
+    'property': (CONCEPTS, 'http://www.metarelate.net/metOcean/property',
+                 'mr:Property', None),
+    'component': (CONCEPTS, 'http://www.metarelate.net/metOcean/component',
+                  'mr:Component', None),
+    'mapping': (MAPPINGS, 'http://www.metarelate.net/metOcean/mapping',
+                'mr:Mapping', ['dc:date']),
+    }
+
+# record type: the predicate selecting the stored records which may have
+# the content of a new record, in the order in which records refer to
+# one another
+_CONTENT_KEYS = [('property', 'mr:name'),
+                 ('component', 'mr:hasFormat'),
+                 ('mapping', 'mr:source')]
+
+# the statements of a stored record which are not part of its content
+_UNRECORDED = ('rdf:type', 'mr:saveCache')
+
+
+class RecordSet(object):
+    """
+    A collection of new records, keyed by subject, for bulk import.
+
+    Records are named as queries.get_property, queries.get_component
+    and queries.create_mapping name them, from the hash of the po_dict,
+    so adding a record with the same content twice creates one record.
+    As the hash follows the order of each predicate's objects, records
+    added with the same objects in different orders are distinct until
+    they are inserted into a triple store, which matches them on content.
+
+    """
+    def __init__(self):
+        # graph: {subject: (rdf type, po_dict)}, in the order added
+        self._records = collections.OrderedDict()
+        for graph, subj_pref, rdf_type, omitted in _RECORD_TYPES.values():
+            self._records.setdefault(graph, collections.OrderedDict())
+
+    def __len__(self):
+        return sum([len(records) for records in self._records.values()])
+
+    def add(self, record_type, po_dict):
+        """
+        add a record of the record_type ('property', 'component' or
+        'mapping') defined by the po_dict, returning the record's id
+
+        """
+        graph, subj_pref, rdf_type, omitted = _RECORD_TYPES[record_type]
+        sha1 = queries.make_hash(po_dict, omitted)
+        subject = '<%s/%s>' % (subj_pref, sha1)
+        if subject not in self._records[graph]:
+            po_dict = copy.deepcopy(po_dict)
+            self._records[graph][subject] = (rdf_type, po_dict)
+        return subject
+
+    def add_property(self, po_dict):
+        """add a property record, returning its id"""
+        return self.add('property', po_dict)
+
+    def add_component(self, po_dict):
+        """add a component record, returning its id"""
+        return self.add('component', po_dict)
+
+    def add_mapping(self, po_dict):
+        """add a mapping record, returning its id"""
+        return self.add('mapping', po_dict)
+
+    def add_linkage(self, linkage, mapping_p_o):
+        """
+        add the records for a mapping between two components, each
+        defined by a format and a list of property po_dicts,
+        returning the mapping id
+
+        Args:
+
+        * linkage:
+            a dictionary with 'mr:source' and 'mr:target' component
+            definitions, of the form
+            {'mr:hasFormat':format, 'mr:hasProperty':[po_dict, ...]},
+            and any other mapping predicates, such as 'mr:invertible'
+        * mapping_p_o:
+            the predicates and objects shared by all of the mappings,
+            such as 'dc:creator' and 'dc:date'
+
+        """
+        map_dict = copy.deepcopy(mapping_p_o)
+        for pred, obj in linkage.iteritems():
+            if pred in ('mr:source', 'mr:target'):
+                prop_ids = [self.add_property(prop)
+                            for prop in obj['mr:hasProperty']]
+                comp_dict = {'mr:hasFormat': obj['mr:hasFormat'],
+                             'mr:hasProperty': prop_ids}
+                map_dict[pred] = self.add_component(comp_dict)
+            else:
+                map_dict[pred] = obj
+        return self.add_mapping(map_dict)
+
+    def subjects(self, graph):
+        """returns the subjects of the records for a graph"""
+        return self._records[graph].keys()
+
+    def insert(self, fuseki_process, debug=False):
+        """
+        write the records whose content is not already in the triple
+        store to it, flagged for saving, in batched updates, and refresh
+        the current mappings; returns a dictionary of the number of
+        records written per graph
+
+        A record's content is matched, as the queries.get_* functions
+        match it, against the stored records of its type with the same
+        name, format or source, whatever their ids. A record which is
+        stored is not written, and the records referring to it are
+        written referring to the stored record instead, so are named
+        from the hash of their amended content.
+
+        """
+        # the id of each record of the set: the id of the record with
+        # its content in the triple store
+        ids = {}
+        written = {}
+        for record_type, key_pred in _CONTENT_KEYS:
+            graph, subj_pref, rdf_type, omitted = _RECORD_TYPES[record_type]
+            records = [(subject, _refer(po_dict, ids)) for subject,
+                       (rtype, po_dict) in self._records[graph].iteritems()
+                       if rtype == rdf_type]
+            keys = set()
+            for subject, po_dict in records:
+                key = po_dict.get(key_pred)
+                keys.update(key if isinstance(key, list) else [key])
+            keys.discard(None)
+            stored = _stored_contents(queries.stored_statements(
+                fuseki_process, graph, rdf_type, key_pred, keys,
+                debug=debug), omitted)
+            batch = []
+            for subject, po_dict in records:
+                content = _content(po_dict, omitted)
+                if content not in stored:
+                    stored[content] = '<%s/%s>' % (subj_pref,
+                                                   queries.make_hash(po_dict,
+                                                                     omitted))
+                    batch.append('''%s
+                %s
+                mr:saveCache "True" .''' % (stored[content],
+                                            _po_string(rdf_type, po_dict)))
+                ids[subject] = stored[content]
+            for i in range(0, len(batch), INSERT_SIZE):
+                queries.insert_records(fuseki_process, graph,
+                                       batch[i:i + INSERT_SIZE], debug=debug)
+            written[graph] = written.get(graph, 0) + len(batch)
+        if written.get(MAPPINGS):
+            queries.refresh_current_mappings(fuseki_process, debug=debug)
+        return written
+
+    def write_ttl(self, graph, path):
+        """
+        append the records for the graph which are not already in the
+        turtle file at path to it, writing each record as it is
+        serialised; a new file is started with the prefixes.
+        returns the number of records written
+
+        Without a triple store, records are only matched on their ids:
+        a record whose content the file holds under another id, such as
+        a legacy id, is written again; use insert to match on content.
+
+        """
+        existing = set()
+        if os.path.exists(path):
+            existing = ttl_subjects(path)
+        written = 0
+        with open(path, 'a') as ttl:
+            if ttl.tell() == 0:
+                ttl.write(prefixes.Prefixes().turtle)
+            for subject in self.subjects(graph):
+                if subject in existing:
+                    continue
+                rdf_type, po_dict = self._records[graph][subject]
+                ttl.write('%s\n' % subject)
+                ttl.write(' ;\n'.join(['      %s' % statement for statement in
+                                       _po_statements(rdf_type, po_dict)]))
+                ttl.write(' .\n\n')
+                written += 1
+        return written
+
+    def save_ttl(self, directory):
+        """
+        append the records to the turtle files in the directory,
+        named as the graphs they belong to, without a triple store;
+        returns a dictionary of the number of records written per graph
+
+        """
+        written = {}
+        for graph in self._records:
+            path = os.path.join(directory, graph.split('/')[-1])
+            written[graph] = self.write_ttl(graph, path)
+        return written
+
+
+def ttl_subjects(path):
+    """
+    returns the set of subjects of the statements in a turtle file,
+    written as they are by FusekiServer.save, one record per block
+    with the subject at the start of a line, as '<uri>' ids; the
+    subjects identify the records, not their content
+
+    """
+    subjects = set()
+    ttl_prefixes = dict(prefixes.Prefixes())
+    with open(path) as ttl:
+        for line in ttl:
+            if line.startswith('@prefix'):
+                elems = line.split()
+                ttl_prefixes[elems[1].rstrip(':')] = elems[2].strip('<>')
+            elif line[:1] and line[:1] not in ' \t\r\n#.@':
+                subject = line.split()[0]
+                if not subject.startswith('<'):
+                    pref, local = subject.split(':', 1)
+                    subject = '<%s%s>' % (ttl_prefixes[pref], local)
+                subjects.add(subject)
+    return subjects
+
+
+def _refer(po_dict, ids):
+    """
+    returns a copy of the po_dict, with each object which is the id of
+    a record of the set replaced by the id of its stored record
+
+    """
+    referred = {}
+    for pred, objs in po_dict.iteritems():
+        if isinstance(objs, list):
+            referred[pred] = [ids.get(obj, obj) for obj in objs]
+        else:
+            referred[pred] = ids.get(objs, objs)
+    return referred
+
+def _content(po_dict, omitted=None):
+    """
+    returns the content of a record, the set of its (predicate, object)
+    statements, other than those of omitted predicates, each written as
+    it is returned by a query: predicates and other URIs in full, in
+    angle brackets, numbers bare and other literals quoted
+
+    """
+    omitted = omitted or []
+    statements = set()
+    for pred, objs in po_dict.iteritems():
+        if pred in omitted:
+            continue
+        if not isinstance(objs, list):
+            objs = [objs]
+        for obj in objs:
+            statements.add((queries.query_form(pred),
+                            queries.query_form(obj)))
+    return frozenset(statements)
+
+def _stored_contents(statements, omitted=None):
+    """
+    returns a dictionary of the ids of stored records keyed by their
+    content, from their ?record ?p ?o statements
+
+    """
+    ignored = set([queries.query_form(pred) for pred in
+                   list(_UNRECORDED) + list(omitted or [])])
+    records = collections.defaultdict(set)
+    for statement in statements:
+        objs = statement['o']
+        if not isinstance(objs, list):
+            objs = [objs]
+        if statement['p'] not in ignored:
+            for obj in objs:
+                records[statement['record']].add((statement['p'], obj))
+        else:
+            records[statement['record']]
+    contents = {}
+    for record, content in sorted(records.iteritems()):
+        contents.setdefault(frozenset(content), record)
+    return contents
+
+def _po_statements(rdf_type, po_dict):
+    """returns the list of 'predicate object' statements for a record"""
+    statements = ['rdf:type %s' % rdf_type]
+    for pred in sorted(po_dict):
+        objs = po_dict[pred]
+        if not isinstance(objs, list):
+            objs = [objs]
+        for obj in objs:
+            statements.append('%s %s' % (pred, obj))
+    return statements
+
+def _po_string(rdf_type, po_dict):
+    """
+    returns the 'predicate object ;' statements for a record,
+    as they are written by the queries.get_* functions
+
+    """
+    statements = ['%s ;' % statement for statement in
+                  _po_statements(rdf_type, po_dict)]
+    return '\n                '.join(statements)
@@ -16,16 +16,22 @@
 # along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
 
 
+import collections
 import ConfigParser
+import errno
 import glob
+import hashlib
+import httplib
 import json
 import os
+import shutil
 import socket
 import subprocess
 import sys
+import tempfile
+import threading
 import time
 import urllib
-import urllib2
 
 import metocean.prefixes as prefixes
 import metocean.queries as queries
@@ -41,6 +47,18 @@ TDB = parser.get('metocean','TDB')
 JENAROOT = parser.get('metocean','jenaroot')
 FUSEKIROOT = parser.get('metocean','fusekiroot')
 DATASET = '/metocean'
+# optional: a folder of pre-built TDBs, keyed by the STATICDATA contents,
+# and the total size in bytes it may grow to
+SNAPSHOTS = None
+if parser.has_option('metocean', 'snapshots'):
+    SNAPSHOTS = parser.get('metocean', 'snapshots')
+SNAPSHOT_LIMIT = 2 * 1024**3
+if parser.has_option('metocean', 'snapshotlimit'):
+    SNAPSHOT_LIMIT = parser.getint('metocean', 'snapshotlimit')
+# bytes read from the socket at a time by streamed queries
+STREAM_CHUNK_SIZE = 65536
+# the content hashes of the ttl files the graphs in the TDB were loaded from
+MANIFEST = os.path.join(TDB, 'staticData.manifest')
 
 os.environ['JENAROOT'] = JENAROOT
 os.environ['FUSEKI_HOME'] = FUSEKIROOT
@@ -50,12 +68,62 @@ class FusekiServer(object):
     """
     A class to represent an instance of a process managing
     a triple database and a Fuseki Server
-    
+
+    Queries and updates are sent over a pool of persistent
+    HTTP connections to the server.  The server is taken to be up
+    while those connections succeed; a failure to connect restarts it.
+
+    Args:
+
+    * port:
+        the port the Fuseki server listens on
+    * host:
+        the host the Fuseki server runs on
+    * pool_size:
+        the maximum number of idle connections kept open for reuse
+    * idle_timeout:
+        the number of seconds an idle connection is kept open for reuse
+    * heartbeat:
+        if set, the interval in seconds at which a background thread
+        checks the server is responding, between queries
+    * cache_size:
+        the maximum number of retrieved records held in memory for reuse;
+        the cache is emptied by any update to the triple database
+    * snapshots:
+        a folder in which to keep copies of loaded TDBs, keyed by the
+        contents of the STATICDATA files, for load to restore rather
+        than rebuild; None disables snapshots
+    * snapshot_limit:
+        the total size, in bytes, of the snapshots to keep; the least
+        recently used are removed first
+
     """
-    def __init__(self, port, host='localhost'):
+    def __init__(self, port, host='localhost', pool_size=4, idle_timeout=30,
+                 heartbeat=None, cache_size=10000, snapshots=SNAPSHOTS,
+                 snapshot_limit=SNAPSHOT_LIMIT):
         self._process = None
+        self._snapshots = snapshots
+        self._snapshot_limit = snapshot_limit
         self._port = port
         self._host = host
+        self._pool = _ConnectionPool(host, port, pool_size, idle_timeout)
+        self._records = _RecordCache(cache_size)
+        self._heartbeat = heartbeat
+        self._heartbeat_thread = None
+        self._heartbeat_stop = None
+        self._health = {'alive': None, 'last_contact': None, 'restarts': 0}
+        self._revision = 0
+        self._generation = 0
+        self._validation_lock = threading.Lock()
+        self._validation = {'running': False, 'check': None, 'completed': 0,
+                            'checks': len(_VALIDATIONS), 'started': None,
+                            'finished': None, 'revision': None,
+                            'results': None, 'incremental': False,
+                            'error': None}
+        # the mappings, and the sources they map, which have changed
+        # since the last validation; None if all of them may have
+        self._touched = None
+        self._vocabulary = None
         
     def __enter__(self):
         self.start()
@@ -88,7 +156,13 @@ class FusekiServer(object):
                 time.sleep(0.1)
                 if i > 1000:
                     raise RuntimeError('Fuseki server not started up correctly')
-
+        self._health['alive'] = True
+        if self._heartbeat and not self._heartbeat_thread:
+            self._heartbeat_stop = threading.Event()
+            self._heartbeat_thread = threading.Thread(
+                target=self._beat, args=(self._heartbeat_stop,))
+            self._heartbeat_thread.daemon = True
+            self._heartbeat_thread.start()
 
 
     def stop(self, save=False):
@@ -97,13 +171,18 @@ class FusekiServer(object):
         """
         if save:
             self.save_cache()
+        if self._heartbeat_thread:
+            self._heartbeat_stop.set()
+            self._heartbeat_thread = None
+        self._pool.clear()
         if self._process:
             print 'stopping'
             self._process.terminate()
             self._process = None
+            self._health['alive'] = False
             i = 0
             while self._check_port():
-                i += i
+                i += 1
                 time.sleep(0.1)
                 if i > 1000:
                     raise RuntimeError('Fuseki server not shut down correctly')
@@ -113,6 +192,16 @@ class FusekiServer(object):
         """check status of instance (is it up?)"""
         return self._check_port()
 
+    def health(self):
+        """
+        returns a dictionary describing the server's health, as observed
+        from queries and heartbeats, without contacting the server:
+        whether it was up at last contact, the time of the last successful
+        contact and the number of restarts following connection failures
+
+        """
+        return dict(self._health)
+
     def _check_port(self):
         s = socket.socket() 
         #print "Attempting to connect to %s on port %s." %(address, port)
@@ -124,6 +213,21 @@ class FusekiServer(object):
             #print "Connecting to %s on port %s failed with
             # the following error: %s" %(address, port, e) 
             return False
+        finally:
+            s.close()
+
+    def _beat(self, stop):
+        """
+        heartbeat thread target: run a trivial query at each interval,
+        recording whether the server responds, until the stop event is set
+
+        """
+        body = urllib.urlencode([('query', 'ASK {}'), ('output', 'json')])
+        while not stop.wait(self._heartbeat):
+            try:
+                self._post('%s/query' % DATASET, body, restart=False)
+            except RuntimeError:
+                pass
 
 
     def clean(self):
@@ -133,6 +237,16 @@ class FusekiServer(object):
         """
         if self._process:
             self.stop()
+        self._reloaded()
+        return self._remove_tdb()
+
+    def _remove_tdb(self):
+        """
+        helper method
+        remove the TDB files, the server being stopped, returning
+        any which remain
+
+        """
         for TDBfile in glob.glob("%s*"% TDB):
             os.remove(TDBfile)
         return glob.glob("%s*"% TDB)
@@ -145,6 +259,7 @@ class FusekiServer(object):
         remove saveCache flags after saving
         
         """
+        self._note_cached_mappings()
         maingraph = 'metarelate.net'
         for subgraph in glob.glob(os.path.join(STATICDATA, maingraph, '*.ttl')):
             graph = 'http://%s/%s' % (maingraph, subgraph.split('/')[-1])
@@ -164,11 +279,14 @@ class FusekiServer(object):
         as the saved ttl files
         
         """
+        self._note_cached_mappings()
         maingraph = 'metarelate.net'
         for infile in glob.glob(os.path.join(STATICDATA, maingraph, '*.ttl')):
             ingraph = infile.split('/')[-1]
             graph = 'http://%s/%s' % (maingraph, ingraph)
             revert_string = queries.revert_cache(self, graph)
+        queries.refresh_current_mappings(self)
+        self._invalidate()
 
 
     def query_cache(self):
@@ -186,51 +304,342 @@ class FusekiServer(object):
         return results
 
 
-    def load(self):
+    def load(self, incremental=False):
         """
         load data from all the ttl files in the STATICDATA folder into a new TDB
 
+        If snapshots are enabled and a TDB has been loaded from identical
+        files before, a copy of it is restored instead; a newly loaded
+        TDB is added to the snapshots.
+
+        A server started by this FusekiServer is stopped while the TDB is
+        loaded and started again afterwards. A server on the port which
+        this FusekiServer did not start may have the TDB open, so the
+        load is refused.
+
+        Args:
+
+        * incremental:
+            if the TDB has been loaded before, only drop and reload the
+            graphs whose ttl files have changed, been added or been removed
+            since, and revert unsaved changes in the other metocean graphs,
+            rather than building a new TDB
+
+        """
+        if self._process is None and self._check_port():
+            ec = 'A Fuseki server not started by this process is running '\
+                 'on {}:{}; stop it before loading the TDB'
+            raise RuntimeError(ec.format(self._host, self._port))
+        running = self._process is not None
+        if running:
+            self.stop()
+        manifest = _static_manifest()
+        key = _manifest_key(manifest)
+        self._reloaded()
+        if not (self._snapshots and self._restore_snapshot(key)):
+            self._load_tdb(manifest, key, incremental)
+        if running:
+            self.start()
+
+    def _load_tdb(self, manifest, key, incremental):
+        """
+        helper method
+        load the graphs of the manifest into the TDB, the server being
+        stopped, and add the TDB to the snapshots
+
+        """
+        loaded = None
+        if incremental:
+            loaded = _read_manifest()
+        if loaded is None:
+            print 'clean:'
+            self._remove_tdb()
+            changed = sorted(manifest)
+        else:
+            changed = sorted([graph for graph in manifest if
+                              loaded.get(graph) != manifest[graph]['sha1']])
+            removed = sorted(set(loaded).difference(manifest))
+            print 'reloading:', ' '.join(changed)
+            print 'dropping:', ' '.join(removed)
+        self._invalidate()
+        if os.path.exists(MANIFEST):
+            os.remove(MANIFEST)
+        if loaded is not None:
+            tdb = _TDBUpdate()
+            for graph in changed + removed:
+                queries.drop_graph(tdb, graph)
+            for graph in sorted(manifest):
+                if graph not in changed and \
+                   graph.startswith('http://metarelate.net/'):
+                    queries.revert_cache(tdb, graph)
+            tdb.commit()
+        _load_graphs(dict([(graph, manifest[graph]['file'])
+                           for graph in changed]))
+        tdb = _TDBUpdate()
+        queries.refresh_current_mappings(tdb)
+        tdb.commit()
+        _write_manifest(manifest)
+        if self._snapshots:
+            self._store_snapshot(key)
+
+    def _restore_snapshot(self, key):
         """
-        print 'clean:'
-        self.clean()
-        for ingraph in glob.glob(os.path.join(STATICDATA, '*')):
-            graph = ingraph.split('/')[-1] + '/'
-            for infile in glob.glob(os.path.join(ingraph, '*.ttl')):
-                subgraph = infile.split('/')[-1]
-                space = ' '
-                loadCall = [JENAROOT + '/bin/tdbloader',
-                            '--graph=http://%s%s' % (graph,subgraph),
-                            '--loc=%s'% TDB, infile]
-                print space.join(loadCall)
-                subprocess.check_call(loadCall)
+        replace the TDB with a copy of the snapshot for the key,
+        returning False if there is no such snapshot
+
+        """
+        snapshot = os.path.join(self._snapshots, key)
+        if not os.path.isdir(snapshot):
+            return False
+        print 'restoring snapshot', snapshot
+        self._remove_tdb()
+        self._invalidate()
+        _copy_tdb(snapshot, TDB)
+        # the modification time orders the snapshots by last use
+        os.utime(snapshot, None)
+        return True
+
+    def _store_snapshot(self, key):
+        """
+        copy the TDB into the snapshot for the key, then remove the least
+        recently used snapshots beyond the size limit
+
+        """
+        snapshot = os.path.join(self._snapshots, key)
+        if os.path.isdir(snapshot):
+            return
+        if not os.path.isdir(self._snapshots):
+            os.makedirs(self._snapshots)
+        # copy to a temporary folder first, so a snapshot is never partial
+        partial = tempfile.mkdtemp(dir=self._snapshots, prefix='.partial')
+        try:
+            _copy_tdb(TDB, partial)
+            os.rename(partial, snapshot)
+        finally:
+            if os.path.isdir(partial):
+                shutil.rmtree(partial)
+        print 'stored snapshot', snapshot
+        snapshots = []
+        for name in os.listdir(self._snapshots):
+            path = os.path.join(self._snapshots, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum([os.path.getsize(os.path.join(path, tdbfile))
+                        for tdbfile in os.listdir(path)])
+            snapshots.append((os.path.getmtime(path), size, path))
+        snapshots.sort()
+        total = sum([snap[1] for snap in snapshots])
+        # always keep the newest snapshot
+        for mtime, size, path in snapshots[:-1]:
+            if total <= self._snapshot_limit:
+                break
+            print 'removing snapshot', path
+            shutil.rmtree(path)
+            total -= size
 
 
-    def validate(self):
+    def validate(self, progress=None, touched=None):
         """
         run the validation queries
+
+        Args:
+
+        * progress:
+            if set, a function called with the number of checks
+            completed and the description of each check as it starts
+        * touched:
+            if set, a dictionary of the 'mappings' and 'sources' to
+            limit the checks to
+
         """
         failures = {}
-        mm_string = 'The following mappings are ambiguous, providing multiple '\
-                    'targets in the same format for a particular source'
-        failures[mm_string] = queries.multiple_mappings(self)
-        invalid_vocab = 'The following mappings contain an undeclared URI'
-        failures[invalid_vocab] = queries.valid_vocab(self)
+        for completed, validation in enumerate(_VALIDATIONS):
+            description, check, keyword, scope, key = validation
+            if progress:
+                progress(completed, description)
+            if touched is None:
+                failures[description] = check(self)
+            else:
+                failures[description] = check(self,
+                                              **{keyword: touched[scope]})
         return failures
 
+    def _note_cached_mappings(self):
+        """
+        add the mappings flagged as unsaved, and the mappings they
+        replace, with their sources and targets, to those changed
+        since the last validation
+
+        """
+        if self._touched is None:
+            return
+        links = queries.cached_mapping_links(self)
+        with self._validation_lock:
+            if self._touched is not None:
+                for link in links:
+                    self._touched['mappings'].add(link['mapping'])
+                    self._touched['sources'].add(link['source'])
+                    self._touched['sources'].add(link['target'])
+
+    def _take_touched(self):
+        """
+        returns the mappings and sources changed since the last
+        validation, or None if they are not known, and starts
+        tracking changes afresh
+
+        """
+        self._note_cached_mappings()
+        with self._validation_lock:
+            touched = self._touched
+            self._touched = {'mappings': set(), 'sources': set()}
+        return touched
+
+    def revision(self):
+        """
+        returns the revision of the triple database, which is
+        increased by every update, load and revert
+
+        """
+        return self._revision
+
+    def generation(self):
+        """
+        returns the generation of the triple database, which is
+        increased each time the data is loaded afresh, or cleaned;
+        data which changes only on load may be kept for a generation
+
+        """
+        return self._generation
+
+    def vocabulary(self):
+        """
+        returns the set of URIs declared by the vocabularies: the
+        subjects of the third party vocabulary graphs.
+        The set is retrieved once for each load of the data.
+
+        """
+        vocabulary = self._vocabulary
+        if vocabulary is None:
+            vocabulary = frozenset([result['subject'] for result in
+                                    queries.vocabulary_subjects(self)])
+            self._vocabulary = vocabulary
+        return vocabulary
+
+    def _reloaded(self):
+        """
+        forget the vocabulary and the changes since the last validation,
+        and start a new generation, as the data is being loaded afresh,
+        so every mapping must be validated again
+
+        """
+        self._touched = None
+        self._vocabulary = None
+        self._generation += 1
+
+    def _invalidate(self):
+        """
+        record a change to the triple database,
+        emptying the record cache
+
+        """
+        self._revision += 1
+        self._records.clear()
+
+    def start_validation(self, incremental=False):
+        """
+        start running the validation queries in a background thread,
+        unless a validation is already running;
+        returns whether a validation was started
+
+        Args:
+
+        * incremental:
+            only check the mappings changed, created or reverted since the
+            last validation, and the sources they map, merging the
+            results into those of the last validation; all the mappings
+            are checked if there are no previous results, or the data
+            has been loaded since
+
+        """
+        with self._validation_lock:
+            if self._validation['running']:
+                return False
+            self._validation.update({'running': True, 'check': None,
+                                     'completed': 0, 'started': time.time(),
+                                     'error': None})
+        thread = threading.Thread(target=self._run_validation,
+                                  args=(incremental,))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _run_validation(self, incremental=False):
+        """
+        background validation thread target: validate, recording
+        progress and then the results in the validation status
+
+        """
+        revision = self._revision
+        def progress(completed, description):
+            with self._validation_lock:
+                self._validation['completed'] = completed
+                self._validation['check'] = description
+        with self._validation_lock:
+            previous = self._validation['results']
+        try:
+            touched = self._take_touched()
+            if not incremental or previous is None or touched is None:
+                touched = None
+            results = self.validate(progress, touched)
+            if touched is not None:
+                results = _merge_validation(previous, results, touched)
+        except Exception, e:
+            with self._validation_lock:
+                # the changes since the last validation are no longer known
+                self._touched = None
+                self._validation.update({'running': False, 'check': None,
+                                         'error': str(e)})
+            return
+        with self._validation_lock:
+            self._validation.update({'running': False, 'check': None,
+                                     'completed': len(_VALIDATIONS),
+                                     'finished': time.time(),
+                                     'revision': revision,
+                                     'results': results,
+                                     'incremental': touched is not None})
+
+    def validation_status(self):
+        """
+        returns a dictionary describing the background validation:
+        whether it is 'running', the 'check' in progress, the number of
+        checks 'completed' of the number of 'checks', the time the last
+        validation 'started', the 'results' of the last validation to
+        complete and the time it 'finished', the 'revision' of the triple
+        database they were computed against and whether that is still the
+        'current' revision, whether they were 'incremental', and the
+        'error' which stopped the last run, if any
+
+        """
+        with self._validation_lock:
+            status = dict(self._validation)
+        status['current'] = status['revision'] == self._revision
+        return status
+
 
-    def run_query(self, query_string, output='json', update=False, debug=False):
+    def run_query(self, query_string, output='json', update=False,
+                  debug=False, stream=False, rows=False):
         """
         run a query_string on the FusekiServer instance
         return the results
-        
+
+        If stream is True, a json query returns a generator which
+        yields each result as it is parsed from the response, rather
+        than a list.  The query is sent when iteration begins.
+
+        If rows is True, a json query returns each result as a Row of
+        typed Terms rather than as a dictionary of strings.
+
         """
-        if not self.status():
-            self.stop()
-            self.start()
-        # use null ProxyHandler to ignore proxy for localhost access
-        proxy_support = urllib2.ProxyHandler({})
-        opener = urllib2.build_opener(proxy_support)
-        urllib2.install_opener(opener)
         pre = prefixes.Prefixes()
         if debug == True:
             k=0
@@ -239,55 +648,309 @@ class FusekiServer(object):
                 k+=1
             for i, line in enumerate(query_string.split('\n')):
                 print i+k, line
+        query = "%s %s" % (pre.sparql, query_string)
+        if stream and output == "json" and not update:
+            return self._stream_request(query, rows)
         if update:
-            action = 'update'
-            qstr = urllib.urlencode([
-                (action, "%s %s" % (pre.sparql, query_string))])
+            # records are only cached between updates: none read while
+            # an update runs is kept, as it may predate the update
+            self._records.begin_update()
+            try:
+                data = self._request(query, output, update)
+            finally:
+                # clear the cache once the update is applied, so records
+                # read before it are not found afterwards
+                self._invalidate()
+                self._records.end_update()
         else:
-            action = 'query'
-            qstr = urllib.urlencode([
-                (action, "%s %s" % (pre.sparql, query_string)),
-                ("output", output),
-                ("stylesheet","/static/xml-to-html-links.xsl")])
-        BASEURL = "http://%s:%i%s/%s?" % (self._host, self._port,
-                                          DATASET, action)
-        data = ''
-        try:
-            data = opener.open(urllib2.Request(BASEURL), qstr).read()
-        except urllib2.URLError as err:
-            ec = 'Error connection to Fuseki server on {}.\n server returned {}'
-            ec.format(BASEURL, err)
-            ec += .format(err)
-            raise RuntimeError(ec)
-            # self.stop()
-            # self.start()
-            # try:
-            #     trydata = opener.open(urllib2.Request(BASEURL)).read()
-            # except urllib2.URLError as err2:
-            #     ec += ec + '\n' + '{}'.format(err2)
-            #     raise RuntimeError(ec)
-        if output == "json":
+            data = self._request(query, output, update)
+        if output == "json" and rows:
+            return process_rows(data)
+        elif output == "json":
             return process_data(data)
         elif output == "text":
             return data
         else:
             return data
 
+    def _request(self, query, output='json', update=False):
+        """
+        send a query, or an update, to the server and return the
+        response body; the transport used by run_query
+
+        _request, with _stream_request, is the hook for other
+        backends: a subclass overriding them, such as the
+        memory.MemoryServer, runs queries against its own store and
+        keeps the prefixes, caching and processing of run_query.
+
+        """
+        path, body = _encode_request(query, output, update)
+        return self._post(path, body)
+
+    def _stream_request(self, query, rows=False):
+        """
+        send a json query to the server and return a generator of the
+        processed results, as dictionaries or as Rows; the transport
+        used by run_query for streamed queries
+
+        """
+        path, body = _encode_request(query, 'json', False)
+        return self._stream(path, body, rows)
+
+    def _post(self, path, body, restart=True):
+        """
+        POST the url encoded body to the path on the Fuseki server,
+        using a pooled connection, and return the response body.
+
+        """
+        conn, response = self._open(path, body, restart)
+        try:
+            data = response.read()
+        except (httplib.HTTPException, socket.error):
+            self._pool.discard(conn)
+            raise
+        self._close(conn, response)
+        return data
+
+    def _stream(self, path, body, rows=False):
+        """
+        POST the url encoded body to the path on the Fuseki server and
+        yield the processed results, as dictionaries or as Rows,
+        as the response is read.
+        The connection is only returned to the pool once the response
+        has been read to the end; an abandoned stream closes it.
+
+        """
+        conn, response = self._open(path, body)
+        complete = False
+        try:
+            chunks = iter(lambda: response.read(STREAM_CHUNK_SIZE), '')
+            if rows:
+                results = process_row_stream(chunks)
+            else:
+                results = process_stream(chunks)
+            for result in results:
+                yield result
+            # drain the remainder of the document so the connection
+            # can be reused
+            for chunk in chunks:
+                pass
+            complete = True
+        finally:
+            if complete:
+                self._close(conn, response)
+            else:
+                self._pool.discard(conn)
+
+    def _open(self, path, body, restart=True):
+        """
+        POST the url encoded body to the path on the Fuseki server,
+        using a pooled connection, and return the connection and the
+        response, ready to be read.
+        A reused connection which fails before the request is sent, or,
+        for a query, which is closed without a response, is assumed to
+        have been closed by the server whilst idle, and the request is
+        retried.
+        If a new connection fails the server is marked as down and,
+        if restart is True, restarted once before retrying.
+        An update which fails once it has been sent is never retried,
+        as the server may have applied it.
+
+        """
+        update = path.endswith('/update')
+        restarted = not restart
+        while True:
+            conn, reused = self._pool.acquire()
+            sent = False
+            try:
+                conn.request('POST', path, body, _POST_HEADERS)
+                sent = True
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error) as err:
+                self._pool.discard(conn)
+                if reused and (not sent or
+                               (not update and _unanswered(err))):
+                    continue
+                self._health['alive'] = False
+                if sent and update:
+                    ec = 'Error sending an update to the Fuseki server on '\
+                         '{}:{}{}; it may not have been applied.\n'\
+                         ' server returned {}'
+                    ec = ec.format(self._host, self._port, path, err)
+                    raise RuntimeError(ec)
+                if not restarted:
+                    restarted = True
+                    self._health['restarts'] += 1
+                    self.stop()
+                    self.start()
+                    continue
+                ec = 'Error connecting to Fuseki server on {}:{}{}.\n'\
+                     ' server returned {}'
+                ec = ec.format(self._host, self._port, path, err)
+                raise RuntimeError(ec)
+            self._health['alive'] = True
+            self._health['last_contact'] = time.time()
+            if response.status >= 400:
+                data = response.read()
+                self._close(conn, response)
+                ec = 'Error from Fuseki server on {}:{}{}.\n'\
+                     ' server returned {} {}\n{}'
+                ec = ec.format(self._host, self._port, path, response.status,
+                               response.reason, data)
+                raise RuntimeError(ec)
+            return conn, response
+
+    def _close(self, conn, response):
+        """return a connection, whose response has been read, to the pool"""
+        if response.will_close:
+            self._pool.discard(conn)
+        else:
+            self._pool.release(conn)
 
+    def connection_stats(self):
+        """
+        returns a dictionary of counts of the connections created,
+        reused and discarded by the connection pool, and of the
+        connections currently idle in the pool
 
-    def retrieve_mappings(self, s_format, t_format):
+        """
+        return self._pool.statistics()
+
+    def cache_stats(self):
+        """
+        returns a dictionary of the hits and misses on the record cache,
+        the number of times it has been emptied by updates and the
+        number of records it holds
+
+        """
+        return self._records.statistics()
+
+    def retrieve_mappings(self, s_format, t_format, batch=True):
         """
         return the format specific mappings for a particular source
         and target format
 
+        Args:
+
+        * batch:
+            fetch all of the records the mappings reference in a small
+            number of batched queries before assembling the mappings,
+            rather than querying for each record in turn
+
         """
         mappings = queries.valid_ordered_mappings(self, s_format, t_format)
+        records = None
+        if batch:
+            records = self._prefetch_records(mappings)
         mapping_list = []
         for mapping in mappings:
-            mapping_list.append(self.structured_mapping(mapping))
+            mapping_list.append(self.structured_mapping(mapping, records))
         return mapping_list
 
-    def _retrieve_component(self, c_id):
+    def _prefetch_records(self, mappings):
+        """
+        returns a dictionary, keyed by record type, of dictionaries
+        of records keyed by record id, for every record reachable from
+        the list of mappings.
+        each record type is retrieved in batches, one pass of queries per
+        level of nesting, rather than one query per record.
+        ids which are known not to identify a record map to None.
+
+        """
+        records = dict([(kind, {}) for kind in _RECORD_KINDS])
+        pending = dict([(kind, set()) for kind in _RECORD_KINDS])
+        for mapping in mappings:
+            for role in ['source', 'target']:
+                _add_ids(pending['component'], mapping.get(role))
+            _add_ids(pending['valueMap'], mapping.get('valueMaps'))
+        while any(pending.values()):
+            found = {}
+            for kind in _RECORD_KINDS:
+                ids = pending[kind].difference(records[kind])
+                pending[kind] = set()
+                if ids:
+                    found[kind] = self._batch_records(kind, ids, records)
+            for record in found.get('component', []):
+                _add_ids(pending['property'], record.get('property'))
+                _add_ids(pending['component'], record.get('subComponent'))
+            for record in found.get('property', []):
+                _add_ids(pending['component'], record.get('component'))
+            for record in found.get('valueMap', []):
+                _add_ids(pending['value'], record.get('source'))
+                _add_ids(pending['value'], record.get('target'))
+            for record in found.get('value', []):
+                for role in ['subject', 'object']:
+                    pid = record.get(role)
+                    if not isinstance(pid, basestring):
+                        continue
+                    elif not pid.startswith('<'):
+                        # a literal cannot identify a scopedProperty
+                        records['scopedProperty'][pid] = None
+                    else:
+                        pending['scopedProperty'].add(pid)
+                        if pid.startswith(_VALUE_PREFIX):
+                            pending['value'].add(pid)
+            for record in found.get('scopedProperty', []):
+                _add_ids(pending['property'], record.get('hasProperty'))
+        return records
+
+    def _batch_records(self, kind, ids, records):
+        """
+        retrieve the records of one kind for a set of ids in batched
+        queries, adding them to the records dictionary;
+        returns the list of records retrieved
+
+        """
+        retrieved = []
+        uncached = []
+        for rid in ids:
+            found, record = self._records.get((kind, rid))
+            if found:
+                records[kind][rid] = record
+                if record is not None:
+                    retrieved.append(record)
+            else:
+                uncached.append(rid)
+        if not uncached:
+            return retrieved
+        generation = self._records.generation
+        results = _RECORD_BATCH_QUERIES[kind](self, uncached)
+        by_id = {}
+        for result in results:
+            by_id.setdefault(result.get(kind), []).append(result)
+        for rid in uncached:
+            matches = by_id.get(rid, [])
+            if len(matches) == 1:
+                records[kind][rid] = matches[0]
+                retrieved.append(matches[0])
+                self._records.put((kind, rid), matches[0], generation)
+            elif not matches:
+                records[kind][rid] = None
+                self._records.put((kind, rid), None, generation)
+            # malformed records are left out, so that retrieving them
+            # individually raises the usual error
+        return retrieved
+
+    def _retrieve_record(self, kind, rid, records=None):
+        """
+        returns the record of the given kind for the id, using the
+        prefetched records or the record cache where available,
+        or querying for it otherwise
+
+        """
+        if records is not None and rid in records[kind]:
+            record = records[kind][rid]
+        else:
+            found, record = self._records.get((kind, rid))
+            if not found:
+                generation = self._records.generation
+                record = _RECORD_QUERIES[kind](self, rid)
+                self._records.put((kind, rid), record, generation)
+        if record is not None:
+            record = dict(record)
+        return record
+
+    def _retrieve_component(self, c_id, records=None):
         """
         returns a dictionary of component information
         recursive call to get all the nested formatConcept
@@ -295,7 +958,7 @@ class FusekiServer(object):
         
         """
         # c_dict = {'formatConcept':'', 'mr:format': '', 'skos:member': []},
-        top_c = queries.retrieve_component(self, c_id)
+        top_c = self._retrieve_record('component', c_id, records)
         if top_c:
             c_dict = {'component':c_id, 'mr:hasFormat': top_c['format']}
             if isinstance(top_c.get('property'), str):
@@ -307,12 +970,13 @@ class FusekiServer(object):
             if top_c.get('subComponent'):
                 c_dict['mr:hasComponent'] = []
             for aproperty in top_c.get('property', []):
-                prop_dict = queries.retrieve_property(self, aproperty)
+                prop_dict = self._retrieve_record('property', aproperty,
+                                                  records)
                 pref_prop_dict = {}
                 #pcomp = prop_dict.get('mr:hasComponent')
                 pcomp = prop_dict.get('component') 
                 if pcomp:
-                    comp = self._retrieve_component(pcomp)
+                    comp = self._retrieve_component(pcomp, records)
                     pref_prop_dict['mr:hasComponent'] = comp
                 if prop_dict.get('name'):
                     pref_prop_dict['mr:name'] = prop_dict['name']
@@ -322,17 +986,17 @@ class FusekiServer(object):
                     pref_prop_dict['rdf:value'] = prop_dict['value']
                 c_dict['mr:hasProperty'].append(pref_prop_dict)
             for component in top_c.get('subComponent',[]):
-                subc_dict = self._retrieve_component(component)
+                subc_dict = self._retrieve_component(component, records)
                 c_dict['mr:hasComponent'].append(subc_dict)
             if top_c.get('mediates'):
                 c_dict['dc:mediator'] = [top_c['mediates']]
             if top_c.get('requires'):
                 c_dict['dc:requires'] = top_c['requires']
         else:
-            raise ValueError('{} a malformed formatConcept'.format(fc_id))
+            raise ValueError('{} a malformed formatConcept'.format(c_id))
         return c_dict
 
-    def _retrieve_value_map(self, valmap_id, inv):
+    def _retrieve_value_map(self, valmap_id, inv, records=None):
         """
         returns a dictionary of valueMap information
         
@@ -345,7 +1009,7 @@ class FusekiServer(object):
             raise ValueError('inv = {}, not "True" or "False"'.format(inv))
         #print '_retrieve_value_map'
         value_map = {'valueMap':valmap_id, 'mr:source':{}, 'mr:target':{}}
-        vm_record = queries.retrieve_valuemap(self, valmap_id)
+        vm_record = self._retrieve_record('valueMap', valmap_id, records)
         if inv:
             value_map['mr:source']['value'] = vm_record['target']
             value_map['mr:target']['value'] = vm_record['source']
@@ -353,23 +1017,24 @@ class FusekiServer(object):
             value_map['mr:source']['value'] = vm_record['source']
             value_map['mr:target']['value'] = vm_record['target']
         for role in ['mr:source', 'mr:target']:
-            value_map[role] = self._retrieve_value(value_map[role]['value'])
+            value_map[role] = self._retrieve_value(value_map[role]['value'],
+                                                   records)
 
         return value_map
 
-    def _retrieve_value(self, val_id):
+    def _retrieve_value(self, val_id, records=None):
         """
         returns a dictionary from a val_id
         
         """
         value_dict = {'value':val_id}
-        val = queries.retrieve_value(self, val_id)
+        val = self._retrieve_record('value', val_id, records)
         for key in val.keys():
             value_dict['mr:{}'.format(key)] = val[key]
         for sc_prop in ['mr:subject', 'mr:object']:
             pid = value_dict.get(sc_prop)
             if pid:
-                prop = queries.retrieve_scoped_property(self, pid)
+                prop = self._retrieve_record('scopedProperty', pid, records)
                 if prop:
                     value_dict[sc_prop] = {}
                     for pkey in prop:
@@ -377,22 +1042,24 @@ class FusekiServer(object):
                         value_dict[sc_prop]['mr:{}'.format(pkey)] = pv
                         if pkey == 'hasProperty':
                             pr = value_dict[sc_prop]['mr:{}'.format(pkey)]
-                            aprop = queries.retrieve_property(self, pr)
+                            aprop = self._retrieve_record('property', pr,
+                                                          records)
                             value_dict[sc_prop]['mr:{}'.format(pkey)] = {'property':pv}
                             for p in aprop:
                                 value_dict[sc_prop]['mr:{}'.format(pkey)]['mr:{}'.format(p)] = aprop[p]
-                elif pid.startswith('<http://www.metarelate.net/metOcean/value/'):
-                    newval = self._retrieve_value(pid)
+                elif pid.startswith(_VALUE_PREFIX):
+                    newval = self._retrieve_value(pid, records)
                     value_dict[sc_prop] = newval
                 else:
                     value_dict[sc_prop] = pid
         return value_dict
 
 
-    def structured_mapping(self, mapping):
+    def structured_mapping(self, mapping, records=None):
         """
         returns the json for a mapping, fully expanded
         from the mapping Id
+        optionally using a dictionary of prefetched records
         
         """
         referrer = {'mapping': mapping['mapping'],
@@ -400,17 +1067,436 @@ class FusekiServer(object):
                     'mr:target': {'component': mapping['target']},
                     'mr:hasValueMap': []}
         if mapping.get('source') and mapping.get('target'):
-            referrer['mr:source'] = self._retrieve_component(mapping['source'])
-            referrer['mr:target'] = self._retrieve_component(mapping['target'])
+            referrer['mr:source'] = self._retrieve_component(mapping['source'],
+                                                             records)
+            referrer['mr:target'] = self._retrieve_component(mapping['target'],
+                                                             records)
             if mapping.get('valueMaps'):
                 if isinstance(mapping['valueMaps'], str):
                     mapping['valueMaps'] = [mapping['valueMaps']]
                 for valmap in mapping['valueMaps']:#.split('&'):
-                    referrer['mr:hasValueMap'].append(self._retrieve_value_map(valmap, mapping['inverted']))
+                    referrer['mr:hasValueMap'].append(self._retrieve_value_map(valmap, mapping['inverted'], records))
         return referrer
 
 
+# the kinds of record, each named for the query binding holding its id
+_RECORD_KINDS = ['component', 'property', 'valueMap', 'value',
+                 'scopedProperty']
+
+_RECORD_QUERIES = {'component': queries.retrieve_component,
+                   'property': queries.retrieve_property,
+                   'valueMap': queries.retrieve_valuemap,
+                   'value': queries.retrieve_value,
+                   'scopedProperty': queries.retrieve_scoped_property}
+
+_RECORD_BATCH_QUERIES = {'component': queries.retrieve_components,
+                         'property': queries.retrieve_properties,
+                         'valueMap': queries.retrieve_valuemaps,
+                         'value': queries.retrieve_values,
+                         'scopedProperty': queries.retrieve_scoped_properties}
+
+_VALUE_PREFIX = '<http://www.metarelate.net/metOcean/value/'
+
+# the validation checks: (description of the failures, query,
+# query keyword limiting the check, the 'mappings' or 'sources' to limit
+# it to, and the result key they are found in)
+_VALIDATIONS = [('The following mappings are ambiguous, providing multiple '
+                 'targets in the same format for a particular source',
+                 queries.multiple_mappings, 'test_source', 'sources',
+                 'asource'),
+                ('The following mappings contain an undeclared URI',
+                 queries.valid_vocab, 'mappings', 'mappings', 'amap')]
+
+
+def _merge_validation(previous, results, touched):
+    """
+    returns the validation failures from a validation limited to the
+    touched mappings and sources merged into the previous failures,
+    which are replaced for those mappings and sources
+
+    """
+    merged = {}
+    for description, check, keyword, scope, key in _VALIDATIONS:
+        failures = [failure for failure in previous.get(description, [])
+                    if failure.get(key) not in touched[scope]]
+        failures.extend(results[description])
+        merged[description] = sorted(failures,
+                                     key=lambda failure: failure.get(key))
+    return merged
+
+
+def _add_ids(id_set, ids):
+    """
+    helper function
+    adds the record ids from a query result binding, which may be a
+    single id or a list of ids, to the id_set; literals are skipped
+
+    """
+    if isinstance(ids, basestring):
+        ids = [ids]
+    for rid in ids or []:
+        if rid.startswith('<'):
+            id_set.add(rid)
+
+
+_JSON_SEPARATORS = ' \t\r\n,'
+
+_POST_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded',
+                 'Connection': 'keep-alive'}
+
+
+def _unanswered(err):
+    """
+    returns whether the error from reading a response shows that the
+    connection was closed without an answer, as an idle connection
+    closed by the server is
+
+    """
+    if isinstance(err, httplib.BadStatusLine):
+        return True
+    return (isinstance(err, socket.error) and
+            err.errno in (errno.ECONNRESET, errno.EPIPE))
+
+def _encode_request(query, output='json', update=False):
+    """
+    returns the path on the Fuseki server and the url encoded body
+    for a query or update
+
+    """
+    if update:
+        action = 'update'
+        body = urllib.urlencode([(action, query)])
+    else:
+        action = 'query'
+        body = urllib.urlencode([
+            (action, query),
+            ("output", output),
+            ("stylesheet","/static/xml-to-html-links.xsl")])
+    path = '%s/%s' % (DATASET, action)
+    return path, body
+
+def _load_graphs(graph_files):
+    """
+    load ttl files into the TDB, each into its own named graph, with
+    a single tdbloader call on a TriG document built from them all
+
+    Files containing labelled blank nodes are loaded separately, as
+    the labels are only distinct within a document, as are files which
+    declare a prefix for more than one namespace, as the declarations
+    are moved before the graph.
+
+    Args:
+
+    * graph_files:
+        a dictionary of ttl file paths, keyed by graph
+
+    """
+    separate = []
+    trig = tempfile.NamedTemporaryFile(suffix='.trig', delete=False)
+    try:
+        with trig:
+            for graph in sorted(graph_files):
+                if not _write_trig_graph(trig, graph, graph_files[graph]):
+                    separate.append(graph)
+        loadCalls = [[JENAROOT + '/bin/tdbloader', '--loc=%s' % TDB,
+                      trig.name]]
+        for graph in separate:
+            loadCalls.append([JENAROOT + '/bin/tdbloader',
+                              '--graph=%s' % graph,
+                              '--loc=%s' % TDB, graph_files[graph]])
+        if len(separate) == len(graph_files):
+            loadCalls.pop(0)
+        for loadCall in loadCalls:
+            print ' '.join(loadCall)
+            subprocess.check_call(loadCall)
+    finally:
+        os.remove(trig.name)
+
+def _write_trig_graph(trig, graph, infile):
+    """
+    append the contents of a ttl file to an open TriG file, as the named
+    graph, with the file's prefix declarations before the graph block;
+    returns False, writing nothing, if the file contains labelled
+    blank nodes or declares a prefix for more than one namespace
+
+    """
+    declarations = []
+    # prefix: namespace
+    declared = {}
+    with open(infile) as ttl:
+        for line in ttl:
+            if '_:' in line:
+                return False
+            if _is_prefix(line):
+                prefix, namespace = line.split(None, 1)[1].split(':', 1)
+                namespace = namespace.split('>', 1)[0].strip()
+                if declared.setdefault(prefix.strip(), namespace) != namespace:
+                    return False
+                declarations.append(line)
+    trig.writelines(declarations)
+    trig.write('\n<%s> {\n' % graph)
+    with open(infile) as ttl:
+        for line in ttl:
+            if not _is_prefix(line):
+                trig.write(line)
+    trig.write('\n}\n\n')
+    return True
+
+def _is_prefix(line):
+    """whether a line of turtle is a prefix declaration"""
+    words = line.split(None, 1)
+    return bool(words) and (words[0] == '@prefix' or
+                            words[0].upper() == 'PREFIX')
+
+def _manifest_key(manifest):
+    """
+    returns a hash of the contents of all of the ttl files in the manifest,
+    identifying a TDB loaded from them
+
+    """
+    sha1 = hashlib.sha1()
+    for graph in sorted(manifest):
+        sha1.update(graph)
+        sha1.update(manifest[graph]['sha1'])
+    return sha1.hexdigest()
+
+def _copy_tdb(source, target):
+    """
+    copy the files of a TDB from the source folder to the target folder,
+    sharing the file contents where the filesystem supports copy on write;
+    the files are not hard linked, as TDB modifies its files in place
+
+    """
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    try:
+        subprocess.check_call(['cp', '-R', '--reflink=auto',
+                               os.path.join(source, '.'), target])
+    except (OSError, subprocess.CalledProcessError):
+        for tdbfile in os.listdir(source):
+            shutil.copy2(os.path.join(source, tdbfile), target)
+
+def _static_manifest():
+    """
+    returns a dictionary, keyed by graph, of the ttl file in the STATICDATA
+    folder each graph is loaded from and the sha-1 hash of its contents
+
+    """
+    manifest = {}
+    for ingraph in glob.glob(os.path.join(STATICDATA, '*')):
+        graph = ingraph.split('/')[-1] + '/'
+        for infile in glob.glob(os.path.join(ingraph, '*.ttl')):
+            subgraph = infile.split('/')[-1]
+            sha1 = hashlib.sha1()
+            with open(infile, 'rb') as ttl:
+                for chunk in iter(lambda: ttl.read(STREAM_CHUNK_SIZE), ''):
+                    sha1.update(chunk)
+            manifest['http://%s%s' % (graph, subgraph)] = {
+                'file': infile, 'sha1': sha1.hexdigest()}
+    return manifest
+
+def _read_manifest():
+    """
+    returns a dictionary of the content hashes of the ttl files the
+    TDB was loaded from, keyed by graph, or None if it is not known
+
+    """
+    try:
+        with open(MANIFEST) as mfile:
+            return json.load(mfile)
+    except (IOError, ValueError):
+        return None
+
+def _write_manifest(manifest):
+    """record the content hashes of the ttl files loaded into the TDB"""
+    loaded = dict([(graph, manifest[graph]['sha1']) for graph in manifest])
+    with open(MANIFEST, 'w') as mfile:
+        json.dump(loaded, mfile, indent=1, sort_keys=True)
+
+
+class _TDBUpdate(object):
+    """
+    Collects updates, passed to run_query as to a FusekiServer, and
+    runs them in a single request directly against the TDB with
+    tdbupdate; the TDB must not be in use by a Fuseki server.
+
+    """
+    def __init__(self):
+        self._updates = []
+
+    def run_query(self, query_string, output='json', update=False,
+                  debug=False):
+        if not update:
+            raise ValueError('only updates may be run against the TDB '
+                             'without a Fuseki server')
+        self._updates.append(query_string)
+        return ''
+
+    def commit(self):
+        """run the collected updates"""
+        if self._updates:
+            pre = prefixes.Prefixes()
+            request = '%s %s' % (pre.sparql, ' ;\n'.join(self._updates))
+            updateCall = [JENAROOT + '/bin/tdbupdate', '--loc=%s' % TDB,
+                          request]
+            print JENAROOT + '/bin/tdbupdate', '--loc=%s' % TDB
+            subprocess.check_call(updateCall)
+            self._updates = []
+
+
+class _ConnectionPool(object):
+    """
+    A pool of persistent HTTP connections to a single host and port.
+    Up to size connections are kept open between requests, each for
+    no longer than idle_timeout seconds.
+
+    """
+    def __init__(self, host, port, size, idle_timeout):
+        self._host = host
+        self._port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        # (connection, time returned to the pool), oldest first
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._counts = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def acquire(self):
+        """
+        returns a connection, and whether it is reused from the pool
+
+        """
+        expired = []
+        with self._lock:
+            oldest = time.time() - self.idle_timeout
+            while self._idle and self._idle[0][1] < oldest:
+                expired.append(self._idle.popleft()[0])
+            self._counts['discarded'] += len(expired)
+            if self._idle:
+                conn = self._idle.pop()[0]
+                self._counts['reused'] += 1
+                reused = True
+            else:
+                conn = httplib.HTTPConnection(self._host, self._port)
+                self._counts['created'] += 1
+                reused = False
+        for old_conn in expired:
+            old_conn.close()
+        return conn, reused
+
+    def release(self, conn):
+        """return a connection to the pool, once its response is read"""
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.time()))
+                conn = None
+            else:
+                self._counts['discarded'] += 1
+        if conn is not None:
+            conn.close()
+
+    def discard(self, conn):
+        """close a connection which may not be reused"""
+        with self._lock:
+            self._counts['discarded'] += 1
+        conn.close()
+
+    def clear(self):
+        """close all of the idle connections"""
+        with self._lock:
+            idle = [conn for conn, last_used in self._idle]
+            self._idle.clear()
+            self._counts['discarded'] += len(idle)
+        for conn in idle:
+            conn.close()
+
+    def statistics(self):
+        """returns a dictionary of the connection counts"""
+        with self._lock:
+            stats = dict(self._counts)
+            stats['idle'] = len(self._idle)
+        return stats
+
+
+class _RecordCache(object):
+    """
+    A bounded, least recently used, cache of records keyed by
+    (record type, record id), holding at most size records.
+    A size of 0 disables the cache.
+
+    Records read from the server are only stored if the cache has not
+    been cleared since the read began, and no update is running, so a
+    record read concurrently with an update is not kept.
+
+    """
+    def __init__(self, size):
+        self.size = size
+        self.generation = 0
+        self._records = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # the number of updates running
+        self._updating = 0
+        self._counts = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """
+        returns whether the key is cached, and its record;
+        the record is None for an id known not to identify a record
+
+        """
+        with self._lock:
+            try:
+                record = self._records.pop(key)
+            except KeyError:
+                self._counts['misses'] += 1
+                return False, None
+            self._records[key] = record
+            self._counts['hits'] += 1
+        return True, record
+
+    def put(self, key, record, generation):
+        """
+        cache the record, read during the given generation of the cache
+
+        """
+        if not self.size:
+            return
+        with self._lock:
+            if generation != self.generation or self._updating:
+                return
+            self._records.pop(key, None)
+            self._records[key] = record
+            while len(self._records) > self.size:
+                self._records.popitem(last=False)
+
+    def clear(self):
+        """discard all of the cached records"""
+        with self._lock:
+            self._records.clear()
+            self.generation += 1
+            self._counts['invalidations'] += 1
+
+    def begin_update(self):
+        """
+        store no records until end_update is called, as an update is
+        about to be sent; the cache is cleared once the update is done
+
+        """
+        with self._lock:
+            self._updating += 1
+            self.generation += 1
+
+    def end_update(self):
+        """store records again once no update is running"""
+        with self._lock:
+            self._updating -= 1
 
+    def statistics(self):
+        """returns a dictionary of the cache counts"""
+        with self._lock:
+            stats = dict(self._counts)
+            stats['records'] = len(self._records)
+        return stats
 
 
 def process_data(jsondata):
@@ -423,29 +1509,293 @@ def process_data(jsondata):
     vars = jdata['head']['vars']
     data = jdata['results']['bindings']
     for item in data:
-        tmpdict = {}
-        for var in vars:
-            tmpvar = item.get(var)
-            if tmpvar:
-                val = tmpvar.get('value')
-                if str(val).startswith('http://') or \
-                   str(val).startswith('https://') :
-                    if len(val.split('&')) == 1:
-                        val = '<{}>'.format(val)
-                    else:
-                        val = ['<{}>'.format(v) for v in val.split('&')]
-                    # val = ['<{}>'.format(v) for v in val.split('&')]
-                else:
-                    try:
-                        int(val)
-                    except ValueError:
-                        try:
-                            float(val)
-                        except ValueError:
-                            if not val.startswith('<'):
-                                val = '"{}"'.format(val)
-                tmpdict[var] = val
+        tmpdict = _process_binding(vars, item)
         if tmpdict != {}:
             resultslist.append(tmpdict)
     return resultslist
 
+def process_stream(chunks):
+    """
+    helper method to take JSON output from a query, as an iterable of
+    string chunks, and yield each result as soon as it has been read
+
+    Only the binding being parsed is held in memory; the results are
+    the same as those returned by process_data.
+
+    """
+    for vars, item in _iter_bindings(chunks):
+        tmpdict = _process_binding(vars, item)
+        if tmpdict != {}:
+            yield tmpdict
+
+def process_rows(jsondata):
+    """
+    helper method to take JSON output from a query and return the
+    results as a list of Rows of typed Terms
+
+    """
+    resultslist = []
+    try:
+        jdata = json.loads(jsondata)
+    except (ValueError, TypeError):
+        return resultslist
+    make_row = _RowBuilder(jdata['head']['vars'])
+    for item in jdata['results']['bindings']:
+        row = make_row(item)
+        if row is not None:
+            resultslist.append(row)
+    return resultslist
+
+def process_row_stream(chunks):
+    """
+    helper method to take JSON output from a query, as an iterable of
+    string chunks, and yield each result as a Row as soon as it
+    has been read
+
+    """
+    make_row = None
+    for vars, item in _iter_bindings(chunks):
+        if make_row is None:
+            make_row = _RowBuilder(vars)
+        row = make_row(item)
+        if row is not None:
+            yield row
+
+def _iter_bindings(chunks):
+    """
+    incrementally parse JSON output from a query, as an iterable of
+    string chunks, yielding the result variables and each binding
+    as soon as it has been read
+
+    """
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    vars = None
+    in_bindings = False
+    eof = False
+    while True:
+        if vars is None:
+            key = buf.find('"vars"', pos)
+            if key != -1:
+                start = buf.find('[', key)
+                if start != -1:
+                    try:
+                        vars, pos = decoder.raw_decode(buf, start)
+                    except ValueError:
+                        pass
+        if vars is not None and not in_bindings:
+            key = buf.find('"bindings"', pos)
+            if key != -1:
+                start = buf.find('[', key)
+                if start != -1:
+                    pos = start + 1
+                    in_bindings = True
+        if in_bindings:
+            while True:
+                while pos < len(buf) and buf[pos] in _JSON_SEPARATORS:
+                    pos += 1
+                if pos == len(buf):
+                    break
+                if buf[pos] == ']':
+                    return
+                try:
+                    item, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    break
+                yield vars, item
+        if eof:
+            if in_bindings:
+                raise ValueError('incomplete SPARQL JSON results')
+            # a document without bindings, e.g. an ASK result
+            return
+        buf = buf[pos:]
+        pos = 0
+        try:
+            buf += next(chunks)
+        except StopIteration:
+            eof = True
+
+def _process_binding(vars, item):
+    """
+    helper method to convert one binding from a query's JSON output
+    into a dictionary of values keyed by variable
+
+    """
+    tmpdict = {}
+    for var in vars:
+        tmpvar = item.get(var)
+        if tmpvar:
+            val = tmpvar.get('value')
+            if val.startswith(('http://', 'https://')):
+                vals = val.split('&')
+                if len(vals) == 1:
+                    val = '<{}>'.format(val)
+                else:
+                    val = ['<{}>'.format(v) for v in vals]
+            else:
+                try:
+                    int(val)
+                except ValueError:
+                    try:
+                        float(val)
+                    except ValueError:
+                        if not val.startswith('<'):
+                            val = '"{}"'.format(val)
+            tmpdict[var] = val
+    return tmpdict
+
+
+# the kinds of Term in a Row
+IRI = 'iri'
+LITERAL = 'literal'
+TYPED_LITERAL = 'typed-literal'
+BNODE = 'bnode'
+# a GROUP_CONCAT of IRIs, whose value is a tuple of IRIs
+MULTI = 'multi'
+
+_NUMERIC_TYPES = frozenset(
+    'http://www.w3.org/2001/XMLSchema#{}'.format(xsd) for xsd in
+    ('integer', 'decimal', 'double', 'float', 'int', 'long', 'short',
+     'byte', 'nonNegativeInteger', 'positiveInteger', 'negativeInteger',
+     'nonPositiveInteger', 'unsignedInt', 'unsignedLong'))
+
+
+class Term(collections.namedtuple('Term', 'kind value datatype language')):
+    """
+    A single value from a query result, decoded using the type,
+    datatype and language reported by the server.
+
+    Literals whose text is one or more '&' separated http(s) urls are
+    taken to be IRIs, as this is how GROUP_CONCAT results are returned.
+
+    """
+    __slots__ = ()
+
+    def __new__(cls, kind, value, datatype=None, language=None):
+        return super(Term, cls).__new__(cls, kind, value, datatype, language)
+
+    @property
+    def n3(self):
+        """
+        the term as process_data returns it: IRIs in angle brackets,
+        numbers bare and other literals quoted, without their datatype
+        or language; a MULTI term gives a list
+
+        """
+        if self.kind == IRI:
+            return '<{}>'.format(self.value)
+        elif self.kind == MULTI:
+            return ['<{}>'.format(v) for v in self.value]
+        elif self.kind == BNODE:
+            return '_:{}'.format(self.value)
+        elif self.datatype in _NUMERIC_TYPES:
+            return self.value
+        try:
+            float(self.value)
+        except ValueError:
+            return '"{}"'.format(self.value)
+        return self.value
+
+
+class Row(object):
+    """
+    A single query result: the Terms bound to each of the
+    query's variables, None where a variable is unbound.
+    All the Rows from one query share their tuple of variable names.
+
+    """
+    __slots__ = ('vars', 'terms')
+
+    def __init__(self, vars, terms):
+        self.vars = vars
+        self.terms = terms
+
+    def __getitem__(self, var):
+        try:
+            term = self.terms[self.vars.index(var)]
+        except ValueError:
+            raise KeyError(var)
+        if term is None:
+            raise KeyError(var)
+        return term
+
+    def get(self, var, default=None):
+        try:
+            return self[var]
+        except KeyError:
+            return default
+
+    def __contains__(self, var):
+        return self.get(var) is not None
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and self.as_dict() == other.as_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Row({!r})'.format(self.as_dict())
+
+    def keys(self):
+        """the bound variables"""
+        return [var for var, term in zip(self.vars, self.terms)
+                if term is not None]
+
+    def items(self):
+        """(variable, Term) pairs for the bound variables"""
+        return [(var, term) for var, term in zip(self.vars, self.terms)
+                if term is not None]
+
+    def as_dict(self):
+        """the bound values as a dictionary of n3 strings"""
+        return dict((var, term.n3) for var, term in self.items())
+
+
+class _RowBuilder(object):
+    """
+    Converts the bindings from one query into Rows, sharing a Term
+    with the previous Row where a variable's value is unchanged, as
+    it is for the grouped or ordered variables of most queries.
+    Only the last Term of each variable is held.
+
+    """
+    def __init__(self, vars):
+        self.vars = tuple(vars)
+        # variable number: (binding key, Term) of the last value
+        self._last = [(None, None)] * len(self.vars)
+
+    def __call__(self, item):
+        terms = tuple(self._term(i, item.get(var))
+                      for i, var in enumerate(self.vars))
+        if not any(term is not None for term in terms):
+            return None
+        return Row(self.vars, terms)
+
+    def _term(self, number, binding):
+        if not binding:
+            return None
+        val = binding.get('value')
+        datatype = binding.get('datatype')
+        language = binding.get('xml:lang')
+        key = (binding.get('type'), val, datatype, language)
+        last_key, term = self._last[number]
+        if key != last_key:
+            if binding.get('type') == 'uri':
+                term = Term(IRI, val, None)
+            elif binding.get('type') == 'bnode':
+                term = Term(BNODE, val, None)
+            elif val.startswith(('http://', 'https://')):
+                vals = val.split('&')
+                if len(vals) == 1:
+                    term = Term(IRI, val, None)
+                else:
+                    term = Term(MULTI, tuple(vals), None)
+            elif datatype:
+                term = Term(TYPED_LITERAL, val, datatype)
+            else:
+                term = Term(LITERAL, val, None, language)
+            self._last[number] = (key, term)
+        return term
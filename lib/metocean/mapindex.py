@@ -0,0 +1,170 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+
+class MappingIndex(object):
+    """
+    The mappings from one format to another, keyed by the properties
+    of their source components, so that the targets for a source are
+    found by a single dictionary lookup.
+
+    An index is built from a FusekiServer and may be saved to, and
+    loaded from, a compact json file, so it can be used without the
+    triple store.
+
+    Args:
+
+    * s_format:
+        the source format of the mappings, e.g.
+        '<http://www.metarelate.net/metOcean/format/um>'
+    * t_format:
+        the target format of the mappings
+
+    """
+    def __init__(self, s_format, t_format):
+        self.s_format = s_format
+        self.t_format = t_format
+        # source key: [{'mapping':, 'mr:target':, 'mr:hasValueMap':}, ...]
+        self._index = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, source):
+        return source_key(source) in self._index
+
+    @classmethod
+    def build(cls, fuseki_process, s_format, t_format):
+        """
+        returns a new index of the valid mappings from s_format to
+        t_format retrieved from the fuseki_process
+
+        """
+        index = cls(s_format, t_format)
+        for mapping in fuseki_process.retrieve_mappings(s_format, t_format):
+            index.add(mapping)
+        return index
+
+    def add(self, mapping):
+        """
+        add a mapping, structured as by FusekiServer.structured_mapping,
+        to the index
+
+        """
+        entry = {'mapping': mapping['mapping'],
+                 'mr:target': mapping['mr:target'],
+                 'mr:hasValueMap': mapping.get('mr:hasValueMap', [])}
+        key = component_key(mapping['mr:source'])
+        self._index.setdefault(key, []).append(entry)
+
+    def lookup(self, source):
+        """
+        returns the list of mappings for a source, each a dictionary of
+        the 'mapping' id, its 'mr:target' component and its
+        'mr:hasValueMap' list; the list is empty if there are none and
+        has more than one member if the mappings are ambiguous
+
+        Args:
+
+        * source:
+            a structured component or a collection of
+            (name, operator, value) property tuples, e.g.
+            [('<http://reference.metoffice.gov.uk/def/um/umdp/F3/stash>',
+              '<http://www.openmath.org/cd/relation1.xhtml#eq>',
+              '<http://reference.metoffice.gov.uk/def/um/stash/concept/m01s00i024>')]
+
+        """
+        return list(self._index.get(source_key(source), []))
+
+    def targets(self, source):
+        """returns the list of target components for a source"""
+        return [entry['mr:target'] for entry in self.lookup(source)]
+
+    def save(self, path):
+        """write the index to a json file at path"""
+        content = {'source': self.s_format,
+                   'target': self.t_format,
+                   'mappings': self._index.items()}
+        with open(path, 'w') as index_file:
+            json.dump(content, index_file, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, path):
+        """returns the index saved in the json file at path"""
+        with open(path) as index_file:
+            content = json.load(index_file)
+        index = cls(content['source'], content['target'])
+        for key, entries in content['mappings']:
+            index._index[_as_tuple(key)] = entries
+        return index
+
+
+def component_key(component):
+    """
+    returns the key for a structured component: the sorted tuple of the
+    (name, operator, value) of each of its properties, where the value
+    of a property with a component, and each sub component, is that
+    component's key, and a multi valued rdf:value is the sorted tuple of
+    its values
+    The key ignores the component's dc:mediator and dc:requires, so
+    components differing only in those share a key.
+
+    """
+    keys = []
+    for prop in component.get('mr:hasProperty', []):
+        value = _value_key(prop.get('rdf:value'))
+        if prop.get('mr:hasComponent'):
+            value = component_key(prop['mr:hasComponent'])
+        keys.append((prop.get('mr:name'), prop.get('mr:operator'), value))
+    for sub_component in component.get('mr:hasComponent', []):
+        keys.append(('mr:hasComponent', None, component_key(sub_component)))
+    return tuple(sorted(keys))
+
+def source_key(source):
+    """
+    returns the key for a structured component or a collection of
+    (name, operator, value) property tuples
+
+    """
+    if isinstance(source, dict):
+        key = component_key(source)
+    else:
+        key = tuple(sorted([tuple(prop[:2]) + (_value_key(prop[2]),)
+                            for prop in source]))
+    return key
+
+def _value_key(value):
+    """
+    helper function
+    returns a property's value, with a list of values made a sorted tuple
+
+    """
+    if isinstance(value, (list, tuple)):
+        value = tuple(sorted(value))
+    return value
+
+def _as_tuple(obj):
+    """
+    helper function
+    returns the key read from json, with each list made a tuple
+
+    """
+    if isinstance(obj, list):
+        obj = tuple([_as_tuple(elem) for elem in obj])
+    return obj
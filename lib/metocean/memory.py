@@ -0,0 +1,232 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import glob
+import json
+import os
+import re
+import threading
+
+try:
+    import rdflib
+    from rdflib.plugins.sparql import aggregates
+    from rdflib.plugins.sparql.sparql import NotBoundError
+except ImportError:
+    rdflib = None
+
+import metocean.fuseki as fuseki
+import metocean.prefixes as prefixes
+import metocean.queries as queries
+
+
+class MemoryServer(fuseki.FusekiServer):
+    """
+    A FusekiServer which holds the triple database in memory, in this
+    process, rather than in a TDB served by a Fuseki process.
+    Requires rdflib 5 or later.
+
+    Queries, updates and the saving and reverting of cached changes
+    behave as for a FusekiServer, so the MemoryServer may be used in
+    its place, for example for tests or a read only editor.
+    There is no server to start; the data is lost when the process ends,
+    unless it is saved.
+
+    Before rdflib 6 an aggregate of an unbound variable, such as
+    COUNT(DISTINCT(?property)) over an OPTIONAL pattern, raises rather
+    than skipping the row. With rdflib 5 the MemoryServer wraps the
+    aggregates so that they skip such rows while it runs a query, and
+    restores them afterwards.
+
+    Args:
+
+    * cache_size:
+        the maximum number of retrieved records held in memory for reuse
+
+    """
+    def __init__(self, cache_size=10000):
+        if rdflib is None or _RDFLIB_VERSION < 5:
+            raise ImportError('the MemoryServer requires rdflib 5 or later')
+        super(MemoryServer, self).__init__(None, cache_size=cache_size,
+                                           snapshots=None)
+        self._lock = threading.RLock()
+        self._dataset = _new_dataset()
+
+    def start(self):
+        """there is no server process to start"""
+        self._health['alive'] = True
+
+    def stop(self, save=False):
+        """there is no server process to stop"""
+        if save:
+            self.save()
+
+    def status(self):
+        """the in memory store is always available"""
+        return True
+
+    def clean(self):
+        """
+        discard all of the data held in memory
+
+        """
+        with self._lock:
+            self._dataset = _new_dataset()
+            self._reloaded()
+            self._invalidate()
+        return []
+
+    def load(self, incremental=False):
+        """
+        load data from all the ttl files in the STATICDATA folder
+        into a new in memory store; every file is always loaded
+
+        """
+        dataset = _new_dataset()
+        for ingraph in glob.glob(os.path.join(fuseki.STATICDATA, '*')):
+            graph = ingraph.split('/')[-1] + '/'
+            for infile in glob.glob(os.path.join(ingraph, '*.ttl')):
+                subgraph = infile.split('/')[-1]
+                named = dataset.graph(rdflib.URIRef('http://%s%s' %
+                                                    (graph, subgraph)))
+                named.parse(infile, format='turtle')
+        with self._lock:
+            self._dataset = dataset
+            self._reloaded()
+            self._invalidate()
+            queries.refresh_current_mappings(self)
+
+    def _request(self, query, output='json', update=False):
+        """
+        run a query, or an update, against the in memory store and
+        return the result as Fuseki would return it: SPARQL JSON for
+        select and ask queries and turtle for construct queries
+
+        """
+        with self._lock, _skipping_unbound():
+            if update:
+                self._dataset.update(query)
+                return ''
+            # rdflib evaluates the query as the result is serialised
+            result = self._dataset.query(query)
+            if result.type in ('CONSTRUCT', 'DESCRIBE'):
+                _bind_prefixes(result.graph)
+                return result.graph.serialize(format='turtle')
+            data = result.serialize(format='json')
+        return _drop_empty_concats(query, data)
+
+    def _stream_request(self, query, rows=False):
+        """
+        run a json query against the in memory store, returning a
+        generator of the processed results
+
+        """
+        data = self._request(query)
+        if rows:
+            return fuseki.process_row_stream([data])
+        return fuseki.process_stream([data])
+
+
+def _new_dataset():
+    """returns an empty store of named graphs"""
+    dataset = rdflib.Dataset()
+    _bind_prefixes(dataset)
+    return dataset
+
+def _bind_prefixes(graph):
+    """
+    bind the metocean prefixes to a graph, so they are used
+    when it is serialised
+
+    """
+    for prefix, namespace in prefixes.Prefixes().iteritems():
+        graph.bind(prefix, rdflib.Namespace(namespace), override=True)
+
+def _drop_empty_concats(query, data):
+    """
+    returns the SPARQL JSON results of a query without the bindings of
+    its GROUP_CONCAT variables which are empty strings, as Fuseki leaves
+    a GROUP_CONCAT of no values unbound, whereas rdflib binds it to ""
+
+    """
+    concats = set(_GROUP_CONCAT.findall(query))
+    if not concats:
+        return data
+    results = json.loads(data)
+    for binding in results['results']['bindings']:
+        for var in concats:
+            if binding.get(var, {}).get('value', None) == '':
+                del binding[var]
+    return json.dumps(results)
+
+def _skip_unbound(use_row):
+    """
+    wrap the distinct test of an rdflib aggregate, so that rows in
+    which the aggregated expression is unbound are skipped, as SPARQL
+    requires, rather than raising a NotBoundError
+
+    """
+    def skipping_use_row(self, row):
+        try:
+            return use_row(self, row)
+        except NotBoundError:
+            return False
+    return skipping_use_row
+
+@contextlib.contextmanager
+def _skipping_unbound():
+    """
+    a context in which the rdflib 5 aggregates are wrapped with
+    _skip_unbound; the original aggregates are restored when the last
+    of the contexts open in the process ends.
+    rdflib 6 and later skip unbound rows themselves
+
+    """
+    global _skipping
+    if _RDFLIB_VERSION >= 6:
+        yield
+        return
+    with _skipping_lock:
+        if not _skipping:
+            for aggregate in (aggregates.Accumulator, aggregates.Counter):
+                if 'use_row' in vars(aggregate):
+                    _originals[aggregate] = vars(aggregate)['use_row']
+                    aggregate.use_row = _skip_unbound(aggregate.use_row)
+        _skipping += 1
+    try:
+        yield
+    finally:
+        with _skipping_lock:
+            _skipping -= 1
+            if not _skipping:
+                for aggregate, use_row in _originals.items():
+                    aggregate.use_row = use_row
+                _originals.clear()
+
+# the variable a GROUP_CONCAT is bound to: (GROUP_CONCAT(...) AS ?var)
+_GROUP_CONCAT = re.compile(r'GROUP_CONCAT\s*\((?:[^()]|\([^()]*\))*\)\s*'
+                           r'AS\s+\?(\w+)', re.IGNORECASE)
+
+_RDFLIB_VERSION = None
+if rdflib is not None:
+    _RDFLIB_VERSION = int(rdflib.__version__.split('.')[0])
+
+# the number of open _skipping_unbound contexts, and the original
+# aggregate use_row methods they wrap: aggregate class: use_row
+_skipping = 0
+_skipping_lock = threading.Lock()
+_originals = {}
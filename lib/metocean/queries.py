@@ -93,6 +93,45 @@ def revert_cache(fuseki_process, graph, debug=False):
     return results
 
 
+def drop_graph(fuseki_process, graph, debug=False):
+    """
+    remove a graph, and all of the statements in it,
+    from the triple database
+    
+    """
+    qstr = 'DROP SILENT GRAPH <%s>' % graph
+    results = fuseki_process.run_query(qstr, update=True, debug=debug)
+    return results
+
+def refresh_current_mappings(fuseki_process, debug=False):
+    """
+    rebuild the current mappings graph, which types each mapping that
+    is neither deprecated, broken nor replaced by another mapping
+    as an mr:CurrentMapping, so queries need not follow the
+    dc:replaces chains
+
+    """
+    qstr = '''
+    DROP SILENT GRAPH <http://metarelate.net/current> ;
+    INSERT
+    {  GRAPH <http://metarelate.net/current>
+        {
+        ?mapping rdf:type mr:CurrentMapping .
+        }
+    }
+    WHERE
+    {  GRAPH <http://metarelate.net/mappings.ttl>
+        {
+        ?mapping rdf:type mr:Mapping ;
+                 mr:status ?status .
+        FILTER (?status NOT IN ("Deprecated", "Broken"))
+        FILTER NOT EXISTS {?anothermap dc:replaces ?mapping .}
+        }
+    }
+    '''
+    results = fuseki_process.run_query(qstr, update=True, debug=debug)
+    return results
+
 def save_cache(fuseki_process, graph, debug=False):
     """
     export new records from a graph in the triple store to an external location,
@@ -153,7 +192,129 @@ def _vocab_graphs():
     vocab_graphs.append('<http://grib/apikeys.ttl>')
     vocab_graphs.append('<http://openmath/ops.ttl>')
     return vocab_graphs
-    
+
+
+# the maximum number of record ids passed to a single batch retrieval query
+BATCH_SIZE = 200
+
+def _retrieve_batch(fuseki_process, qstr, ids, debug=False):
+    """
+    run a record retrieval query, containing one '%s' placeholder
+    for a comma separated list of record ids, over a collection of ids;
+    one query is run for each BATCH_SIZE ids
+    returns the concatenated results
+
+    """
+    ids = sorted(set(ids))
+    results = []
+    for i in range(0, len(ids), BATCH_SIZE):
+        id_list = ', '.join(ids[i:i + BATCH_SIZE])
+        results += fuseki_process.run_query(qstr % id_list, debug=debug)
+    return results
+
+
+def _single(obj):
+    """ returns the object of a single valued predicate from a po_dict """
+    if isinstance(obj, list):
+        obj = obj[0]
+    return obj
+
+def _group_concat(values):
+    """
+    returns a collection of values, as a query returns them, as a query
+    returns their GROUP_CONCAT with the '&' separator: '""' for no
+    values, a single value as it is, a list of URIs or a single
+    literal of the values joined by '&'
+
+    """
+    values = sorted(values)
+    if not values:
+        return '""'
+    if len(values) == 1:
+        return values[0]
+    joined = '&'.join([value.strip('<>"') for value in values])
+    if joined.startswith(('http://', 'https://')):
+        return ['<%s>' % value for value in joined.split('&')]
+    return '"%s"' % joined
+
+def query_form(term):
+    """
+    returns a term of a po_dict, a URI, a prefixed name or a literal,
+    as process_data returns it from a query
+
+    """
+    if term.startswith('<'):
+        return term
+    if term.startswith('"'):
+        value = term[1:term.rindex('"')]
+    else:
+        pref, sep, local = term.partition(':')
+        pre = prefixes.Prefixes()
+        if sep and pre.has_key(pref):
+            return '<%s%s>' % (pre[pref], local)
+        value = term
+    if value.startswith(('http://', 'https://')):
+        return '<%s>' % value
+    try:
+        float(value)
+    except ValueError:
+        return '"%s"' % value
+    return value
+
+def _find_or_create(fuseki_process, qstr, po_dict, subj_pref, rdf_type,
+                    search_string, var, extra=None, debug=False):
+    """
+    find the record matching the po_dict in the concepts graph,
+    creating it if it does not exist, and return a list of
+    result dictionaries, as returned by the select query qstr
+
+    The select query, matching the record on its content, is run first,
+    so a record which exists, whatever its id, is found in one request.
+    Otherwise the record, named by the hash of its po_dict, is inserted,
+    guarded by the same select, so a record with the same content which
+    another editor has just created is not duplicated, and its id
+    returned without querying again.
+
+    Args:
+
+    * qstr:
+        the select query matching the record on its content
+    * subj_pref:
+        the namespace of the record's subject
+    * rdf_type:
+        the type of the record
+    * search_string:
+        the predicate object statements of the record
+    * var:
+        the name of the record id variable bound by qstr
+    * extra:
+        a dictionary of other variables bound by qstr, for the result
+        of the insert
+
+    """
+    results = fuseki_process.run_query(qstr, debug=debug)
+    if results:
+        return results
+    subject = '<%s/%s>' % (subj_pref, make_hash(po_dict))
+    instr = '''INSERT {
+    GRAPH <http://metarelate.net/concepts.ttl> {
+    %s rdf:type %s ;
+            %s
+            mr:saveCache "True" .
+    }
+    }
+    WHERE {
+    FILTER NOT EXISTS {
+    %s
+    }
+    }
+    ''' % (subject, rdf_type, search_string, qstr)
+    fuseki_process.run_query(instr, update=True, debug=debug)
+    result = {var: subject}
+    if extra:
+        result.update(extra)
+    return [result]
+
 
 def query_cache(fuseki_process, graph, debug=False):
     """
@@ -324,9 +485,10 @@ def get_label(fuseki_process, subject, debug=False):
     return label
 
 
-def subject_and_plabel(fuseki_process, graph, debug=False):
+def subject_and_plabel(fuseki_process, graph, debug=False, stream=False):
     """
     selects subject and prefLabel from a particular graph
+    if stream is True the results are returned as a generator
     
     """
     qstr = '''
@@ -338,7 +500,7 @@ def subject_and_plabel(fuseki_process, graph, debug=False):
         }
         ORDER BY ?subject
     ''' % graph
-    results = fuseki_process.run_query(qstr, debug=debug)
+    results = fuseki_process.run_query(qstr, debug=debug, stream=stream)
     return results
 
     
@@ -359,8 +521,8 @@ def valid_ordered_mappings(fuseki_process, s_format, t_format, debug=False):
              mr:status ?status .
     BIND("False" AS ?inverted)
     OPTIONAL {?mapping mr:hasValueMap ?valueMap . }
-    FILTER (?status NOT IN ("Deprecated", "Broken"))
-    MINUS {?mapping ^dc:replaces+ ?anothermap}
+    FILTER EXISTS {GRAPH <http://metarelate.net/current> {
+        ?mapping rdf:type mr:CurrentMapping .}}
     }
     UNION {
     ?mapping mr:source ?target ;
@@ -369,8 +531,8 @@ def valid_ordered_mappings(fuseki_process, s_format, t_format, debug=False):
              mr:invertible "True" .
     BIND("True" AS ?inverted)
     OPTIONAL {?mapping mr:hasValueMap ?valueMap . }
-    FILTER (?status NOT IN ("Deprecated", "Broken"))
-    MINUS {?mapping ^dc:replaces+ ?anothermap}
+    FILTER EXISTS {GRAPH <http://metarelate.net/current> {
+        ?mapping rdf:type mr:CurrentMapping .}}
     } }
     GRAPH <http://metarelate.net/concepts.ttl> { 
     ?source mr:hasFormat ?sourceFormat .
@@ -422,7 +584,7 @@ def get_property(fuseki_process, po_dict, debug=False):
                     counter +=1
                 assign_string += '''
                 %s ?%s ;''' % (pred, pred.split(':')[-1])
-                count_string += '''COUNT(DISTINCT(?%(p)s)) AS ?%(p)ss
+                count_string += '''(COUNT(DISTINCT(?%(p)s)) AS ?%(p)ss)
                 ''' % {'p':pred.split(':')[-1]}
                 filter_string += '''
                 FILTER(?%ss = %i)''' % (pred.split(':')[-1], counter)
@@ -456,20 +618,9 @@ def get_property(fuseki_process, po_dict, debug=False):
         ''' % {'count':count_string,'assign':assign_string,
                'search':search_string, 'filter':filter_string,
                'block':block_string}
-        results = fuseki_process.run_query(qstr, debug=debug)
-        if len(results) == 0:
-            sha1 = make_hash(po_dict)
-            instr = '''INSERT DATA {
-            GRAPH <http://metarelate.net/concepts.ttl> {
-            <%s/%s> rdf:type mr:Property ;
-                    %s
-            mr:saveCache "True" .
-            }
-            }
-            ''' % (subj_pref, sha1, search_string)
-            insert_results = fuseki_process.run_query(instr, update=True,
-                                                      debug=debug)
-            results = fuseki_process.run_query(qstr, debug=debug)
+        results = _find_or_create(fuseki_process, qstr, po_dict, subj_pref,
+                                  'mr:Property', search_string, 'property',
+                                  debug=debug)
         if len(results) == 1:
             results = results[0]
         elif len(results) == 0:
@@ -481,10 +632,11 @@ def get_property(fuseki_process, po_dict, debug=False):
         results = None
     return results
 
-def retrieve_property(fuseki_process, prop_id, debug=False):
+def retrieve_properties(fuseki_process, prop_ids, debug=False):
     """
-    Retrieve a property record from it's id
-    or None if one does not exist.
+    Retrieve the property records for a collection of ids,
+    in as few queries as the batch size allows.
+    Ids with no record are absent from the results.
 
     """
     qstr = '''SELECT ?property ?name ?operator ?component
@@ -495,12 +647,21 @@ def retrieve_property(fuseki_process, prop_id, debug=False):
         OPTIONAL { ?property rdf:value ?avalue ;
                   mr:operator ?operator . }
         OPTIONAL {?property mr:hasComponent ?component . }
-        FILTER(?property = %s)
+        FILTER(?property IN (%s))
         }
     }
     GROUP BY ?property ?name ?operator ?component
-    ''' % prop_id
-    results = fuseki_process.run_query(qstr, debug=debug)
+    '''
+    return _retrieve_batch(fuseki_process, qstr, prop_ids, debug)
+
+
+def retrieve_property(fuseki_process, prop_id, debug=False):
+    """
+    Retrieve a property record from it's id
+    or None if one does not exist.
+
+    """
+    results = retrieve_properties(fuseki_process, [prop_id], debug=debug)
     if len(results) == 0:
         prop = None
     elif len(results) >1:
@@ -589,20 +750,10 @@ def get_component(fuseki_process, po_dict, debug=False):
         FILTER(?requireses = %i)
         }
         ''' % (search_string, n_components, n_propertys, n_reqs)
-        results = fuseki_process.run_query(qstr, debug=debug)
-        if len(results) == 0:
-            sha1 = make_hash(po_dict)
-            instr = '''INSERT DATA {
-            GRAPH <http://metarelate.net/concepts.ttl> {
-            <%s/%s> rdf:type mr:Component ;
-                    %s
-                    mr:saveCache "True" .
-            }
-            }
-            ''' % (subj_pref, sha1, search_string)
-            insert_results = fuseki_process.run_query(instr, update=True,
-                                                      debug=debug)
-            results = fuseki_process.run_query(qstr, debug=debug)
+        results = _find_or_create(fuseki_process, qstr, po_dict, subj_pref,
+                                  'mr:Component', search_string, 'component',
+                                  {'format': _single(po_dict.get('mr:hasFormat'))},
+                                  debug=debug)
         if len(results) == 1:
             results = results[0]
         elif len(results) == 0:
@@ -615,13 +766,14 @@ def get_component(fuseki_process, po_dict, debug=False):
         results = None
     return results
 
-def retrieve_component(fuseki_process, fcId, debug=False):
+def retrieve_components(fuseki_process, fc_ids, debug=False):
     """
-    Return a component record from the provided id
-    or None if one does not exist.
-    
+    Return the component records for a collection of ids,
+    in as few queries as the batch size allows.
+    Ids with no record are absent from the results.
+
     """
-    qstr = '''SELECT ?component ?format ?mediates 
+    qstr = '''SELECT ?component ?format ?mediates
     (GROUP_CONCAT(?acomponent; SEPARATOR='&') AS ?subComponent)
     (GROUP_CONCAT(?aproperty; SEPARATOR='&') AS ?property)
     (GROUP_CONCAT(?arequires; SEPARATOR='&') AS ?requires)
@@ -632,12 +784,21 @@ def retrieve_component(fuseki_process, fcId, debug=False):
         OPTIONAL{?component mr:hasProperty ?aproperty .}
         OPTIONAL{?component dc:requires ?arequires .}
         OPTIONAL{?component dc:mediator ?mediates .}
-        FILTER(?component = %s)
+        FILTER(?component IN (%s))
         }
     }
     GROUP BY ?component ?format ?mediates
-    ''' % fcId
-    results = fuseki_process.run_query(qstr, debug=debug)
+    '''
+    return _retrieve_batch(fuseki_process, qstr, fc_ids, debug)
+
+
+def retrieve_component(fuseki_process, fcId, debug=False):
+    """
+    Return a component record from the provided id
+    or None if one does not exist.
+
+    """
+    results = retrieve_components(fuseki_process, [fcId], debug=debug)
     if len(results) == 0:
         fCon = None
     elif len(results) >1:
@@ -684,20 +845,9 @@ def get_value_map(fuseki_process, po_dict, debug=False):
         }
         }
         ''' % (search_string)
-        results = fuseki_process.run_query(qstr, debug=debug)
-        if len(results) == 0:
-            sha1 = make_hash(po_dict)
-            instr = '''INSERT DATA {
-            GRAPH <http://metarelate.net/concepts.ttl> {
-            <%s/%s> a mr:ValueMap ;
-                    %s
-                    mr:saveCache "True" .
-            }
-            }
-            ''' % (subj_pref, sha1, search_string)
-            insert_results = fuseki_process.run_query(instr, update=True,
-                                                      debug=debug)
-            results = fuseki_process.run_query(qstr, debug=debug)
+        results = _find_or_create(fuseki_process, qstr, po_dict, subj_pref,
+                                  'mr:ValueMap', search_string, 'valueMap',
+                                  debug=debug)
         if len(results) == 1:
             results = results[0]
         else:
@@ -746,20 +896,9 @@ def get_value(fuseki_process, po_dict, debug=False):
         }
         }
         ''' % (search_string)
-        results = fuseki_process.run_query(qstr, debug=debug)
-        if len(results) == 0:
-            sha1 = make_hash(po_dict)
-            instr = '''INSERT DATA {
-            GRAPH <http://metarelate.net/concepts.ttl> {
-            <%s/%s> a mr:Value ;
-                    %s
-                    mr:saveCache "True" .
-            }
-            }
-            ''' % (subj_pref, sha1, search_string)
-            insert_results = fuseki_process.run_query(instr, update=True,
-                                                      debug=debug)
-            results = fuseki_process.run_query(qstr, debug=debug)
+        results = _find_or_create(fuseki_process, qstr, po_dict, subj_pref,
+                                  'mr:Value', search_string, 'value',
+                                  debug=debug)
         if len(results) == 1:
             results = results[0]
         else:
@@ -808,20 +947,9 @@ def get_scoped_property(fuseki_process, po_dict, debug=False):
         }
         }
         ''' % (search_string)
-        results = fuseki_process.run_query(qstr, debug=debug)
-        if len(results) == 0:
-            sha1 = make_hash(po_dict)
-            instr = '''INSERT DATA {
-            GRAPH <http://metarelate.net/concepts.ttl> {
-            <%s/%s> a mr:Property ;
-                    %s
-                    mr:saveCache "True" .
-            }
-            }
-            ''' % (subj_pref, sha1, search_string)
-            insert_results = fuseki_process.run_query(instr, update=True,
-                                                      debug=debug)
-            results = fuseki_process.run_query(qstr, debug=debug)
+        results = _find_or_create(fuseki_process, qstr, po_dict, subj_pref,
+                                  'mr:Property', search_string,
+                                  'scopedProperty', debug=debug)
         if len(results) == 1:
             results = results[0]
         else:
@@ -833,22 +961,31 @@ def get_scoped_property(fuseki_process, po_dict, debug=False):
     return results
 
 
-def retrieve_valuemap(fuseki_process, vmId, debug=False):
+def retrieve_valuemaps(fuseki_process, vm_ids, debug=False):
     """
-    return a valueMap record from the provided id
-    or None if one does not exist
-    
+    return the valueMap records for a collection of ids,
+    in as few queries as the batch size allows
+
     """
     qstr = '''SELECT ?valueMap ?source ?target
     WHERE {
     GRAPH <http://metarelate.net/concepts.ttl> {
         ?valueMap mr:source ?source ;
                   mr:target ?target .
-        FILTER(?valueMap = %s)
+        FILTER(?valueMap IN (%s))
         }
     }
-    ''' % vmId
-    results = fuseki_process.run_query(qstr, debug=debug)
+    '''
+    return _retrieve_batch(fuseki_process, qstr, vm_ids, debug)
+
+
+def retrieve_valuemap(fuseki_process, vmId, debug=False):
+    """
+    return a valueMap record from the provided id
+    or None if one does not exist
+
+    """
+    results = retrieve_valuemaps(fuseki_process, [vmId], debug=debug)
     if len(results) == 0:
         valuemap = None
     elif len(results) >1:
@@ -858,11 +995,11 @@ def retrieve_valuemap(fuseki_process, vmId, debug=False):
     return valuemap
 
 
-def retrieve_value(fuseki_process, vId, debug=False):
+def retrieve_values(fuseki_process, v_ids, debug=False):
     """
-    return a value record from the provided id
-    or None if one does not exist
-    
+    return the value records for a collection of ids,
+    in as few queries as the batch size allows
+
     """
     qstr = '''SELECT ?value ?operator ?subject ?object
     WHERE {
@@ -870,11 +1007,20 @@ def retrieve_value(fuseki_process, vId, debug=False):
         ?value mr:subject ?subject .
         OPTIONAL {?value mr:operator ?operator .}
         OPTIONAL {?value mr:object ?object . }
-        FILTER(?value = %s)
+        FILTER(?value IN (%s))
         }
     }
-    ''' % vId
-    results = fuseki_process.run_query(qstr, debug=debug)
+    '''
+    return _retrieve_batch(fuseki_process, qstr, v_ids, debug)
+
+
+def retrieve_value(fuseki_process, vId, debug=False):
+    """
+    return a value record from the provided id
+    or None if one does not exist
+
+    """
+    results = retrieve_values(fuseki_process, [vId], debug=debug)
     if len(results) == 0:
         result = None
     elif len(results) >1:
@@ -884,22 +1030,31 @@ def retrieve_value(fuseki_process, vId, debug=False):
     return result
 
 
-def retrieve_scoped_property(fuseki_process, spId, debug=False):
+def retrieve_scoped_properties(fuseki_process, sp_ids, debug=False):
     """
-    return a value record from the provided id
-    or None if one does not exist
-    
+    return the scopedProperty records for a collection of ids,
+    in as few queries as the batch size allows
+
     """
     qstr = '''SELECT ?scopedProperty ?scope ?hasProperty
     WHERE {
     GRAPH <http://metarelate.net/concepts.ttl> {
         ?scopedProperty mr:scope ?scope ;
                   mr:hasProperty ?hasProperty .
-        FILTER(?scopedProperty = %s)
+        FILTER(?scopedProperty IN (%s))
         }
     }
-    ''' % spId
-    results = fuseki_process.run_query(qstr, debug=debug)
+    '''
+    return _retrieve_batch(fuseki_process, qstr, sp_ids, debug)
+
+
+def retrieve_scoped_property(fuseki_process, spId, debug=False):
+    """
+    return a value record from the provided id
+    or None if one does not exist
+
+    """
+    results = retrieve_scoped_properties(fuseki_process, [spId], debug=debug)
     if len(results) == 0:
         result = None
     elif len(results) >1:
@@ -955,28 +1110,90 @@ def create_mapping(fuseki_process, po_dict, debug=False):
             %s %s ;''' % (pred, po_dict[pred])
     sha1 = make_hash(po_dict, ['''dc:date'''])
     mapping = '%s/%s' % (subj_pref, sha1)
-    qstr = '''SELECT ?mapping
+    instr = '''INSERT {
+    GRAPH <http://metarelate.net/mappings.ttl> {
+    <%s> a mr:Mapping ;
+                %s
+                mr:saveCache "True" .
+    }
+    }
     WHERE {
+    FILTER NOT EXISTS {
     GRAPH <http://metarelate.net/mappings.ttl> {
-    ?mapping rdf:type mr:Mapping .
-    FILTER(?mapping = <%s>)
-    } }''' % mapping
-    results = fuseki_process.run_query(qstr, debug=debug)
-    if results == []:
-        #create the mapping
-        instr = '''INSERT DATA {
-        GRAPH <http://metarelate.net/mappings.ttl> {
-        <%s> a mr:Mapping ;
-                    %s
-                    mr:saveCache "True" .
-        }
-        }
-        ''' % (mapping, search_string)
-        insert_results = fuseki_process.run_query(instr, update=True,
-                                                  debug=debug)
+    <%s> rdf:type mr:Mapping .
+    } }
+    } ;
+    DELETE
+    { GRAPH <http://metarelate.net/current> {
+    ?replaced rdf:type mr:CurrentMapping .
+    } }
+    WHERE
+    { GRAPH <http://metarelate.net/mappings.ttl> {
+    <%s> dc:replaces ?replaced .
+    } } ;
+    INSERT
+    { GRAPH <http://metarelate.net/current> {
+    <%s> rdf:type mr:CurrentMapping .
+    } }
+    WHERE
+    { GRAPH <http://metarelate.net/mappings.ttl> {
+    <%s> mr:status ?status .
+    FILTER (?status NOT IN ("Deprecated", "Broken"))
+    FILTER NOT EXISTS {?anothermap dc:replaces <%s> .}
+    } }
+    ''' % (mapping, search_string, mapping, mapping, mapping, mapping,
+           mapping)
+    insert_results = fuseki_process.run_query(instr, update=True,
+                                              debug=debug)
     return [{'map':'<{}>'.format(mapping)}]
 
 
+def stored_statements(fuseki_process, graph, rdf_type, key_pred, keys,
+                      debug=False):
+    """
+    return the statements, ?record ?p ?o, of the records of the rdf_type
+    in the graph whose key_pred is one of the keys
+
+    Args:
+
+    * graph:
+        the URI of the graph being queried
+    * rdf_type:
+        the type of the records, e.g. 'mr:Property'
+    * key_pred:
+        the predicate selecting the records, e.g. 'mr:name'
+    * keys:
+        a collection of the URIs, of the form '<uri>', to select
+
+    """
+    qstr = '''SELECT ?record ?p ?o
+    WHERE {
+    GRAPH <%s> {
+        ?record rdf:type %s ;
+                %s ?key ;
+                ?p ?o .
+        FILTER(?key IN (%%s))
+        }
+    }
+    ''' % (graph, rdf_type, key_pred)
+    return _retrieve_batch(fuseki_process, qstr, keys, debug)
+
+
+def insert_records(fuseki_process, graph, records, debug=False):
+    """
+    insert a list of records, each a string of turtle statements
+    about a single subject, into the graph in one update
+
+    """
+    instr = '''INSERT DATA {
+    GRAPH <%s> {
+    %s
+    }
+    }
+    ''' % (graph, '\n'.join(records))
+    return fuseki_process.run_query(instr, update=True, debug=debug)
+
+
 def get_mapping_by_id(fuseki_process, map_id, val=True, rep=True, debug=False):
     """
     return a mapping record if one exists,
@@ -984,10 +1201,13 @@ def get_mapping_by_id(fuseki_process, map_id, val=True, rep=True, debug=False):
     
     """
     vstr = ''
-    if val:
+    if val and rep:
+        vstr += '\tFILTER EXISTS {GRAPH <http://metarelate.net/current> {'\
+                '\n\t    ?mapping rdf:type mr:CurrentMapping .}}'
+    elif val:
         vstr += '\tFILTER (?status NOT IN ("Deprecated", "Broken"))'
-    if rep:
-        vstr += '\n\tMINUS {?mapping ^dc:replaces+ ?anothermap}'
+    elif rep:
+        vstr += '\tFILTER NOT EXISTS {?anothermap dc:replaces ?mapping .}'
     qstr = '''SELECT ?mapping ?source ?target ?invertible ?replaces ?status
                      ?note ?reason ?date ?creator ?inverted
     (GROUP_CONCAT(DISTINCT(?owner); SEPARATOR = '&') AS ?owners)
@@ -1027,180 +1247,280 @@ def get_mapping_by_id(fuseki_process, map_id, val=True, rep=True, debug=False):
 
 ###validation rules
 
+def current_mapping_links(fuseki_process, debug=False):
+    """
+    returns the source, target and invertible flag of every
+    current mapping
+
+    """
+    qstr = '''SELECT ?mapping ?source ?target ?invertible
+    WHERE {
+    GRAPH <http://metarelate.net/current> {
+    ?mapping rdf:type mr:CurrentMapping .
+    }
+    GRAPH <http://metarelate.net/mappings.ttl> {
+    ?mapping mr:source ?source ;
+             mr:target ?target .
+    OPTIONAL {?mapping mr:invertible ?invertible .}
+    }
+    }
+    '''
+    results = fuseki_process.run_query(qstr, debug=debug, stream=True)
+    return results
+
+def component_members(fuseki_process, debug=False):
+    """
+    returns the format of every component, with one result for each
+    of the component's properties and sub components, and the member's
+    rdf:value if it has one
+
+    """
+    qstr = '''SELECT ?component ?format ?member ?value
+    WHERE {
+    GRAPH <http://metarelate.net/concepts.ttl> {
+    ?component mr:hasFormat ?format .
+    OPTIONAL {?component mr:hasProperty|mr:hasComponent ?member .
+              OPTIONAL {?member rdf:value ?value .}
+    }
+    }
+    }
+    '''
+    results = fuseki_process.run_query(qstr, debug=debug, stream=True)
+    return results
+
+def cached_mapping_links(fuseki_process, debug=False):
+    """
+    returns the source and target of every mapping flagged with
+    the saveCache predicate, and of every mapping they replace
+
+    """
+    qstr = '''SELECT DISTINCT ?mapping ?source ?target
+    WHERE {
+    GRAPH <http://metarelate.net/mappings.ttl> {
+    ?cached rdf:type mr:Mapping ;
+            mr:saveCache "True" ;
+            dc:replaces? ?mapping .
+    ?mapping mr:source ?source ;
+             mr:target ?target .
+    }
+    }
+    '''
+    results = fuseki_process.run_query(qstr, debug=debug)
+    return results
+
 def multiple_mappings(fuseki_process, test_source=None, debug=False):
     """
     returns all the mappings which map the same source to a different target
     where the targets are the same format
-    filter to a single test mapping with test_map
+    filter to a single test source with test_source, or to a
+    collection of sources
+
+    The current mappings and their components are retrieved once and
+    grouped by source and target format, so the ambiguous mappings are
+    found in a single pass; the signature of each pair concatenates the
+    values of the members of the first mapping's source and target,
+    which must have a member, as a GROUP_CONCAT of them would.
     
     """
-    tm_filter = ''
-    if test_source:
-        pattern = '<http.*>'
-        pattern = re.compile(pattern)
-        if pattern.match(test_source):
-            tm_filter = '\n\tFILTER(?asource = {})'.format(test_source)
-    qstr = '''SELECT ?amap ?asource ?atarget ?bmap ?bsource ?btarget
-    (GROUP_CONCAT(DISTINCT(?value); SEPARATOR='&') AS ?signature)
+    sources = None
+    if isinstance(test_source, basestring):
+        if re.match('<http.*>', test_source):
+            sources = set([test_source])
+    elif test_source is not None:
+        sources = set(test_source)
+        if not sources:
+            return []
+    # component: (format, set of member values, has members)
+    components = {}
+    for result in component_members(fuseki_process, debug=debug):
+        comp = components.setdefault(result['component'],
+                                     (result['format'], set(), []))
+        if result.get('member'):
+            comp[2].append(result['member'])
+        if result.get('value'):
+            comp[1].add(result['value'])
+    # (source, target format): set of (mapping, target)
+    groups = collections.defaultdict(set)
+    for result in current_mapping_links(fuseki_process, debug=debug):
+        links = [(result['source'], result['target'])]
+        if result.get('invertible') == '"True"':
+            links.append((result['target'], result['source']))
+        for source, target in links:
+            if source not in components or target not in components:
+                continue
+            if sources is not None and source not in sources:
+                continue
+            groups[(source, components[target][0])].add((result['mapping'],
+                                                         target))
+    results = []
+    for source, tformat in sorted(groups):
+        members = sorted(groups[(source, tformat)])
+        if len(set([target for amap, target in members])) < 2:
+            continue
+        for amap, atarget in members:
+            if not (components[source][2] or components[atarget][2]):
+                continue
+            signature = _group_concat(components[source][1].union(
+                components[atarget][1]))
+            for bmap, btarget in members:
+                if bmap != amap and btarget != atarget:
+                    results.append({'amap': amap, 'asource': source,
+                                    'atarget': atarget, 'bmap': bmap,
+                                    'bsource': source, 'btarget': btarget,
+                                    'signature': signature})
+    return results
+
+def vocabulary_subjects(fuseki_process, debug=False):
+    """
+    returns a generator of every URI which is the subject of a statement
+    in the third party vocabulary graphs; these are the URIs declared
+    by the vocabularies
+
+    """
+    qstr = '''
+    SELECT DISTINCT ?subject
     WHERE {
-    GRAPH <http://metarelate.net/mappings.ttl> { {
-    ?amap mr:status ?astatus ;
-         mr:source ?asource ;
-         mr:target ?atarget . } 
-    UNION 
-        { 
-    ?amap mr:invertible "True" ;
-         mr:status ?astatus ;
-         mr:target ?asource ;
-         mr:source ?atarget . } 
-    FILTER (?astatus NOT IN ("Deprecated", "Broken"))
-    MINUS {?amap ^dc:replaces+ ?anothermap} %s
-    } 
-    GRAPH <http://metarelate.net/mappings.ttl> { {
-    ?bmap mr:status ?bstatus ;
-         mr:source ?bsource ;
-         mr:target ?btarget . } 
-    UNION  
-        { 
-    ?bmap mr:invertible "True" ;
-         mr:status ?bstatus ;
-         mr:target ?bsource ;
-         mr:source ?btarget . } 
-    FILTER (?bstatus NOT IN ("Deprecated", "Broken"))
-    MINUS {?bmap ^dc:replaces+ ?bnothermap}
-    filter (?bmap != ?amap)
-    filter (?bsource = ?asource)
-    filter (?btarget != ?atarget)
-    } 
-    GRAPH <http://metarelate.net/concepts.ttl> {
-    ?asource mr:hasFormat ?asourceformat .
-    ?bsource mr:hasFormat ?bsourceformat .
-    ?atarget mr:hasFormat ?atargetformat .
-    ?btarget mr:hasFormat ?btargetformat .
+    GRAPH ?g { ?subject ?p ?o . }
+    FILTER(ISURI(?subject))
+    FILTER(?g IN (%s))
     }
-    filter (?btargetformat = ?atargetformat)
-    GRAPH <http://metarelate.net/concepts.ttl> { {
-    ?asource mr:hasProperty ?prop . }
-    UNION {
-    ?atarget mr:hasProperty ?prop . }
-    UNION {
-    ?asource mr:hasComponent|mr:hasProperty ?prop . }
-    UNION {
-    ?atarget mr:hasComponent|mr:hasProperty ?prop . }
-    UNION { 
-    ?asource mr:hasProperty|mr:hasComponent|mr:hasProperty ?prop . }
-    UNION { 
-    ?atarget mr:hasProperty|mr:hasComponent|mr:hasProperty ?prop . }
-    OPTIONAL { ?prop rdf:value ?value . }
-    } }
-    GROUP BY ?amap ?asource ?atarget ?bmap ?bsource ?btarget
-    ORDER BY ?asource
-    ''' % tm_filter
-    results = fuseki_process.run_query(qstr, debug=debug)
+    ''' % ', '.join(_vocab_graphs())
+    results = fuseki_process.run_query(qstr, debug=debug, stream=True)
     return results
 
-def valid_vocab(fuseki_process, debug=False):
+def component_vocabulary(fuseki_process, debug=False):
     """
-    find all valid mapping and every property they reference
+    returns a generator of Rows of the URIs used as the name, operator
+    or value of each component's properties
 
     """
     qstr = '''
-    SELECT DISTINCT  ?amap 
-    (GROUP_CONCAT(DISTINCT(?vocab); SEPARATOR = '&') AS ?signature)
-    WHERE {      
-    GRAPH <http://metarelate.net/mappings.ttl> { {  
-    ?amap mr:status ?astatus ; 
-    FILTER (?astatus NOT IN ("Deprecated", "Broken")) 
-    MINUS {?amap ^dc:replaces+ ?anothermap}      }
-    { 
-    ?amap mr:source ?fc .      }
-    UNION {
-    ?amap mr:target ?fc .      } } 
+    SELECT DISTINCT ?component ?vocab
+    WHERE {
     GRAPH <http://metarelate.net/concepts.ttl> { {
-    ?fc mr:hasProperty ?prop . }
+    ?component mr:hasProperty ?prop . }
     UNION {
-    ?fc mr:hasComponent|mr:hasProperty ?prop . }
-    UNION { 
-    ?fc mr:hasProperty|mr:hasComponent|mr:hasProperty ?prop .
-    }
+    ?component mr:hasComponent|mr:hasProperty ?prop . }
+    UNION {
+    ?component mr:hasProperty|mr:hasComponent|mr:hasProperty ?prop . }
     { ?prop mr:name ?vocab . }
     UNION {
     ?prop mr:operator ?vocab . }
     UNION {
     ?prop rdf:value ?vocab . }
     FILTER(ISURI(?vocab))  }
-    OPTIONAL {GRAPH ?g{?vocab ?p ?o .} }
-    FILTER(!BOUND(?g))      }
-    GROUP BY ?amap
+    }
     '''
-    results = fuseki_process.run_query(qstr, debug=debug)
+    results = fuseki_process.run_query(qstr, debug=debug, stream=True,
+                                       rows=True)
+    return results
+
+def valid_vocab(fuseki_process, mappings=None, debug=False):
+    """
+    find all valid mapping and every property they reference
+    optionally only for a collection of mapping ids
+
+    Each URI a mapping's components use is looked up in the
+    fuseki_process's vocabulary, a set of the declared URIs,
+    returning the mappings which use undeclared URIs, with the
+    undeclared URIs as their signature.
+
+    """
+    if mappings is not None:
+        mappings = set(mappings)
+        if not mappings:
+            return []
+    declared = fuseki_process.vocabulary()
+    undeclared = collections.defaultdict(set)
+    for row in component_vocabulary(fuseki_process, debug=debug):
+        vocab = row['vocab'].n3
+        if vocab not in declared:
+            undeclared[row['component'].n3].add(vocab)
+    # mapping: set of undeclared URIs
+    invalid = collections.defaultdict(set)
+    for result in current_mapping_links(fuseki_process, debug=debug):
+        if mappings is not None and result['mapping'] not in mappings:
+            continue
+        for role in ['source', 'target']:
+            invalid[result['mapping']].update(undeclared.get(result[role],
+                                                             []))
+    results = []
+    for amap in sorted(invalid):
+        signature = sorted(invalid[amap])
+        if len(signature) == 1:
+            signature = signature[0]
+        if signature:
+            results.append({'amap': amap, 'signature': signature})
     return results
 
 #### search queries ###
 
+def component_properties(fuseki_process, names=None, debug=False):
+    """
+    returns the name, operator and value of each of the properties of
+    every component, including the properties of its sub components,
+    optionally only for properties with one of a collection of names
+
+    """
+    fstr = ''
+    if names:
+        fstr = 'FILTER(?name IN ({}))'.format(', '.join(names))
+    qstr = '''SELECT DISTINCT ?component ?name ?operator ?value
+    WHERE {
+    GRAPH <http://metarelate.net/concepts.ttl> { {
+    ?component mr:hasProperty ?property
+    }
+    UNION {
+    ?component mr:hasComponent/mr:hasProperty ?property
+    }
+    UNION {
+    ?component mr:hasProperty/mr:hasComponent/mr:hasProperty ?property
+    }
+    ?property mr:name ?name .
+    OPTIONAL{?property rdf:value ?value . }
+    OPTIONAL{?property mr:operator ?operator . }
+    %s
+    }
+    }
+    ''' % fstr
+    results = fuseki_process.run_query(qstr, debug=debug, stream=True)
+    return results
+
 def mapping_by_properties(fuseki_process, prop_list, debug=False):
     """
     Return the mapping id's which contain all of the proerties
     in the list of property dictionaries
+
+    The properties of the components are retrieved in one query and
+    matched against every property dictionary, so the number of
+    queries does not depend on the number of properties.  Names,
+    operators and values are compared as queries return them, see
+    query_form, so a number matches whether it is stored as a number
+    or as a quoted literal.
     
     """
-    mapping = None
+    constraints = []
     for prop_dict in prop_list:
-        fstr = ''
-        name = prop_dict.get('mr:name')
-        op = prop_dict.get('mr:operator')
-        value = prop_dict.get('rdf:value')
-        if name:
-            fstr += '\tFILTER(?name = {})\n'.format(name)
-        if op:
-            fstr += '\tFILTER(?operator = {})\n'.format(op)
-        if value:
-            fstr += '\tFILTER(?value = {})\n'.format(value)
-            
-        qstr = '''SELECT DISTINCT ?mapping 
-        WHERE {
-        GRAPH <http://metarelate.net/mappings.ttl> {    
-        ?mapping rdf:type mr:Mapping ;
-                 mr:source ?source ;
-                 mr:target ?target ;
-                 mr:status ?status ;
-
-        FILTER (?status NOT IN ("Deprecated", "Broken"))
-        MINUS {?mapping ^dc:replaces+ ?anothermap}
-        }
-        GRAPH <http://metarelate.net/concepts.ttl> { {
-        ?source mr:hasProperty ?property
-        }
-        UNION {
-        ?target mr:hasProperty ?property
-        }
-        UNION {
-        ?source mr:hasComponent/mr:hasProperty ?property
-        }
-        UNION {
-        ?target mr:hasComponent/mr:hasProperty ?property
-        }
-        UNION {
-        ?source mr:hasProperty/mr:hasComponent/mr:hasProperty ?property
-        }
-        UNION {
-        ?target mr:hasProperty/mr:hasComponent/mr:hasProperty ?property
-        }
-        ?property mr:name ?name .
-        OPTIONAL{?property rdf:value ?value . }
-        OPTIONAL{?property mr:operator ?operator . }
-        %s
-        }
-        }
-        ''' % fstr
-        results = fuseki_process.run_query(qstr, debug=debug)
-        #print results
-        maps = set([r['mapping'] for r in results])
-        if not mapping:
-            mappings = maps
-        else:
-            mappings.intersection_update(maps)
-    #print mappings
+        constraint = [(key, query_form(prop_dict[pred])) for key, pred in
+                      [('name', 'mr:name'), ('operator', 'mr:operator'),
+                       ('value', 'rdf:value')] if prop_dict.get(pred)]
+        constraints.append(constraint)
+    if not constraints:
+        return set()
+    names = [dict(required).get('name') for required in constraints]
+    if not all(names):
+        names = None
+    # the components containing a property matching each constraint
+    matches = [set() for required in constraints]
+    for result in component_properties(fuseki_process, names, debug=debug):
+        for i, constraint in enumerate(constraints):
+            if all([result.get(key) == obj for key, obj in constraint]):
+                matches[i].add(result['component'])
+    mappings = set()
+    for result in current_mapping_links(fuseki_process, debug=debug):
+        components = (result['source'], result['target'])
+        if all([match.intersection(components) for match in matches]):
+            mappings.add(result['mapping'])
     return mappings
 
 
@@ -1254,9 +1574,10 @@ def select_graph(fuseki_process, graph, debug=False):
 
 
 
-def subject_by_graph(fuseki_process, graph, debug=False):
+def subject_by_graph(fuseki_process, graph, debug=False, stream=False):
     """
     selects distinct subject from a particular graph
+    if stream is True the results are returned as a generator
     
     """
     qstr = '''
@@ -1268,7 +1589,7 @@ def subject_by_graph(fuseki_process, graph, debug=False):
 
     ''' % graph
     
-    results = fuseki_process.run_query(qstr, debug=debug)
+    results = fuseki_process.run_query(qstr, debug=debug, stream=stream)
     return results
 
 def subject_graph_pattern(fuseki_process, graph,pattern,debug=False):
@@ -0,0 +1,117 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import metocean.bulk as bulk
+
+
+UM = '<http://www.metarelate.net/metOcean/format/um>'
+CF = '<http://www.metarelate.net/metOcean/format/cf>'
+EQ = '<http://www.openmath.org/cd/relation1.xhtml#eq>'
+
+
+def _linkage(code):
+    source = {'mr:hasFormat': UM,
+              'mr:hasProperty': [{'mr:name': '<http://x/stash>',
+                                  'mr:operator': EQ,
+                                  'rdf:value': '<http://x/{}>'.format(code)}]}
+    target = {'mr:hasFormat': CF,
+              'mr:hasProperty': [{'mr:name': '<http://x/standard_name>',
+                                  'mr:operator': EQ,
+                                  'rdf:value': '"name_{}"'.format(code)}]}
+    return {'mr:source': source, 'mr:target': target}
+
+
+class TestRecordSet(unittest.TestCase):
+    def setUp(self):
+        self.records = bulk.RecordSet()
+        self.mapping_p_o = {'dc:creator': '<http://x/editor>',
+                            'dc:date': '"2013-01-01T00:00:00"^^xsd:dateTime',
+                            'mr:status': '"Draft"'}
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'concepts.ttl')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_same_content_one_record(self):
+        first = self.records.add_linkage(_linkage(1), self.mapping_p_o)
+        again = self.records.add_linkage(_linkage(1), self.mapping_p_o)
+        self.assertEqual(first, again)
+        # two properties, two components and a mapping
+        self.assertEqual(len(self.records), 5)
+
+    def test_write_ttl_dedup(self):
+        self.records.add_linkage(_linkage(1), self.mapping_p_o)
+        self.assertEqual(self.records.write_ttl(bulk.CONCEPTS, self.path), 4)
+        self.assertEqual(self.records.write_ttl(bulk.CONCEPTS, self.path), 0)
+        self.records.add_linkage(_linkage(2), self.mapping_p_o)
+        self.assertEqual(self.records.write_ttl(bulk.CONCEPTS, self.path), 4)
+        self.assertEqual(bulk.ttl_subjects(self.path),
+                         set(self.records.subjects(bulk.CONCEPTS)))
+
+    def test_write_ttl_prefixed_subjects(self):
+        subject = self.records.add_property({'mr:name': '<http://x/n>'})
+        namespace, local = subject.strip('<>').rsplit('/', 1)
+        with open(self.path, 'w') as ttl:
+            ttl.write('@prefix prop: <{}/> .\n\n'.format(namespace))
+            ttl.write('prop:{}\n      rdf:type mr:Property .\n'.format(local))
+        self.assertEqual(self.records.write_ttl(bulk.CONCEPTS, self.path), 0)
+
+    def test_write_ttl_matches_ids_only(self):
+        self.records.add_property({'mr:name': '<http://x/n>'})
+        with open(self.path, 'w') as ttl:
+            ttl.write('<http://x/legacy>\n      rdf:type mr:Property ;\n'
+                      '      mr:name <http://x/n> .\n')
+        # the same content under a legacy id is written again
+        self.assertEqual(self.records.write_ttl(bulk.CONCEPTS, self.path), 1)
+        self.assertEqual(bulk.ttl_subjects(self.path),
+                         set(['<http://x/legacy>'] +
+                             self.records.subjects(bulk.CONCEPTS)))
+
+
+class TestContent(unittest.TestCase):
+    def test_query_form(self):
+        po_dict = {'mr:name': '<http://x/n>',
+                   'rdf:value': ['"12"', '"a"', '"2013-01-01"^^xsd:date',
+                                 'http://x/v'],
+                   'dc:date': '"2013-01-01T00:00:00"^^xsd:dateTime'}
+        mr = 'http://www.metarelate.net/vocabulary/index.html#'
+        rdf = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+        expected = set([('<%sname>' % mr, '<http://x/n>'),
+                        ('<%svalue>' % rdf, '12'),
+                        ('<%svalue>' % rdf, '"a"'),
+                        ('<%svalue>' % rdf, '"2013-01-01"'),
+                        ('<%svalue>' % rdf, '<http://x/v>')])
+        self.assertEqual(bulk._content(po_dict, ['dc:date']), expected)
+
+    def test_refer(self):
+        po_dict = {'mr:hasProperty': ['<http://x/a>', '<http://x/b>'],
+                   'mr:hasFormat': '<http://x/a>'}
+        ids = {'<http://x/a>': '<http://x/stored>'}
+        self.assertEqual(bulk._refer(po_dict, ids),
+                         {'mr:hasProperty': ['<http://x/stored>',
+                                             '<http://x/b>'],
+                          'mr:hasFormat': '<http://x/stored>'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,643 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import socket
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+import urlparse
+
+try:
+    import rdflib
+except ImportError:
+    rdflib = None
+
+import metocean.fuseki as fuseki
+
+
+STATICDATA = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+                          'staticData')
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """answers every POST with an empty SPARQL JSON result"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length'))
+        form = urlparse.parse_qs(self.rfile.read(length))
+        if self.server.down:
+            # drop the connection unanswered, as a stopped server would
+            self.close_connection = 1
+            return
+        self.server.requests.append((self.path, form))
+        data = json.dumps({'head': {'vars': ['s']},
+                           'results': {'bindings': []}})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/sparql-results+json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        # close a kept alive connection without saying so, as a server
+        # does once the connection has been idle for a while
+        self.close_connection = int(self.server.close_after)
+
+    def log_message(self, *args):
+        pass
+
+
+class _StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """a stand in for a Fuseki server, recording the requests it answers"""
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', 0),
+                                           _StubHandler)
+        self.requests = []
+        self.down = False
+        self.close_after = False
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = fuseki._ConnectionPool('localhost', 3131, 2, 60)
+
+    def test_reuse(self):
+        conn, reused = self.pool.acquire()
+        self.assertFalse(reused)
+        self.pool.release(conn)
+        self.assertEqual(self.pool.acquire(), (conn, True))
+        self.assertEqual(self.pool.statistics(),
+                         {'created': 1, 'reused': 1, 'discarded': 0,
+                          'idle': 0})
+
+    def test_size(self):
+        conns = [self.pool.acquire()[0] for i in range(3)]
+        for conn in conns:
+            self.pool.release(conn)
+        stats = self.pool.statistics()
+        self.assertEqual((stats['idle'], stats['discarded']), (2, 1))
+        # the most recently returned connection is reused first
+        self.assertIs(self.pool.acquire()[0], conns[1])
+
+    def test_idle_eviction(self):
+        old, reused = self.pool.acquire()
+        recent, reused = self.pool.acquire()
+        self.pool.release(old)
+        self.pool.release(recent)
+        # the first connection was returned longer ago than the timeout
+        self.pool._idle[0] = (old, time.time() - 61)
+        self.assertEqual(self.pool.acquire(), (recent, True))
+        stats = self.pool.statistics()
+        self.assertEqual((stats['idle'], stats['discarded']), (0, 1))
+
+    def test_clear(self):
+        self.pool.release(self.pool.acquire()[0])
+        self.pool.clear()
+        self.assertFalse(self.pool.acquire()[1])
+        self.assertEqual(self.pool.statistics()['discarded'], 1)
+
+
+class TestPooledRequests(unittest.TestCase):
+    def setUp(self):
+        self.stub = _StubServer()
+        self.server = fuseki.FusekiServer(self.stub.server_address[1],
+                                          snapshots=None)
+
+    def tearDown(self):
+        self.server._pool.clear()
+        self.stub.close()
+
+    def test_connection_reused(self):
+        for i in range(3):
+            self.assertEqual(self.server.run_query('SELECT ?s {}'), [])
+        stats = self.server.connection_stats()
+        self.assertEqual((stats['created'], stats['reused']), (1, 2))
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_closed_idle_connection_retried(self):
+        self.stub.close_after = True
+        self.assertEqual(self.server.run_query('SELECT ?s {}'), [])
+        # the pooled connection was closed by the server, so the query
+        # is sent again on a new connection
+        self.assertEqual(self.server.run_query('SELECT ?s {}'), [])
+        stats = self.server.connection_stats()
+        self.assertEqual((stats['created'], stats['reused']), (2, 1))
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.server.health()['restarts'], 0)
+
+
+class TestHealth(unittest.TestCase):
+    def setUp(self):
+        self.stub = _StubServer()
+        self.port = self.stub.server_address[1]
+
+    def tearDown(self):
+        self.stub.close()
+
+    def wait_for(self, condition):
+        for i in range(100):
+            if condition():
+                return True
+            time.sleep(0.02)
+        return False
+
+    def test_no_port_probe(self):
+        server = fuseki.FusekiServer(self.port, snapshots=None)
+        probes = []
+        server._check_port = lambda: probes.append(1)
+        server.run_query('SELECT ?s {}')
+        self.assertEqual(probes, [])
+        health = server.health()
+        self.assertTrue(health['alive'])
+        self.assertIsNotNone(health['last_contact'])
+        server._pool.clear()
+
+    def test_heartbeat(self):
+        server = fuseki.FusekiServer(self.port, heartbeat=0.02,
+                                     snapshots=None)
+        server.start()
+        try:
+            self.assertTrue(self.wait_for(lambda: self.stub.requests))
+            path, form = self.stub.requests[0]
+            self.assertEqual(form['query'], ['ASK {}'])
+            # the heartbeat notices the server going down, and does not
+            # restart it
+            self.stub.down = True
+            self.stub.close()
+            self.assertTrue(self.wait_for(
+                lambda: server.health()['alive'] is False))
+            self.assertEqual(server.health()['restarts'], 0)
+        finally:
+            server.stop()
+        self.assertIsNone(server._heartbeat_thread)
+
+    def test_restart_once_on_failure(self):
+        self.stub.close()
+        server = fuseki.FusekiServer(self.port, snapshots=None)
+        calls = []
+        server.start = lambda: calls.append('start')
+        server.stop = lambda: calls.append('stop')
+        self.assertRaises(RuntimeError, server.run_query, 'SELECT ?s {}')
+        self.assertEqual(calls, ['stop', 'start'])
+        self.assertEqual(server.health()['restarts'], 1)
+        self.assertFalse(server.health()['alive'])
+
+
+class TestRecordCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = fuseki._RecordCache(2)
+
+    def test_put_get(self):
+        self.cache.put(('mapping', 'a'), {'id': 'a'}, self.cache.generation)
+        self.assertEqual(self.cache.get(('mapping', 'a')),
+                         (True, {'id': 'a'}))
+        self.assertEqual(self.cache.get(('mapping', 'b')), (False, None))
+
+    def test_least_recently_used_discarded(self):
+        generation = self.cache.generation
+        self.cache.put('a', 1, generation)
+        self.cache.put('b', 2, generation)
+        self.cache.get('a')
+        self.cache.put('c', 3, generation)
+        self.assertEqual(self.cache.get('b'), (False, None))
+        self.assertEqual(self.cache.get('a'), (True, 1))
+
+    def test_read_before_clear_not_stored(self):
+        generation = self.cache.generation
+        self.cache.clear()
+        self.cache.put('a', 1, generation)
+        self.assertEqual(self.cache.get('a'), (False, None))
+
+    def test_read_during_update_not_stored(self):
+        self.cache.begin_update()
+        self.cache.put('a', 1, self.cache.generation)
+        self.assertEqual(self.cache.get('a'), (False, None))
+        self.cache.end_update()
+        self.cache.put('a', 1, self.cache.generation)
+        self.assertEqual(self.cache.get('a'), (True, 1))
+
+    def test_read_before_update_not_stored(self):
+        generation = self.cache.generation
+        self.cache.begin_update()
+        self.cache.end_update()
+        self.cache.put('a', 1, generation)
+        self.assertEqual(self.cache.get('a'), (False, None))
+
+    def test_disabled(self):
+        cache = fuseki._RecordCache(0)
+        cache.put('a', 1, cache.generation)
+        self.assertEqual(cache.get('a'), (False, None))
+
+
+class TestProcessRows(unittest.TestCase):
+    def setUp(self):
+        bindings = [{'s': {'type': 'uri', 'value': 'http://a/1'},
+                     'n': {'type': 'typed-literal', 'value': '3',
+                           'datatype':
+                           'http://www.w3.org/2001/XMLSchema#integer'},
+                     'l': {'type': 'literal',
+                           'value': 'http://a/2&http://a/3'}},
+                    {'s': {'type': 'uri', 'value': 'http://a/1'},
+                     'l': {'type': 'literal', 'value': 'text'},
+                     'd': {'type': 'typed-literal',
+                           'value': '2013-01-01T00:00:00',
+                           'datatype':
+                           'http://www.w3.org/2001/XMLSchema#dateTime'}},
+                    {'s': {'type': 'uri', 'value': 'http://a/4'},
+                     'l': {'type': 'literal', 'value': 'texte',
+                           'xml:lang': 'fr'},
+                     'n': {'type': 'literal', 'value': '2.5'}}]
+        self.data = json.dumps({'head': {'vars': ['s', 'n', 'l', 'd']},
+                                'results': {'bindings': bindings}})
+
+    def test_terms(self):
+        rows = fuseki.process_rows(self.data)
+        self.assertEqual(rows[0]['s'], fuseki.Term(fuseki.IRI, 'http://a/1',
+                                                   None))
+        self.assertEqual(rows[0]['n'].n3, '3')
+        self.assertEqual(rows[0]['l'].kind, fuseki.MULTI)
+        self.assertEqual(rows[1]['l'].n3, '"text"')
+        self.assertNotIn('n', rows[1])
+        self.assertEqual(rows[1]['d'].n3, '"2013-01-01T00:00:00"')
+        self.assertEqual(rows[2]['l'].language, 'fr')
+        self.assertEqual(rows[2]['l'].n3, '"texte"')
+        self.assertEqual(rows[2]['n'].n3, '2.5')
+
+    def test_as_process_data(self):
+        rows = fuseki.process_rows(self.data)
+        self.assertEqual([row.as_dict() for row in rows],
+                         fuseki.process_data(self.data))
+
+    def test_unchanged_term_shared(self):
+        rows = fuseki.process_rows(self.data)
+        self.assertIs(rows[0]['s'], rows[1]['s'])
+
+    def test_stream(self):
+        rows = list(fuseki.process_row_stream([self.data[:20],
+                                               self.data[20:]]))
+        self.assertEqual(rows, fuseki.process_rows(self.data))
+
+
+class TestLoad(unittest.TestCase):
+    def test_refuse_unowned_server(self):
+        listener = socket.socket()
+        listener.bind(('localhost', 0))
+        listener.listen(1)
+        try:
+            server = fuseki.FusekiServer(listener.getsockname()[1],
+                                         snapshots=None)
+            self.assertRaises(RuntimeError, server.load)
+        finally:
+            listener.close()
+
+    def test_snapshot_restore_one_generation(self):
+        folder = tempfile.mkdtemp()
+        saved = fuseki.STATICDATA, fuseki.TDB
+        try:
+            fuseki.STATICDATA = os.path.join(folder, 'staticData')
+            fuseki.TDB = os.path.join(folder, 'tdb') + os.sep
+            os.makedirs(fuseki.STATICDATA)
+            os.makedirs(fuseki.TDB)
+            snapshots = os.path.join(folder, 'snapshots')
+            key = fuseki._manifest_key(fuseki._static_manifest())
+            os.makedirs(os.path.join(snapshots, key))
+            with open(os.path.join(snapshots, key, 'node.dat'), 'w') as tdb:
+                tdb.write('tdb')
+            listener = socket.socket()
+            listener.bind(('localhost', 0))
+            port = listener.getsockname()[1]
+            listener.close()
+            server = fuseki.FusekiServer(port, snapshots=snapshots)
+            generation = server.generation()
+            server.load()
+            self.assertEqual(server.generation(), generation + 1)
+            self.assertTrue(os.path.exists(os.path.join(fuseki.TDB,
+                                                        'node.dat')))
+        finally:
+            fuseki.STATICDATA, fuseki.TDB = saved
+            shutil.rmtree(folder)
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.saved = fuseki.TDB
+        fuseki.TDB = os.path.join(self.folder, 'tdb') + os.sep
+        os.makedirs(fuseki.TDB)
+        self.snapshots = os.path.join(self.folder, 'snapshots')
+        self.server = fuseki.FusekiServer(3131, snapshots=self.snapshots,
+                                          snapshot_limit=10)
+
+    def tearDown(self):
+        fuseki.TDB = self.saved
+        shutil.rmtree(self.folder)
+
+    def write_tdb(self, content):
+        with open(os.path.join(fuseki.TDB, 'node.dat'), 'w') as tdb:
+            tdb.write(content)
+
+    def read_tdb(self):
+        with open(os.path.join(fuseki.TDB, 'node.dat')) as tdb:
+            return tdb.read()
+
+    def test_store_restore(self):
+        self.write_tdb('first')
+        self.server._store_snapshot('a')
+        self.write_tdb('second')
+        self.assertTrue(self.server._restore_snapshot('a'))
+        self.assertEqual(self.read_tdb(), 'first')
+        self.assertFalse(self.server._restore_snapshot('b'))
+        self.assertEqual(self.read_tdb(), 'first')
+
+    def test_least_recently_used_removed(self):
+        for key, age in [('a', 200), ('b', 100)]:
+            self.write_tdb(key * 4)
+            self.server._store_snapshot(key)
+            # order the snapshots' use, as the clock may not have moved
+            os.utime(os.path.join(self.snapshots, key),
+                     (time.time() - age, time.time() - age))
+        self.server._restore_snapshot('a')
+        self.write_tdb('cccc')
+        self.server._store_snapshot('c')
+        # the limit holds two snapshots, and 'a' was used after 'b'
+        self.assertEqual(sorted(os.listdir(self.snapshots)), ['a', 'c'])
+
+
+class TestBackgroundValidation(unittest.TestCase):
+    def setUp(self):
+        self.server = fuseki.FusekiServer(3131, snapshots=None)
+        self.release = threading.Event()
+        self.checked = []
+        self.server.validate = self.validate
+        self.server._note_cached_mappings = lambda: None
+
+    # the results, or the error, of the validation
+    outcome = {}
+
+    def validate(self, progress=None, touched=None):
+        self.checked.append(touched)
+        progress(0, 'check')
+        self.release.wait(5)
+        if isinstance(self.outcome, Exception):
+            raise self.outcome
+        return self.outcome
+
+    def wait(self):
+        for i in range(250):
+            status = self.server.validation_status()
+            if not status['running']:
+                return status
+            time.sleep(0.02)
+        self.fail('the validation did not finish')
+
+    def test_status(self):
+        self.assertTrue(self.server.start_validation())
+        status = self.server.validation_status()
+        self.assertTrue(status['running'])
+        # a second validation is not started while one runs
+        self.assertFalse(self.server.start_validation())
+        self.release.set()
+        status = self.wait()
+        self.assertEqual(status['results'], {})
+        self.assertEqual(status['completed'], status['checks'])
+        self.assertTrue(status['current'])
+        self.assertIsNone(status['error'])
+        self.assertEqual(self.checked, [None])
+        self.server._invalidate()
+        self.assertFalse(self.server.validation_status()['current'])
+
+    def test_error(self):
+        self.outcome = RuntimeError('server down')
+        self.release.set()
+        self.server.start_validation()
+        status = self.wait()
+        self.assertEqual(status['error'], 'server down')
+        self.assertIsNone(status['results'])
+
+    def validated(self, incremental=False):
+        self.release.set()
+        self.server.start_validation(incremental)
+        return self.wait()
+
+    def test_incremental(self):
+        ambiguous, undeclared = [validation[0] for validation in
+                                 fuseki._VALIDATIONS]
+        self.outcome = {ambiguous: [{'asource': '<s1>'}, {'asource': '<s2>'}],
+                        undeclared: [{'amap': '<m1>'}, {'amap': '<m2>'}]}
+        self.validated(incremental=True)
+        # the changes since the first validation
+        self.server._touched['mappings'].add('<m1>')
+        self.server._touched['sources'].add('<s1>')
+        self.outcome = {ambiguous: [],
+                        undeclared: [{'amap': '<m1>', 'signature': 'x'}]}
+        status = self.validated(incremental=True)
+        self.assertEqual(self.checked, [None, {'mappings': set(['<m1>']),
+                                               'sources': set(['<s1>'])}])
+        self.assertTrue(status['incremental'])
+        self.assertEqual(status['results'],
+                         {ambiguous: [{'asource': '<s2>'}],
+                          undeclared: [{'amap': '<m1>', 'signature': 'x'},
+                                       {'amap': '<m2>'}]})
+
+    def test_reload_validates_all(self):
+        self.validated(incremental=True)
+        self.server._reloaded()
+        status = self.validated(incremental=True)
+        self.assertEqual(self.checked, [None, None])
+        self.assertFalse(status['incremental'])
+
+
+
+class _FakeTDB(object):
+    """collects the updates run against the TDB, as _TDBUpdate does"""
+    updates = []
+
+    def run_query(self, query_string, output='json', update=False,
+                  debug=False):
+        self.updates.append(' '.join(query_string.split()))
+        return ''
+
+    def commit(self):
+        pass
+
+
+class TestIncrementalLoad(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.saved = (fuseki.STATICDATA, fuseki.TDB, fuseki.MANIFEST,
+                      fuseki._load_graphs, fuseki._TDBUpdate)
+        fuseki.STATICDATA = os.path.join(self.folder, 'staticData')
+        fuseki.TDB = os.path.join(self.folder, 'tdb') + os.sep
+        fuseki.MANIFEST = os.path.join(fuseki.TDB, 'staticData.manifest')
+        self.loaded = []
+        fuseki._load_graphs = self.loaded.append
+        fuseki._TDBUpdate = _FakeTDB
+        _FakeTDB.updates = []
+        os.makedirs(fuseki.TDB)
+        for graph in ('um/stash.ttl', 'metarelate.net/mappings.ttl'):
+            self.write(graph, '<http://x/s> <http://x/p> <http://x/o> .\n')
+        self.server = fuseki.FusekiServer(3131, snapshots=None)
+
+    def tearDown(self):
+        (fuseki.STATICDATA, fuseki.TDB, fuseki.MANIFEST,
+         fuseki._load_graphs, fuseki._TDBUpdate) = self.saved
+        shutil.rmtree(self.folder)
+
+    def write(self, graph, content):
+        path = os.path.join(fuseki.STATICDATA, graph)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as ttl:
+            ttl.write(content)
+
+    def load(self, incremental):
+        manifest = fuseki._static_manifest()
+        del self.loaded[:]
+        del _FakeTDB.updates[:]
+        self.server._load_tdb(manifest, fuseki._manifest_key(manifest),
+                              incremental)
+        return sorted(self.loaded[0])
+
+    def test_first_load_complete(self):
+        with open(os.path.join(fuseki.TDB, 'node.dat'), 'w') as tdb:
+            tdb.write('tdb')
+        self.assertEqual(self.load(True),
+                         ['http://metarelate.net/mappings.ttl',
+                          'http://um/stash.ttl'])
+        self.assertEqual(os.listdir(fuseki.TDB), ['staticData.manifest'])
+
+    def test_changed_graphs_reloaded(self):
+        self.load(True)
+        self.assertEqual(self.load(True), [])
+        self.write('um/stash.ttl', '<http://x/s> <http://x/p> "changed" .\n')
+        self.assertEqual(self.load(True), ['http://um/stash.ttl'])
+        updates = _FakeTDB.updates
+        self.assertEqual(updates[0], 'DROP SILENT GRAPH <http://um/stash.ttl>')
+        # the unsaved changes in the unchanged metarelate.net graph are
+        # reverted, and the current mappings rebuilt
+        self.assertIn('mr:saveCache "True"', updates[1])
+        self.assertIn('<http://metarelate.net/mappings.ttl>', updates[1])
+        self.assertIn('<http://metarelate.net/current>', updates[2])
+        self.assertEqual(len(updates), 3)
+
+    def test_added_and_removed_graphs(self):
+        self.load(True)
+        self.write('CF/names.ttl', '<http://x/n> <http://x/p> "new" .\n')
+        os.remove(os.path.join(fuseki.STATICDATA, 'um', 'stash.ttl'))
+        self.assertEqual(self.load(True), ['http://CF/names.ttl'])
+        self.assertEqual(_FakeTDB.updates[:2],
+                         ['DROP SILENT GRAPH <http://CF/names.ttl>',
+                          'DROP SILENT GRAPH <http://um/stash.ttl>'])
+        self.assertEqual(sorted(fuseki._read_manifest()),
+                         ['http://CF/names.ttl',
+                          'http://metarelate.net/mappings.ttl'])
+
+    def test_not_incremental(self):
+        self.load(True)
+        self.assertEqual(self.load(False),
+                         ['http://metarelate.net/mappings.ttl',
+                          'http://um/stash.ttl'])
+        # a new TDB needs nothing dropped
+        self.assertEqual(len(_FakeTDB.updates), 1)
+
+
+class TestTrigLoad(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.trig = os.path.join(self.folder, 'load.trig')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def ttl(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as ttl:
+            ttl.write(content)
+        return path
+
+    @unittest.skipIf(rdflib is None, 'requires rdflib')
+    def test_staticdata_graphs(self):
+        files = ['CF/cfmodel.ttl', 'grib/apikeys.ttl', 'grib/codesflags.ttl',
+                 'metarelate.net/contacts.ttl', 'openmath/ops.ttl',
+                 'um/umdpF3.ttl']
+        with open(self.trig, 'w') as trig:
+            for name in files:
+                self.assertTrue(fuseki._write_trig_graph(
+                    trig, 'http://%s' % name,
+                    os.path.join(STATICDATA, name)))
+        dataset = rdflib.ConjunctiveGraph()
+        dataset.parse(self.trig, format='trig')
+        for name in files:
+            ttl = rdflib.Graph()
+            ttl.parse(os.path.join(STATICDATA, name), format='turtle')
+            graph = dataset.get_context(rdflib.URIRef('http://%s' % name))
+            self.assertTrue(len(ttl))
+            self.assertEqual(set(graph), set(ttl))
+
+    def test_separate_files(self):
+        blank = self.ttl('blank.ttl', '@prefix x: <http://x/> .\n'
+                         'x:s x:p _:b1 .\n')
+        redeclared = self.ttl('redeclared.ttl', '@prefix x: <http://x/> .\n'
+                              'x:s x:p x:o .\n'
+                              '@prefix x: <http://y/> .\n'
+                              'x:s x:p x:o .\n')
+        with open(self.trig, 'w') as trig:
+            self.assertFalse(fuseki._write_trig_graph(trig, 'http://b',
+                                                      blank))
+            self.assertFalse(fuseki._write_trig_graph(trig, 'http://r',
+                                                      redeclared))
+        self.assertEqual(os.path.getsize(self.trig), 0)
+
+    def test_one_loader_call(self):
+        graph_files = {'http://a': self.ttl('a.ttl', '<http://x/s> '
+                                            '<http://x/p> "a" .\n'),
+                       'http://b': self.ttl('b.ttl', '<http://x/s> '
+                                            '<http://x/p> "b" .\n'),
+                       'http://c': self.ttl('c.ttl', '<http://x/s> '
+                                            '<http://x/p> _:c .\n')}
+        calls = []
+        check_call = fuseki.subprocess.check_call
+        fuseki.subprocess.check_call = calls.append
+        try:
+            fuseki._load_graphs(graph_files)
+        finally:
+            fuseki.subprocess.check_call = check_call
+        self.assertEqual(len(calls), 2)
+        trig = calls[0][-1]
+        self.assertTrue(trig.endswith('.trig'))
+        self.assertFalse(os.path.exists(trig))
+        self.assertEqual(calls[1][1:], ['--graph=http://c',
+                                        '--loc=%s' % fuseki.TDB,
+                                        graph_files['http://c']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import metocean.mapindex as mapindex
+
+
+UM = '<http://www.metarelate.net/metOcean/format/um>'
+CF = '<http://www.metarelate.net/metOcean/format/cf>'
+EQ = '<http://www.openmath.org/cd/relation1.xhtml#eq>'
+STASH = '<http://reference.metoffice.gov.uk/def/um/umdp/F3/stash>'
+LBPROC = '<http://reference.metoffice.gov.uk/def/um/umdp/F3/lbproc>'
+
+
+def _stash(code):
+    return '<http://reference.metoffice.gov.uk/def/um/stash/concept/{}>'\
+           ''.format(code)
+
+def _mapping(number, properties, sub_components=()):
+    source = {'mr:hasProperty': [{'mr:name': name, 'mr:operator': EQ,
+                                  'rdf:value': value}
+                                 for name, value in properties]}
+    if sub_components:
+        source['mr:hasComponent'] = list(sub_components)
+    target = {'mr:hasProperty': [{'mr:name': '<http://x/standard_name>',
+                                  'mr:operator': EQ,
+                                  'rdf:value': '"name_{}"'.format(number)}]}
+    return {'mapping': '<http://x/mapping/{}>'.format(number),
+            'mr:source': source, 'mr:target': target}
+
+
+class TestMappingIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = mapindex.MappingIndex(UM, CF)
+        self.mappings = [
+            _mapping(1, [(STASH, _stash('m01s00i024'))]),
+            _mapping(2, [(STASH, _stash('m01s00i024')), (LBPROC, '128')]),
+            _mapping(3, [(STASH, _stash('m01s16i222'))],
+                     [{'mr:hasProperty': [{'mr:name': LBPROC,
+                                           'mr:operator': EQ,
+                                           'rdf:value': '0'}]}])]
+        for mapping in self.mappings:
+            self.index.add(mapping)
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_lookup(self):
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.targets([(STASH, EQ,
+                                              _stash('m01s00i024'))]),
+                         [self.mappings[0]['mr:target']])
+        self.assertEqual(self.index.lookup([(LBPROC, EQ, '128'),
+                                            (STASH, EQ,
+                                             _stash('m01s00i024'))])[0]
+                         ['mapping'], '<http://x/mapping/2>')
+        self.assertEqual(self.index.lookup([(STASH, EQ, '0')]), [])
+
+    def test_save_load(self):
+        path = os.path.join(self.folder, 'index.json')
+        self.index.save(path)
+        loaded = mapindex.MappingIndex.load(path)
+        self.assertEqual((loaded.s_format, loaded.t_format), (UM, CF))
+        self.assertEqual(len(loaded), len(self.index))
+        for mapping in self.mappings:
+            source = mapping['mr:source']
+            self.assertIn(source, loaded)
+            self.assertEqual(loaded.lookup(source),
+                             self.index.lookup(source))
+
+    def test_multi_valued(self):
+        values = [_stash('m01s00i024'), _stash('m01s00i025')]
+        mapping = _mapping(4, [(STASH, values)])
+        self.index.add(mapping)
+        reordered = _mapping(4, [(STASH, values[::-1])])['mr:source']
+        self.assertEqual(self.index.lookup(reordered)[0]['mapping'],
+                         '<http://x/mapping/4>')
+        self.assertEqual(self.index.lookup([(STASH, EQ, values[::-1])]),
+                         self.index.lookup(reordered))
+        path = os.path.join(self.folder, 'index.json')
+        self.index.save(path)
+        loaded = mapindex.MappingIndex.load(path)
+        self.assertEqual(loaded.lookup(reordered),
+                         self.index.lookup(reordered))
+
+    def test_mediators_ignored(self):
+        source = dict(self.mappings[0]['mr:source'],
+                      **{'dc:mediator': ['<http://x/mediator>'],
+                         'dc:requires': ['<http://x/mapping/2>']})
+        self.assertEqual(mapindex.component_key(source),
+                         mapindex.component_key(self.mappings[0]
+                                                ['mr:source']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,386 @@
+# (C) British Crown Copyright 2011 - 2012, Met Office
+#
+# This file is part of metOcean-mapping.
+#
+# metOcean-mapping is free software: you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# metOcean-mapping is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with metOcean-mapping. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+from rdflib.plugins.sparql import aggregates
+
+import metocean.bulk as bulk
+import metocean.fuseki as fuseki
+import metocean.memory as memory
+import metocean.queries as queries
+
+
+UM = '<http://www.metarelate.net/metOcean/format/um>'
+CF = '<http://www.metarelate.net/metOcean/format/cf>'
+
+STATICDATA = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+                          'staticData')
+
+# the store loaded from the repository's staticData, shared by the tests
+# as loading takes some time
+server = None
+
+
+def setUpModule():
+    global server
+    fuseki.STATICDATA = STATICDATA
+    server = memory.MemoryServer()
+    server.load()
+
+
+class TestRetrieveMappings(unittest.TestCase):
+    def test_mappings(self):
+        mappings = server.retrieve_mappings(UM, CF)
+        self.assertTrue(mappings)
+        for mapping in mappings:
+            self.assertIn('mr:source', mapping)
+            self.assertIn('mr:target', mapping)
+
+    def test_batch_as_single(self):
+        # a sample of the mappings, as retrieving each record in turn
+        # from the in memory store is slow
+        mappings = queries.valid_ordered_mappings(server, UM, CF)[::20]
+        # empty the record cache, so each retrieval reads every record
+        server._invalidate()
+        records = server._prefetch_records(mappings)
+        batched = [server.structured_mapping(mapping, records)
+                   for mapping in mappings]
+        server._invalidate()
+        single = [server.structured_mapping(mapping) for mapping in mappings]
+        self.assertTrue(single)
+        self.assertEqual(batched, single)
+
+    def test_no_empty_components(self):
+        for mapping in server.retrieve_mappings(UM, CF):
+            for role in ('mr:source', 'mr:target'):
+                self.assertNotIn('""', mapping[role].get('mr:hasComponent',
+                                                         []))
+
+
+class TestGroupConcat(unittest.TestCase):
+    def test_empty_concat_unbound(self):
+        qstr = ('SELECT ?s (GROUP_CONCAT(?o; SEPARATOR = "&") AS ?os) '
+                'WHERE { GRAPH <http://metarelate.net/mappings.ttl> '
+                '{ ?s a mr:Mapping . '
+                'OPTIONAL { ?s <http://example.com/none> ?o } } } '
+                'GROUP BY ?s LIMIT 1')
+        results = server.run_query(qstr)
+        self.assertTrue(results)
+        self.assertNotIn('os', results[0])
+
+    def test_unbound_aggregate_skipped(self):
+        store = memory.MemoryServer()
+        store.run_query('INSERT DATA { GRAPH <http://example.com/g> { '
+                        '<http://example.com/s> a mr:Mapping } }',
+                        update=True)
+        use_rows = [vars(aggregate).get('use_row') for aggregate in
+                    (aggregates.Accumulator, aggregates.Counter)]
+        qstr = ('SELECT (COUNT(DISTINCT(?o)) AS ?n) WHERE { GRAPH ?g { '
+                '?s a mr:Mapping . '
+                'OPTIONAL { ?s <http://example.com/none> ?o } } }')
+        self.assertEqual(store.run_query(qstr), [{'n': '0'}])
+        # the aggregates are only wrapped while the query runs
+        self.assertEqual([vars(aggregate).get('use_row') for aggregate in
+                          (aggregates.Accumulator, aggregates.Counter)],
+                         use_rows)
+
+
+class TestFindOrCreate(unittest.TestCase):
+    def test_legacy_record_found(self):
+        server.run_query('INSERT DATA { GRAPH '
+                         '<http://metarelate.net/concepts.ttl> { '
+                         '<http://example.com/legacy> a mr:Value ; '
+                         'mr:subject <http://example.com/subject> ; '
+                         'mr:operator <http://example.com/op> . } }',
+                         update=True)
+        value = queries.get_value(server,
+                                  {'mr:subject': '<http://example.com/subject>',
+                                   'mr:operator': '<http://example.com/op>'})
+        self.assertEqual(value, {'value': '<http://example.com/legacy>'})
+
+    def test_requests(self):
+        requests = []
+        request = server._request
+        def counting(query, output='json', update=False):
+            requests.append(update)
+            return request(query, output, update)
+        server._request = counting
+        try:
+            po_dict = {'mr:subject': '<http://example.com/counted>',
+                       'mr:operator': '<http://example.com/op>'}
+            created = queries.get_value(server, po_dict)
+            # a select, then the insert
+            self.assertEqual(requests, [False, True])
+            del requests[:]
+            revision = server.revision()
+            self.assertEqual(queries.get_value(server, po_dict), created)
+            # a single select, which leaves the revision as it was
+            self.assertEqual(requests, [False])
+            self.assertEqual(server.revision(), revision)
+        finally:
+            del server._request
+
+    def test_created_once(self):
+        po_dict = {'mr:name': '<http://example.com/name>',
+                   'rdf:value': ['"1"', '"2"']}
+        prop = queries.get_property(server, po_dict)
+        po_dict['rdf:value'].reverse()
+        self.assertEqual(queries.get_property(server, po_dict), prop)
+
+
+class TestInsertRecords(unittest.TestCase):
+    def test_legacy_record_matched(self):
+        server.run_query('INSERT DATA { GRAPH '
+                         '<http://metarelate.net/concepts.ttl> { '
+                         '<http://example.com/legacyprop> a mr:Property ; '
+                         'mr:name <http://example.com/bulkname> ; '
+                         'rdf:value "12" . } }',
+                         update=True)
+        records = bulk.RecordSet()
+        prop = records.add_property({'mr:name': '<http://example.com/bulkname>',
+                                     'rdf:value': '"12"'})
+        records.add_component({'mr:hasFormat': UM, 'mr:hasProperty': [prop]})
+        # the component only, referring to the stored property
+        self.assertEqual(records.insert(server),
+                         {bulk.CONCEPTS: 1, bulk.MAPPINGS: 0})
+        qstr = ('SELECT ?property WHERE { GRAPH '
+                '<http://metarelate.net/concepts.ttl> { '
+                '?component mr:hasProperty ?property . '
+                '?property mr:name <http://example.com/bulkname> } }')
+        self.assertEqual(server.run_query(qstr),
+                         [{'property': '<http://example.com/legacyprop>'}])
+        self.assertEqual(records.insert(server),
+                         {bulk.CONCEPTS: 0, bulk.MAPPINGS: 0})
+
+
+class TestMultipleMappings(unittest.TestCase):
+    # sources s1 and s2 map to several cf targets: s1 through m1, m2 and
+    # the inverse of the invertible m3, s2 through m4, to a target with
+    # no members, and m6; m7 is deprecated
+    fixture = """
+    GRAPH <http://metarelate.net/concepts.ttl> {
+    <http://x/s1> mr:hasFormat %(um)s ; mr:hasProperty <http://x/p1> .
+    <http://x/s2> mr:hasFormat %(um)s .
+    <http://x/t1> mr:hasFormat %(cf)s ;
+                  mr:hasProperty <http://x/p2>, <http://x/p3> .
+    <http://x/t2> mr:hasFormat %(cf)s ; mr:hasProperty <http://x/p1> .
+    <http://x/t3> mr:hasFormat %(cf)s .
+    <http://x/t5> mr:hasFormat %(cf)s ;
+                  mr:hasComponent <http://x/p5>, <http://x/p6> .
+    <http://x/p1> mr:name <http://x/name> .
+    <http://x/p2> rdf:value <http://x/v2> .
+    <http://x/p3> rdf:value <http://x/v3> .
+    <http://x/p5> rdf:value "b" .
+    <http://x/p6> rdf:value "c" .
+    }
+    GRAPH <http://metarelate.net/mappings.ttl> {
+    <http://x/m1> a mr:Mapping ; mr:status "Draft" ;
+                  mr:source <http://x/s1> ; mr:target <http://x/t1> .
+    <http://x/m2> a mr:Mapping ; mr:status "Draft" ;
+                  mr:source <http://x/s1> ; mr:target <http://x/t2> .
+    <http://x/m3> a mr:Mapping ; mr:status "Draft" ; mr:invertible "True" ;
+                  mr:source <http://x/t5> ; mr:target <http://x/s1> .
+    <http://x/m4> a mr:Mapping ; mr:status "Draft" ;
+                  mr:source <http://x/s2> ; mr:target <http://x/t3> .
+    <http://x/m6> a mr:Mapping ; mr:status "Draft" ;
+                  mr:source <http://x/s2> ; mr:target <http://x/t1> .
+    <http://x/m7> a mr:Mapping ; mr:status "Deprecated" ;
+                  mr:source <http://x/s1> ; mr:target <http://x/t3> .
+    }
+    """ % {'um': UM, 'cf': CF}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = memory.MemoryServer()
+        cls.server.run_query('INSERT DATA { %s }' % cls.fixture, update=True)
+        queries.refresh_current_mappings(cls.server)
+
+    def test_rows(self):
+        # the rows of the query this replaced, which grouped the pairs
+        # of mappings and concatenated the values of their members
+        sig1 = ['<http://x/v2>', '<http://x/v3>']
+        sig3 = '"b&c"'
+        pairs = [('m1', 's1', 't1', 'm2', 't2', sig1),
+                 ('m1', 's1', 't1', 'm3', 't5', sig1),
+                 ('m2', 's1', 't2', 'm1', 't1', '""'),
+                 ('m2', 's1', 't2', 'm3', 't5', '""'),
+                 ('m3', 's1', 't5', 'm1', 't1', sig3),
+                 ('m3', 's1', 't5', 'm2', 't2', sig3),
+                 ('m6', 's2', 't1', 'm4', 't3', sig1)]
+        expected = [{'amap': '<http://x/%s>' % amap,
+                     'asource': '<http://x/%s>' % source,
+                     'atarget': '<http://x/%s>' % atarget,
+                     'bmap': '<http://x/%s>' % bmap,
+                     'bsource': '<http://x/%s>' % source,
+                     'btarget': '<http://x/%s>' % btarget,
+                     'signature': signature}
+                    for amap, source, atarget, bmap, btarget, signature
+                    in pairs]
+        self.assertEqual(queries.multiple_mappings(self.server), expected)
+
+    def test_source(self):
+        results = queries.multiple_mappings(self.server, '<http://x/s2>')
+        self.assertEqual([(result['amap'], result['bmap'])
+                          for result in results],
+                         [('<http://x/m6>', '<http://x/m4>')])
+
+
+class TestValidVocab(unittest.TestCase):
+    def test_undeclared(self):
+        # the mappings the query this replaced found in the staticData
+        computed = ['<http://reference.metoffice.gov.uk/def/grib/'
+                    'computed_value#%s>' % name
+                    for name in ('_x_circular', '_x_points', '_y_points')]
+        axis = ('<http://def.cfconventions.org/datamodel/attribute_name#'
+                'semi_major_axis>')
+        expected = [('2c82220e463af9172cf98bf99df91de2cf58a13b', computed),
+                    ('3eaf7221354afd1a3ae9bd43cc5f97ed4ee00dac', computed),
+                    ('4a63ee7eb0aec5bbd426fbcf47659439aa059c7d', axis),
+                    ('5d3487aa6591dcc980cda057016af2214327d1d5', computed),
+                    ('bc324e3df82fe0191ac7b478242dc0ab484f7f98', computed),
+                    ('e071c625e511e8ecb6717d90835fe621bc216435', axis),
+                    ('efc0fc2ee887a2f35502280d47cf8efdd189dbaa', axis),
+                    ('fb604b57e8346e89b7a00fb4e752fbe161622109', axis)]
+        expected = [{'amap': '<http://www.metarelate.net/metOcean/mapping/%s>'
+                     % amap, 'signature': signature}
+                    for amap, signature in expected]
+        self.assertEqual(queries.valid_vocab(server), expected)
+
+    def test_mappings(self):
+        amap = ('<http://www.metarelate.net/metOcean/mapping/'
+                '4a63ee7eb0aec5bbd426fbcf47659439aa059c7d>')
+        results = queries.valid_vocab(server, [amap])
+        self.assertEqual([result['amap'] for result in results], [amap])
+
+
+class TestMappingByProperties(unittest.TestCase):
+    fixture = """
+    GRAPH <http://metarelate.net/concepts.ttl> {
+    <http://x/s1> mr:hasFormat %(um)s ;
+                  mr:hasProperty <http://x/iri>, <http://x/number> .
+    <http://x/t1> mr:hasFormat %(cf)s ; mr:hasProperty <http://x/literal> .
+    <http://x/s2> mr:hasFormat %(um)s ; mr:hasComponent <http://x/c2> .
+    <http://x/c2> mr:hasProperty <http://x/string> .
+    <http://x/iri> mr:name <http://x/code> ;
+                   mr:operator <http://x/eq> ;
+                   rdf:value <http://x/v> .
+    <http://x/number> mr:name <http://x/level> ; rdf:value 5 .
+    <http://x/literal> mr:name <http://x/units> ; rdf:value "K" .
+    <http://x/string> mr:name <http://x/level> ; rdf:value "7" .
+    }
+    GRAPH <http://metarelate.net/mappings.ttl> {
+    <http://x/m1> a mr:Mapping ; mr:status "Draft" ;
+                  mr:source <http://x/s1> ; mr:target <http://x/t1> .
+    <http://x/m2> a mr:Mapping ; mr:status "Draft" ;
+                  mr:source <http://x/s2> ; mr:target <http://x/t1> .
+    <http://x/m3> a mr:Mapping ; mr:status "Deprecated" ;
+                  mr:source <http://x/s1> ; mr:target <http://x/t1> .
+    }
+    """ % {'um': UM, 'cf': CF}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = memory.MemoryServer()
+        cls.server.run_query('INSERT DATA { %s }' % cls.fixture, update=True)
+        queries.refresh_current_mappings(cls.server)
+
+    def search(self, *prop_list):
+        return queries.mapping_by_properties(self.server, prop_list)
+
+    def test_iri(self):
+        self.assertEqual(self.search({'mr:name': '<http://x/code>',
+                                      'mr:operator': '<http://x/eq>',
+                                      'rdf:value': '<http://x/v>'}),
+                         set(['<http://x/m1>']))
+        self.assertEqual(self.search({'rdf:value': 'http://x/v'}),
+                         set(['<http://x/m1>']))
+
+    def test_number(self):
+        self.assertEqual(self.search({'mr:name': '<http://x/level>',
+                                      'rdf:value': '5'}),
+                         set(['<http://x/m1>']))
+        # a number stored as a literal, in a sub component
+        self.assertEqual(self.search({'rdf:value': '7'}),
+                         set(['<http://x/m2>']))
+        self.assertEqual(self.search({'rdf:value': '"7"'}),
+                         set(['<http://x/m2>']))
+
+    def test_literal(self):
+        self.assertEqual(self.search({'rdf:value': '"K"'}),
+                         set(['<http://x/m1>', '<http://x/m2>']))
+        self.assertEqual(self.search({'rdf:value': '"K"'},
+                                     {'mr:name': '<http://x/level>'}),
+                         set(['<http://x/m1>', '<http://x/m2>']))
+        self.assertEqual(self.search({'rdf:value': '"K"'},
+                                     {'rdf:value': '5'}),
+                         set(['<http://x/m1>']))
+        self.assertEqual(self.search({'rdf:value': '"k"'}), set())
+
+
+class TestCurrentMappings(unittest.TestCase):
+    def setUp(self):
+        self.server = memory.MemoryServer()
+        self.server.run_query('INSERT DATA { GRAPH '
+                              '<http://metarelate.net/mappings.ttl> { '
+                              '<http://x/m1> a mr:Mapping ; '
+                              'mr:status "Draft" . '
+                              '<http://x/m2> a mr:Mapping ; '
+                              'mr:status "Deprecated" . } }', update=True)
+        queries.refresh_current_mappings(self.server)
+
+    def current(self):
+        qstr = ('SELECT ?mapping WHERE { GRAPH '
+                '<http://metarelate.net/current> { '
+                '?mapping rdf:type mr:CurrentMapping } }')
+        return set([result['mapping'] for result in
+                    self.server.run_query(qstr)])
+
+    def create(self, status, replaces=None):
+        po_dict = {'mr:source': '<http://x/source>',
+                   'mr:target': '<http://x/target>',
+                   'mr:invertible': '"False"', 'mr:status': status,
+                   'mr:reason': '"new mapping"',
+                   'dc:date': '"2013-01-01T00:00:00"^^xsd:dateTime',
+                   'dc:creator': '<http://x/editor>'}
+        if replaces:
+            po_dict['dc:replaces'] = replaces
+        return queries.create_mapping(self.server, po_dict)[0]['map']
+
+    def test_refresh(self):
+        self.assertEqual(self.current(), set(['<http://x/m1>']))
+
+    def test_created_mappings(self):
+        draft = self.create('"Draft"', '<http://x/m1>')
+        # the replaced mapping is no longer current
+        self.assertEqual(self.current(), set([draft]))
+        # a broken mapping is not current, though it replaces one
+        self.create('"Broken"', draft)
+        self.assertEqual(self.current(), set())
+        # the graph is kept as a rebuild would leave it
+        queries.refresh_current_mappings(self.server)
+        self.assertEqual(self.current(), set())
+
+    def test_revert(self):
+        self.create('"Draft"', '<http://x/m1>')
+        self.server.revert()
+        self.assertEqual(self.current(), set(['<http://x/m1>']))
+
+
+if __name__ == '__main__':
+    unittest.main()